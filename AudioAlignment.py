@@ -20,6 +20,8 @@ from SourceFile import SourceFile
 sys.path.append(os.path.dirname(sys.executable))
 
 from MTRConfig import getConfig
+from ProcessEngine import getProcessEngine
+from ScratchSpace import getScratchSpace
 
 audioFiles = set()
 audioExt = ".m4a"
@@ -44,12 +46,11 @@ def getAudioPath(videoPath: str):
 
 
 def readExistingAudioFiles():
+    # the scratch space removes audio that hasn't been used in a while
+    getScratchSpace()
     for root, _, files in os.walk(audioBasepath):
         for file in [os.path.join(root, file) for file in files]:
-            if os.path.getatime(file) < time.time() - 7 * (24 * 60 * 60):
-                os.remove(file)
-            else:
-                audioFiles.add(file)
+            audioFiles.add(file)
     logger.detail(audioFiles)
 
 
@@ -71,11 +72,15 @@ def extractAudio(target_file: str):
             "-y",
             audioPath,
         ]
-        subprocess.check_call(extractCommand,
-                              stderr=subprocess.DEVNULL,
-                              stdout=subprocess.DEVNULL,
-                              stdin=subprocess.DEVNULL)
+        returncode = getProcessEngine().start(extractCommand).wait()
+        if returncode != 0:
+            if os.path.isfile(audioPath):
+                os.remove(audioPath)
+            raise subprocess.CalledProcessError(returncode, extractCommand)
         audioFiles.add(audioPath)
+        getScratchSpace().register(audioPath)
+    else:
+        getScratchSpace().touch(audioPath)
     return audioPath
 
 
@@ -21,6 +21,8 @@ from SharedUtils import calcGameCounts
 from RenderConfig import RenderConfig
 from RenderTask import DEFAULT_PRIORITY, MANUAL_PRIORITY, MAXIMUM_PRIORITY, RenderTask, clearErroredStatuses, deleteRenderStatus, getRenderStatus, getRendersWithStatus, setRenderStatus
 from SessionWorker import getAllStreamingDaysByStreamer
+from ProbeScheduler import prewarmProbeCache
+from RenderTelemetry import formatRenderProgress
 from SourceFile import reloadAndSave
 
 
@@ -53,9 +55,14 @@ commandArray.append(Command(triggerStartRenderThread, 'Start render thread'))
 
 
 def printActiveJobs():
-    activeRenderTask, activeRenderTaskSubindex, _ = RenderWorker.getActiveRenderTaskInfo()
-    print(f"Active render job:",
-          "None" if activeRenderTask is None else f"{str(activeRenderTask)}, subindex {str(activeRenderTaskSubindex)}\n{activeRenderTask.__repr__()}")
+    activeRenderTasks = RenderWorker.getActiveRenderTaskInfo()
+    if len(activeRenderTasks) == 0:
+        print("Active render job: None")
+    for activeRenderTask, activeRenderTaskSubindex in activeRenderTasks:
+        print(f"Active render job:",
+              f"{str(activeRenderTask)}, subindexes {str(activeRenderTaskSubindex)}\n{activeRenderTask.__repr__()}")
+    if len(activeRenderTasks) > 0:
+        print(formatRenderProgress())
     if COPY_FILES:
         activeCopyTask = CopyWorker.getActiveCopyTaskInfo()
         print(f"Active copy job:",
@@ -157,6 +164,14 @@ def forceReloadFiles():
 
 commandArray.append(Command(forceReloadFiles, 'Force reload all files'))
 
+def probeAllFiles():
+    print("Probing all video files that haven't been probed yet, this may take a while")
+    files = list(scanned.allFilesByVideoId.values())
+    probedCount = prewarmProbeCache(files)
+    print(f"Probe info available for {probedCount} of {len(files)} video files")
+
+commandArray.append(Command(probeAllFiles, 'Probe all video files'))
+
 def reloadConfigFile():
     loadConfigFile(getArgs().configFilePath)
 
@@ -382,9 +397,13 @@ def inputManualJob(initialRenderConfig=None):
     if renderConfig is None:
         return None
     item = RenderTask(mainStreamer, fileDate, renderConfig, outputPath)
+    item.updateSortKey()
     print(f"Adding render for streamer {mainStreamer} from {fileDate}")
     setRenderStatus(mainStreamer, fileDate,
                     'COPY_QUEUE' if COPY_FILES else 'RENDER_QUEUE')
+    if COPY_FILES:
+        # stored right away, so it's restored if the program stops while it's copying
+        RenderWorker.renderQueue.store(MANUAL_PRIORITY, item)
     (CopyWorker.copyQueue if COPY_FILES else RenderWorker.renderQueue).put((MANUAL_PRIORITY, item))
 
 
@@ -446,6 +465,9 @@ def editQueueItem(queueEntry):
         else:
             print(f"Invalid option: '{userInput}'")
     newItem = RenderTask(mainStreamer, fileDate, renderConfig, outputPath)
+    # still holds the local copies made for the old item
+    newItem.stagedFiles = item.stagedFiles
+    newItem.updateSortKey()
     return (priority, newItem)
 
 
@@ -494,6 +516,9 @@ def editQueue():
             if modifiedItem is None:
                 break
             elif modifiedItem == ...:
+                # tasks in the copy queue can be stored too, when they were restored or added manually
+                RenderWorker.renderQueue.discard(selectedItem[1])
+                RenderWorker.releaseStagedFiles(selectedItem[1])
                 del items[index]
             else:
                 items[index] = modifiedItem
@@ -502,6 +527,8 @@ def editQueue():
             print(f"Invalid input: '{userInput}'")
             continue
     for item in items:  # push modified items back into queue with their new priorities
+        if selectedQueue is not RenderWorker.renderQueue:
+            RenderWorker.renderQueue.store(*item)
         selectedQueue.put(item)
     selectedQueueLock.release()
 
@@ -1,13 +1,9 @@
 
 from functools import partial
 import queue
-import shutil
 import threading
 import time as ttime #avoid name conflict with import in config file
-import os
-from typing import Tuple
-
-from SharedUtils import extractInputFiles
+from typing import Dict, List, Tuple, TYPE_CHECKING
 
 import MTRLogging
 
@@ -20,13 +16,17 @@ COPY_FILES = getConfig('main.copyFiles')
 import scanned
 
 from RenderWorker import renderQueue, renderQueueLock
-from RenderTask import RenderTask, getRenderStatus, setRenderStatus, incrFileRefCount, DEFAULT_PRIORITY
+from RenderTask import RenderTask, getRenderStatus, setRenderStatus
 from MultiTwitchRenderer import generateTilingCommandMultiSegment
+from FileStaging import RANGE_MARGIN_SECONDS, getFileStager, getInputWindows
+
+if TYPE_CHECKING:
+    from SourceFile import SourceFile
 
 if COPY_FILES:
     activeCopyTask: RenderTask = None
     copyThread: threading.Thread = None
-    copyQueue: queue.PriorityQueue[Tuple[int, RenderTask]] = queue.PriorityQueue<Tuple[int, RenderTask]>()
+    copyQueue: queue.PriorityQueue[Tuple[int, RenderTask]] = queue.PriorityQueue()
     copyQueueLock = threading.RLock()
 
 def getActiveCopyTaskInfo() -> RenderTask:
@@ -56,56 +56,63 @@ def copyWorker(copyLog=None):
                                                          task.fileDate,
                                                          task.renderConfig,
                                                          task.outputPath)
-        # outputPath = [command for command in commandArray if 'ffmpeg' in command[0]][-1][-1]
         renderCommands = [
             command for command in commandArray if 'ffmpeg' in command[0]]
-        allInputFiles = [filepath for command in renderCommands for filepath in extractInputFiles(
-            command) if type(filepath) == str and 'anullsrc' not in filepath]
-        # print(commandArray)
         allOutputFiles = set([command[-1] for command in renderCommands])
         overallOutputFile = renderCommands[-1][-1]
-        sourceFiles = [scanned.filesBySourceVideoPath[filepath]
-                       for filepath in allInputFiles if filepath not in allOutputFiles]
-        # self.intermediateFiles = set([command[-1] for command in commandArray[:-1] if 'ffmpeg' in command[0]])
-        # renderCommand = list(task.commandArray)
-        for file in sourceFiles:
-            remotePath = file.videoFile
-            localPath = remotePath.replace(getConfig('main.basepath'), getConfig('main.localBasepath'))
-            if not os.path.isfile(localPath):
-                # time.sleep(5)
-                logger.detail(f"Copying file {remotePath} to local storage")
-                if copyLog is not None:
-                    copyLog(f"Copying file {remotePath} to local storage")
-                # copy to temp file to avoid tripping the if condition with incomplete transfers
-                shutil.copyfile(remotePath, localPath+'.temp')
-                logger.detail(f'File copy complete, moving to location {localPath}')
-                if copyLog is not None:
-                    copyLog('File copy complete, moving to location')
-                shutil.move(localPath+'.temp', localPath)
-                logger.detail('Move complete')
-                if copyLog is not None:
-                    copyLog('Move complete')
+        stager = getFileStager()
+        # audio alignment reads the whole audio track of each file
+        copyRanges = getConfig('main.copyMode') == 'range' and not task.renderConfig.preciseAlign
+        # source file:[(first chunk index, start, end)] of the parts of it the task reads, end is None for all the rest of it
+        fileWindows: Dict['SourceFile', List[Tuple[int, float, float | None]]] = {}
+        for chunkIndex, command in enumerate(renderCommands):
+            for filepath, start, end in getInputWindows(command):
+                if filepath in allOutputFiles:
+                    continue
+                # already local if an earlier task staged it
+                file = scanned.filesBySourceVideoPath.get(filepath, stager.getSourceFile(filepath))
+                if file is None or not file.videoFile.startswith(getConfig('main.basepath')):
+                    continue
+                fileWindows.setdefault(file, []).append((chunkIndex, start, end))
+        # (first chunk index, file, start, end) to copy, end is None for a full copy
+        copies: List[Tuple[int, 'SourceFile', float, float | None]] = []
+        for file, windows in fileWindows.items():
+            if not copyRanges or any((end is None for _, _, end in windows)):
+                copies.append((min((chunkIndex for chunkIndex, _, _ in windows)), file, 0., None))
+                continue
+            # Windows that overlap are joined. Consecutive chunks only touch (give or take the rounding of their
+            # timestamps) and get copies of their own, so the first chunk doesn't wait for a copy of the whole day.
+            windows.sort(key=lambda x: x[1])
+            firstChunk, mergedStart, mergedEnd = windows[0]
+            for chunkIndex, start, end in windows[1:]:
+                if start < mergedEnd - 1:
+                    firstChunk, mergedEnd = min(firstChunk, chunkIndex), max(mergedEnd, end)
+                else:
+                    copies.append((firstChunk, file, mergedStart, mergedEnd))
+                    firstChunk, mergedStart, mergedEnd = chunkIndex, start, end
+            copies.append((firstChunk, file, mergedStart, mergedEnd))
+        # Copies are started in the order the chunks read them and the task is queued for rendering right away. Each chunk
+        # only waits for its own inputs, so chunk N renders while the inputs of chunk N+1 are still copying.
+        copies.sort(key=lambda x: x[0])
+        task.stagedFiles = []
+        for _, file, start, end in copies:
+            if end is not None:
+                copy = stager.stageRange(file, start, end + RANGE_MARGIN_SECONDS, copyLog)
             else:
-                logger.detail('Local file already exists')
+                copy = stager.stageFile(file, copyLog)
+            if copy is None:
+                logger.warning(f"No room in scratch space for {file.videoFile}, the render will read the original")
                 if copyLog is not None:
-                    copyLog('Local file already exists')
-            incrFileRefCount(localPath)
-            # copy file and update SourceFile object
-            file.localVideoPath = localPath
-            # add copied file to filesBySourceVideoPath
-            scanned.filesBySourceVideoPath[localPath] = file
-            # replace file path in renderCommand
-            for command in task.commandArray:
-                command[command.index(remotePath)] = localPath
-        logger.detail('Local file already exists')
+                    copyLog(f"No room in scratch space for {file.videoFile}, the render will read the original")
+                continue
+            task.stagedFiles.append(copy.localPath)
+        logger.detail(f"Started {len(task.stagedFiles)} copies of source files for render to {overallOutputFile}")
         if copyLog is not None:
-            copyLog(f'Finished source file copies for render to {overallOutputFile}')
-        # item = QueueItem(streamer, day, renderConfig, outPath)
+            copyLog(f"Started {len(task.stagedFiles)} copies of source files for render to {overallOutputFile}")
         copyQueue.task_done()
-        queueItem = (DEFAULT_PRIORITY, RenderTask(task.mainStreamer,
-                     task.fileDate, task.renderConfig, task.outputPath))
+        task.updateSortKey()
         renderQueueLock.acquire()  # block if user is editing queue
-        renderQueue.put(queueItem)
+        renderQueue.put((priority, task))
         renderQueueLock.release()
         setRenderStatus(task.mainStreamer, task.fileDate, 'RENDER_QUEUE')
 
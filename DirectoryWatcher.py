@@ -0,0 +1,180 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from MTRConfig import getConfig
+from SourceFile import getScannedExts
+
+from MTRLogging import getLogger
+logger = getLogger('DirectoryWatcher')
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# wd, mask, cookie, len
+eventHeader = struct.Struct('iIII')
+
+# basepath and streamer folders only need to tell us about new subfolders
+FOLDER_WATCH_MASK = IN_CREATE | IN_MOVED_TO | IN_ONLYDIR
+# IN_CREATE is only used to note download activity (e.g. a new .part file), files are scanned once they are closed or moved in
+SESSION_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+
+# how long to keep collecting events after the first one, so the files of a single download are scanned together
+EVENT_SETTLE_SECONDS = 2
+MAX_EVENT_SETTLE_SECONDS = 30
+
+libc = None
+
+def loadLibc():
+    global libc
+    if libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_init1.restype = ctypes.c_int
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_add_watch.restype = ctypes.c_int
+    return libc
+
+
+class DirectoryWatcher:
+    def __init__(self, basepath:str, outputDirectory:str, scannedExts:Tuple[str]):
+        self.basepath = basepath
+        self.excludedFolders = ("NA", outputDirectory)
+        self.scannedExts = scannedExts
+        self.libc = loadLibc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 failed: {os.strerror(errno)}")
+        self.watchedFolders: Dict[int, Tuple[str, str]] = {}  # wd:(path, kind)
+        self.changedPaths: Dict[str, None] = {}  # insertion-ordered set
+        self.needsFullScan = False
+        self.lastEventTime: datetime | None = None
+        try:
+            self.addWatch(basepath, 'root', FOLDER_WATCH_MASK)
+            with os.scandir(basepath) as entries:
+                streamerFolders = [entry.path for entry in entries if entry.name not in self.excludedFolders and entry.is_dir()]
+            for streamerFolder in streamerFolders:
+                self.watchStreamerFolder(streamerFolder, listExisting=False)
+        except:
+            self.close()
+            raise
+        logger.info(f"Watching {len(self.watchedFolders)} folders for changes")
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def addWatch(self, path:str, kind:str, mask:int):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch failed for {path}: {os.strerror(errno)}")
+        self.watchedFolders[wd] = (path, kind)
+
+    def watchStreamerFolder(self, path:str, listExisting:bool):
+        self.addWatch(path, 'streamer', FOLDER_WATCH_MASK)
+        sessionFolder = os.path.join(path, 'S1')
+        if os.path.isdir(sessionFolder):
+            self.watchSessionFolder(sessionFolder, listExisting)
+
+    def watchSessionFolder(self, path:str, listExisting:bool):
+        self.addWatch(path, 'session', SESSION_WATCH_MASK)
+        # anything written before the watch was added would otherwise never be reported
+        if listExisting:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.endswith(self.scannedExts):
+                        self.changedPaths[entry.path] = None
+
+    def readEvents(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, nameLength = eventHeader.unpack_from(data, offset)
+            offset += eventHeader.size
+            name = os.fsdecode(data[offset:offset+nameLength].rstrip(b'\0'))
+            offset += nameLength
+            try:
+                self.handleEvent(wd, mask, name)
+            except OSError as ex:
+                logger.error(f"Unable to watch new folder, falling back to a full scan: {ex}")
+                self.needsFullScan = True
+
+    def handleEvent(self, wd:int, mask:int, name:str):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("inotify event queue overflowed, some changes were missed")
+            self.needsFullScan = True
+            return
+        if wd not in self.watchedFolders:
+            return
+        if mask & IN_IGNORED:  # folder was removed or unmounted
+            logger.detail(f"Stopped watching {self.watchedFolders[wd][0]}")
+            del self.watchedFolders[wd]
+            return
+        folder, kind = self.watchedFolders[wd]
+        fullpath = os.path.join(folder, name)
+        if kind == 'root':
+            if mask & IN_ISDIR and name not in self.excludedFolders:
+                logger.info(f"New streamer folder {fullpath}")
+                self.watchStreamerFolder(fullpath, listExisting=True)
+        elif kind == 'streamer':
+            if mask & IN_ISDIR and name == 'S1':
+                self.watchSessionFolder(fullpath, listExisting=True)
+        else:
+            self.lastEventTime = datetime.now(timezone.utc)
+            if not mask & IN_ISDIR and mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and name.endswith(self.scannedExts):
+                logger.trace(f"File changed: {fullpath}")
+                self.changedPaths[fullpath] = None
+
+    def waitForChanges(self, timeout:float) -> List[str] | None:
+        """Returns the video, info and chat files written or moved in since the last call, waiting up to timeout seconds for one.
+        Returns None if events were lost and the caller needs to do a full scan instead."""
+        if len(self.changedPaths) == 0 and not self.needsFullScan:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            if len(readable) > 0:
+                settleStart = time.monotonic()
+                self.readEvents()
+                while time.monotonic() - settleStart < MAX_EVENT_SETTLE_SECONDS:
+                    readable, _, _ = select.select([self.fd], [], [], EVENT_SETTLE_SECONDS)
+                    if len(readable) == 0:
+                        break
+                    self.readEvents()
+        if self.needsFullScan:
+            self.needsFullScan = False
+            self.changedPaths = {}
+            return None
+        changedPaths = list(self.changedPaths.keys())
+        self.changedPaths = {}
+        return changedPaths
+
+
+def createDirectoryWatcher() -> DirectoryWatcher | None:
+    if getConfig('main.fileWatchMode') != 'inotify':
+        return None
+    if not sys.platform.startswith('linux'):
+        logger.warning("inotify is only available on Linux, falling back to polling")
+        return None
+    try:
+        return DirectoryWatcher(getConfig('main.basepath'), getConfig('main.outputDirectory'), getScannedExts())
+    except (OSError, AttributeError) as ex:  # AttributeError if libc has no inotify functions
+        logger.warning(f"Unable to start inotify watcher, falling back to polling: {ex}")
+        return None
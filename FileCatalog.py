@@ -0,0 +1,278 @@
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, List, Tuple
+
+from MTRLogging import getLogger
+logger = getLogger('FileCatalog')
+
+catalogSchema = """
+CREATE TABLE IF NOT EXISTS files (
+    videoId TEXT PRIMARY KEY,
+    streamer TEXT NOT NULL,
+    videoFile TEXT NOT NULL,
+    infoFile TEXT NOT NULL,
+    chatFile TEXT,
+    startTimestamp INTEGER NOT NULL,
+    endTimestamp INTEGER NOT NULL,
+    duration INTEGER NOT NULL,
+    downloadTime REAL NOT NULL,
+    chatParsed INTEGER NOT NULL DEFAULT 0,
+    infoJson TEXT
+);
+CREATE INDEX IF NOT EXISTS filesByStreamer ON files (streamer, startTimestamp);
+CREATE INDEX IF NOT EXISTS filesByStartTimestamp ON files (startTimestamp);
+CREATE TABLE IF NOT EXISTS chapters (
+    videoId TEXT NOT NULL REFERENCES files (videoId) ON DELETE CASCADE,
+    chapterIndex INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    startTime REAL NOT NULL,
+    endTime REAL NOT NULL,
+    PRIMARY KEY (videoId, chapterIndex)
+);
+CREATE TABLE IF NOT EXISTS chatGroups (
+    videoId TEXT NOT NULL REFERENCES files (videoId) ON DELETE CASCADE,
+    groupIndex INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    players TEXT NOT NULL,
+    PRIMARY KEY (videoId, groupIndex)
+);
+CREATE TABLE IF NOT EXISTS probes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtimeNs INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    info TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS groupMessages (
+    version TEXT NOT NULL,
+    message TEXT NOT NULL,
+    players TEXT NOT NULL,
+    PRIMARY KEY (version, message)
+);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    mtimeNs INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS renderSamples (
+    codec TEXT NOT NULL,
+    tileCount INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    renderSeconds REAL NOT NULL,
+    finishedTime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS renderSamplesByLayout ON renderSamples (codec, tileCount, finishedTime);
+"""
+
+catalogConnection: sqlite3.Connection = None
+catalogFilepath: str = None
+catalogLock = threading.RLock()
+# directory journal as last written, so saves only touch entries that changed
+savedDirectories: Dict[str, Tuple[int, int]] = {}
+
+
+def openCatalog(filepath: str) -> sqlite3.Connection:
+    global catalogConnection
+    global catalogFilepath
+    with catalogLock:
+        if catalogConnection is not None and catalogFilepath == filepath:
+            return catalogConnection
+        closeCatalog()
+        logger.info(f"Opening file catalog {filepath}")
+        # shared between the session, render and command threads, all access goes through catalogLock
+        connection = sqlite3.connect(filepath, check_same_thread=False)
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.executescript(catalogSchema)
+        connection.commit()
+        catalogConnection = connection
+        catalogFilepath = filepath
+        return connection
+
+
+def closeCatalog():
+    global catalogConnection
+    global catalogFilepath
+    with catalogLock:
+        if catalogConnection is not None:
+            catalogConnection.close()
+        catalogConnection = None
+        catalogFilepath = None
+        savedDirectories.clear()
+
+
+def getFileCount() -> int:
+    with catalogLock:
+        return catalogConnection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+
+def loadFileRows() -> List[sqlite3.Row]:
+    with catalogLock:
+        cursor = catalogConnection.execute("""SELECT videoId, streamer, videoFile, infoFile, chatFile, startTimestamp,
+                                                     endTimestamp, duration, downloadTime, chatParsed
+                                              FROM files ORDER BY startTimestamp""")
+        cursor.row_factory = sqlite3.Row
+        return cursor.fetchall()
+
+
+def loadAllChapters() -> Dict[str, List[Dict[str, Any]]]:
+    """Chapters of every file, in the same shape as the info.json 'chapters' entries"""
+    chaptersByVideoId: Dict[str, List[Dict[str, Any]]] = {}
+    with catalogLock:
+        rows = catalogConnection.execute("""SELECT videoId, title, startTime, endTime FROM chapters
+                                            ORDER BY videoId, chapterIndex""").fetchall()
+    for videoId, title, startTime, endTime in rows:
+        if videoId not in chaptersByVideoId:
+            chaptersByVideoId[videoId] = []
+        chaptersByVideoId[videoId].append({'title': title, 'start_time': startTime, 'end_time': endTime})
+    return chaptersByVideoId
+
+
+def loadInfoJson(videoId: str) -> dict | None:
+    with catalogLock:
+        row = catalogConnection.execute("SELECT infoJson FROM files WHERE videoId = ?", (videoId,)).fetchone()
+    if row is None or row[0] is None:
+        return None
+    return json.loads(row[0])
+
+
+def loadChatGroups(videoId: str) -> List[Tuple[str, List[str]]]:
+    """Returns (ISO timestamp, players) pairs in their original order"""
+    with catalogLock:
+        rows = catalogConnection.execute("""SELECT time, players FROM chatGroups WHERE videoId = ?
+                                            ORDER BY groupIndex""", (videoId,)).fetchall()
+    return [(time, json.loads(players)) for time, players in rows]
+
+
+def loadProbe(path: str, size: int, mtimeNs: int, inode: int) -> dict | None:
+    """Returns None if the file has changed since it was probed"""
+    with catalogLock:
+        if catalogConnection is None:
+            return None
+        row = catalogConnection.execute("SELECT info FROM probes WHERE path = ? AND size = ? AND mtimeNs = ? AND inode = ?",
+                                        (path, size, mtimeNs, inode)).fetchone()
+    return None if row is None else json.loads(row[0])
+
+
+def saveFile(videoId: str, streamer: str, videoFile: str, infoFile: str, chatFile: str | None,
+             startTimestamp: float, endTimestamp: float, duration: float, downloadTime: float,
+             infoJson: dict | None, chapters: List[Dict[str, Any]] | None,
+             chatGroups: List[Tuple[str, List[str]]] | None):
+    """Upserts one file. infoJson, chapters and chatGroups left as None keep whatever is already stored."""
+    with catalogLock:
+        catalogConnection.execute("""INSERT INTO files (videoId, streamer, videoFile, infoFile, chatFile, startTimestamp,
+                                                        endTimestamp, duration, downloadTime, chatParsed, infoJson)
+                                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                     ON CONFLICT (videoId) DO UPDATE SET
+                                        streamer = excluded.streamer, videoFile = excluded.videoFile,
+                                        infoFile = excluded.infoFile, chatFile = excluded.chatFile,
+                                        startTimestamp = excluded.startTimestamp, endTimestamp = excluded.endTimestamp,
+                                        duration = excluded.duration, downloadTime = excluded.downloadTime,
+                                        chatParsed = MAX(files.chatParsed, excluded.chatParsed),
+                                        infoJson = COALESCE(excluded.infoJson, files.infoJson)""",
+                                  (videoId, streamer, videoFile, infoFile, chatFile, startTimestamp, endTimestamp,
+                                   duration, downloadTime, int(chatGroups is not None),
+                                   None if infoJson is None else json.dumps(infoJson)))
+        if chapters is not None:
+            catalogConnection.execute("DELETE FROM chapters WHERE videoId = ?", (videoId,))
+            catalogConnection.executemany("""INSERT INTO chapters (videoId, chapterIndex, title, startTime, endTime)
+                                             VALUES (?, ?, ?, ?, ?)""",
+                                          ((videoId, i, chapter['title'], chapter['start_time'], chapter['end_time'])
+                                           for i, chapter in enumerate(chapters)))
+        if chatGroups is not None:
+            catalogConnection.execute("DELETE FROM chatGroups WHERE videoId = ?", (videoId,))
+            catalogConnection.executemany("""INSERT INTO chatGroups (videoId, groupIndex, time, players)
+                                             VALUES (?, ?, ?, ?)""",
+                                          ((videoId, i, time, json.dumps(players))
+                                           for i, (time, players) in enumerate(chatGroups)))
+
+
+def saveProbe(path: str, size: int, mtimeNs: int, inode: int, info: dict, commit: bool = False):
+    with catalogLock:
+        if catalogConnection is None:
+            return
+        catalogConnection.execute("INSERT OR REPLACE INTO probes (path, size, mtimeNs, inode, info) VALUES (?, ?, ?, ?, ?)",
+                                  (path, size, mtimeNs, inode, json.dumps(info)))
+        if commit:
+            catalogConnection.commit()
+
+
+def loadDirectories() -> Dict[str, Tuple[int, int]]:
+    with catalogLock:
+        rows = catalogConnection.execute("SELECT path, inode, mtimeNs FROM directories").fetchall()
+        savedDirectories.clear()
+        for path, inode, mtimeNs in rows:
+            savedDirectories[path] = (inode, mtimeNs)
+        return dict(savedDirectories)
+
+
+def saveDirectories(journal: Dict[str, Tuple[int, int]]):
+    with catalogLock:
+        removedPaths = [path for path in savedDirectories.keys() if path not in journal]
+        changedEntries = [(path, key[0], key[1]) for path, key in journal.items() if savedDirectories.get(path) != key]
+        catalogConnection.executemany("DELETE FROM directories WHERE path = ?", ((path,) for path in removedPaths))
+        catalogConnection.executemany("INSERT OR REPLACE INTO directories (path, inode, mtimeNs) VALUES (?, ?, ?)",
+                                      changedEntries)
+        for path in removedPaths:
+            del savedDirectories[path]
+        for path, inode, mtimeNs in changedEntries:
+            savedDirectories[path] = (inode, mtimeNs)
+
+
+def loadGroupMessages(version: str, limit: int) -> Dict[str, List[str]]:
+    with catalogLock:
+        if catalogConnection is None:
+            return {}
+        rows = catalogConnection.execute("SELECT message, players FROM groupMessages WHERE version = ? LIMIT ?",
+                                         (version, limit)).fetchall()
+    return {message: json.loads(players) for message, players in rows}
+
+
+def saveGroupMessages(version: str, entries: Dict[str, List[str]]):
+    with catalogLock:
+        # results for any other streamer/alias set can never be used again
+        catalogConnection.execute("DELETE FROM groupMessages WHERE version != ?", (version,))
+        catalogConnection.executemany("INSERT OR REPLACE INTO groupMessages (version, message, players) VALUES (?, ?, ?)",
+                                      ((version, message, json.dumps(players)) for message, players in entries.items()))
+
+
+def saveRenderSample(codec: str, tileCount: int, duration: float, renderSeconds: float, finishedTime: float):
+    with catalogLock:
+        if catalogConnection is None:
+            return
+        catalogConnection.execute("""INSERT INTO renderSamples (codec, tileCount, duration, renderSeconds, finishedTime)
+                                     VALUES (?, ?, ?, ?, ?)""", (codec, tileCount, duration, renderSeconds, finishedTime))
+        catalogConnection.commit()
+
+
+def loadRenderSpeed(codec: str, tileCount: int, limit: int) -> float | None:
+    """Seconds of video rendered per second over the most recent renders with this codec and tile count"""
+    with catalogLock:
+        if catalogConnection is None:
+            return None
+        row = catalogConnection.execute("""SELECT SUM(duration), SUM(renderSeconds) FROM
+                                               (SELECT duration, renderSeconds FROM renderSamples WHERE codec = ? AND tileCount = ?
+                                                ORDER BY finishedTime DESC LIMIT ?)""", (codec, tileCount, limit)).fetchone()
+    if row[0] is None or row[1] <= 0:
+        return None
+    return row[0] / row[1]
+
+
+def commit():
+    with catalogLock:
+        catalogConnection.commit()
+
+
+def rollback():
+    with catalogLock:
+        catalogConnection.rollback()
+
+
+def clearCatalog():
+    with catalogLock:
+        for table in ('chatGroups', 'chapters', 'files', 'directories'):
+            catalogConnection.execute(f"DELETE FROM {table}")
+        catalogConnection.commit()
+        savedDirectories.clear()
+
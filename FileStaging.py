@@ -0,0 +1,273 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+from MTRConfig import getConfig
+from ProcessEngine import getProcessEngine
+from RenderTelemetry import getRenderDuration
+from ScratchSpace import getScratchSpace
+from SharedUtils import insertSuffix
+
+from MTRLogging import getLogger
+logger = getLogger('FileStaging')
+
+if TYPE_CHECKING:
+    from SourceFile import SourceFile
+
+COPY_BLOCK_SIZE = 1 << 20
+RANGE_MARGIN_SECONDS = 10  # extra kept after the end of a window, for the decoder to flush the last frames
+
+
+class TokenBucket:
+    """Limits throughput to rate bytes per second, with bursts of up to a second's worth"""
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.lastRefill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount: int):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.lastRefill) * self.rate)
+                self.lastRefill = now
+                # a block bigger than the bucket would never fit, let it through once the bucket is full
+                needed = min(amount, self.rate)
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return
+                waitTime = (needed - self.tokens) / self.rate
+            time.sleep(waitTime)
+
+
+def copyFileLimited(sourcePath: str, destPath: str, bucket: TokenBucket | None):
+    if bucket is None:
+        shutil.copyfile(sourcePath, destPath)
+        return
+    with open(sourcePath, 'rb') as sourceFile, open(destPath, 'wb') as destFile:
+        for block in iter(lambda: sourceFile.read(COPY_BLOCK_SIZE), b''):
+            bucket.consume(len(block))
+            destFile.write(block)
+
+
+def getLocalPath(remotePath: str) -> str:
+    return remotePath.replace(getConfig('main.basepath'), getConfig('main.localBasepath'))
+
+
+def getRemotePath(localPath: str) -> str:
+    return localPath.replace(getConfig('main.localBasepath'), getConfig('main.basepath'))
+
+
+def getStartTime(videoFile: str) -> float:
+    probe = getProcessEngine().start(['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_entries', 'format=start_time',
+                                      videoFile], captureStdout=True, timeout=120)
+    if probe.wait() != 0:
+        raise RuntimeError(f"Unable to probe start time of {videoFile}")
+    return float(json.loads(probe.stdout.decode())['format'].get('start_time', 0))
+
+
+def getInputWindows(command: List) -> List[Tuple[str, float, float | None]]:
+    """(input path, start, end) of the part of each input the command reads. End is None if it can't be told from the
+    command, the whole rest of the file may be read."""
+    duration = getRenderDuration(command)
+    windows = []
+    for i in range(len(command)-1):
+        if command[i] != '-i' or not isinstance(command[i+1], str):
+            continue
+        start = float(command[i-1]) if i >= 2 and command[i-2] == '-ss' else 0.
+        windows.append((command[i+1], start, None if duration is None else start + duration))
+    return windows
+
+
+class StagedCopy:
+    """Local copy of a source file, or with start and end set, of just that window of it"""
+    def __init__(self, file: 'SourceFile', localPath: str, start: float | None = None, end: float | None = None):
+        self.file = file
+        self.remotePath = file.videoFile
+        self.localPath = localPath
+        self.start = start
+        self.end = end
+        self.offset = 0.  # seconds of the original before the start of the copy
+        self.future: Future | None = None
+
+    def covers(self, start: float, end: float) -> bool:
+        return self.start is None or (self.start <= start and end <= self.end)
+
+    def failed(self) -> bool:
+        return self.future.done() and self.future.exception() is not None
+
+
+class FileStager:
+    """Copies source files to local storage on a pool of threads sharing one bandwidth limit. Files are copied once no
+    matter how many tasks use them, and renders wait for just the files each of their commands reads.
+    Full copies replace the file's path in every command built afterwards. Range copies only hold the part of the file
+    one task needs, so they are swapped into that task's commands one at a time by localizeCommand."""
+    def __init__(self, maxConcurrentCopies: int, bandwidthLimit: float):
+        self.executor = ThreadPoolExecutor(max_workers=maxConcurrentCopies, thread_name_prefix='file copy')
+        self.bucket = TokenBucket(bandwidthLimit) if bandwidthLimit > 0 else None
+        # local path:copy
+        self.copies: Dict[str, StagedCopy] = {}
+        self.lock = threading.Lock()
+        getScratchSpace().evictionListeners.append(self.onEvicted)
+
+    def copyFile(self, copy: StagedCopy, copyLog=None):
+        if os.path.isfile(copy.localPath):
+            logger.detail(f"Local file {copy.localPath} already exists")
+            getScratchSpace().register(copy.localPath)
+            return
+        logger.detail(f"Copying file {copy.remotePath} to local storage")
+        if copyLog is not None:
+            copyLog(f"Copying file {copy.remotePath} to local storage")
+        startTime = time.time()
+        # copy to temp file so an incomplete transfer is never mistaken for the local file
+        copyFileLimited(copy.remotePath, copy.localPath+'.temp', self.bucket)
+        shutil.move(copy.localPath+'.temp', copy.localPath)
+        getScratchSpace().register(copy.localPath)
+        logger.detail(f"Copied {copy.remotePath} in {time.time()-startTime:.1f} seconds")
+        if copyLog is not None:
+            copyLog(f"Copied {copy.remotePath} in {time.time()-startTime:.1f} seconds")
+
+    def remuxRange(self, copy: StagedCopy, copyLog=None):
+        if not os.path.isfile(copy.localPath):
+            logger.detail(f"Copying {copy.start:.0f}-{copy.end:.0f}s of {copy.remotePath} to local storage")
+            if copyLog is not None:
+                copyLog(f"Copying {copy.start:.0f}-{copy.end:.0f}s of {copy.remotePath} to local storage")
+            startTime = time.time()
+            tempPath = insertSuffix(copy.localPath, '.temp')
+            # -copyts keeps the original timestamps, so the start time of the copy says where in the original it starts
+            returncode = getProcessEngine().start([f"{getConfig('main.ffmpegPath')}ffmpeg", '-y', '-v', 'error',
+                                                   '-ss', str(copy.start), '-i', copy.remotePath,
+                                                   '-t', str(copy.end - copy.start), '-map', '0', '-c', 'copy',
+                                                   '-copyts', tempPath]).wait()
+            if returncode != 0:
+                if os.path.isfile(tempPath):
+                    os.remove(tempPath)
+                raise RuntimeError(f"ffmpeg exited with return code {returncode}")
+            shutil.move(tempPath, copy.localPath)
+            logger.detail(f"Copied {copy.start:.0f}-{copy.end:.0f}s of {copy.remotePath} in {time.time()-startTime:.1f} seconds")
+        # admitted with an estimate
+        getScratchSpace().register(copy.localPath)
+        copy.offset = getStartTime(copy.localPath) - getStartTime(copy.remotePath)
+
+    def addCopy(self, copy: StagedCopy, copyTarget, copyLog) -> StagedCopy:
+        copy.future = self.executor.submit(copyTarget, copy, copyLog)
+        self.copies[copy.localPath] = copy
+
+        def onCopied(future: Future):
+            if future.exception() is not None:
+                logger.error(f"Copying {copy.remotePath} to {copy.localPath} failed: {future.exception()}")
+                getScratchSpace().discard(copy.localPath)
+                if copy.start is None:
+                    # render from the original until another copy is attempted
+                    copy.file.localVideoFile = None
+        copy.future.add_done_callback(onCopied)
+        return copy
+
+    def stageFile(self, file: 'SourceFile', copyLog=None) -> StagedCopy | None:
+        """Starts copying the file if it isn't local already. Render commands built from then on read the local copy.
+        Takes a reference to the copy in the scratch space for the task, None if there's no room for it."""
+        scratch = getScratchSpace()
+        localPath = getLocalPath(file.videoFile)
+        with self.lock:
+            copy = self.copies.get(localPath)
+            if copy is not None and not copy.failed() and scratch.acquire(localPath):
+                return copy
+        # may wait for other tasks to free up space, so not while holding the lock
+        if not scratch.admit(localPath, os.path.getsize(file.videoFile)):
+            return None
+        with self.lock:
+            file.localVideoFile = localPath
+            return self.addCopy(StagedCopy(file, localPath), self.copyFile, copyLog)
+
+    def stageRange(self, file: 'SourceFile', start: float, end: float, copyLog=None) -> StagedCopy | None:
+        """Starts copying the window of the file, unless a copy that covers it already exists. Takes a reference like
+        stageFile."""
+        scratch = getScratchSpace()
+        with self.lock:
+            for copy in self.copies.values():
+                if copy.remotePath == file.videoFile and copy.covers(start, end) and not copy.failed() and \
+                        scratch.acquire(copy.localPath):
+                    return copy
+        # whole seconds, so the name of the copy always tells exactly what it holds
+        start, end = math.floor(start), math.ceil(end)
+        localPath = insertSuffix(getLocalPath(file.videoFile), f" {start}-{end}")
+        fileSize = os.path.getsize(file.videoFile)
+        try:
+            estimatedSize = int(fileSize * min(1., (end - start) / float(file.getVideoFileInfo()['format']['duration'])))
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):
+            estimatedSize = fileSize
+        if not scratch.admit(localPath, estimatedSize):
+            return None
+        with self.lock:
+            return self.addCopy(StagedCopy(file, localPath, start, end), self.remuxRange, copyLog)
+
+    def getSourceFile(self, localPath: str) -> 'SourceFile | None':
+        with self.lock:
+            copy = self.copies.get(localPath)
+            return None if copy is None or copy.start is not None else copy.file
+
+    def waitForInputs(self, command: List) -> bool:
+        """Waits until the copies of the command's inputs are done, range copies only if they cover the part it reads.
+        Returns False if a full copy failed, a command that needed a range copy that failed just reads the original."""
+        windows = getInputWindows(command)
+        with self.lock:
+            copies = [copy for copy in self.copies.values()
+                      if any((copy.localPath == path or (copy.start is not None and copy.remotePath == path and end is not None
+                                                         and copy.covers(start, end)) for path, start, end in windows))]
+        return all((copy.future.exception() is None or copy.start is not None for copy in copies))
+
+    def localizeCommand(self, command: List) -> List:
+        """Copy of the command reading the range copies of its inputs where there are finished ones"""
+        command = list(command)
+        for path, start, end in getInputWindows(command):
+            if end is None:
+                continue
+            with self.lock:
+                copy = next((copy for copy in self.copies.values() if copy.start is not None and copy.remotePath == path
+                             and copy.covers(start, end) and copy.future.done() and not copy.failed()), None)
+            if copy is None or start - copy.offset < 0:
+                continue
+            inputIndex = command.index(path) - 1
+            command[inputIndex+1] = copy.localPath
+            if inputIndex >= 2 and command[inputIndex-2] == '-ss':
+                command[inputIndex-1] = str(start - copy.offset)
+            elif start - copy.offset != 0:
+                command[inputIndex:inputIndex] = ['-ss', str(start - copy.offset)]
+        return command
+
+    def getOriginalCommand(self, command: List) -> List:
+        """Copy of the command reading the original source files instead of local copies, for other machines"""
+        command = list(command)
+        for i in range(len(command)-1):
+            if command[i] == '-i' and isinstance(command[i+1], str) and command[i+1].startswith(getConfig('main.localBasepath')):
+                file = self.getSourceFile(command[i+1])
+                command[i+1] = file.videoFile if file is not None else getRemotePath(command[i+1])
+        return command
+
+    def onEvicted(self, localPath: str):
+        """The local copy was removed to make room, commands built from then on read the original again"""
+        with self.lock:
+            if getScratchSpace().contains(localPath):
+                return  # already staged again
+            copy = self.copies.pop(localPath, None)
+            if copy is not None and copy.start is None:
+                copy.file.localVideoFile = None
+
+
+fileStager: FileStager | None = None
+fileStagerLock = threading.Lock()
+
+
+def getFileStager() -> FileStager:
+    global fileStager
+    with fileStagerLock:
+        if fileStager is None:
+            fileStager = FileStager(getConfig('internal.maxConcurrentCopies'),
+                                    getConfig('main.copyBandwidthLimit') * 1024 * 1024)
+        return fileStager
@@ -109,6 +109,10 @@ configSchema = Schema({
             [isValidStreamerName],
         Optional('dataFilepath', default='./knownFiles.pickle'):
             isWriteableFile,
+        Optional('catalogFilepath', default='./fileCatalog.sqlite'):
+            isWriteableFile,
+        Optional('renderQueueFilepath', default='./renderQueue.sqlite'):
+            isWriteableFile,
         Optional('nongroupGames', default=['Just Chatting', "I'm Only Sleeping"]):
             [str],
         Optional('ffmpegPath', default=''):
@@ -123,8 +127,16 @@ configSchema = Schema({
             str,
         Optional('copyFiles', default=False):
             bool,
+        Optional('copyMode', default='full'):
+            Or('full', 'range'),
+        Optional('scratchBudgetGB', default=0):
+            And(Or(int, float), lambda x: x >= 0),
+        Optional('copyBandwidthLimit', default=0):
+            And(Or(int, float), lambda x: x >= 0),
         'minimumSessionWorkerDelayHours':
             And(int, lambda x: x > 0),
+        Optional('fileWatchMode', default='poll'):
+            And(str, lambda x: x in ('poll', 'inotify')),
         'monitorStreamers':
             [isValidStreamerName],
         Optional('overwriteIntermediateFiles', default=True):
@@ -135,6 +147,10 @@ configSchema = Schema({
             And(int, lambda x: x>=0),
         Optional('queueOldestFirst', default=True):
             bool,
+        Optional('queuePolicy', default='date'):
+            lambda x: x in ('date', 'shortestFirst', 'deadline'),
+        Optional('renderDeadlineHours', default=24):
+            And(Or(int, float), lambda x: x > 0),
         'defaultRenderConfig': 
             renderConfigSchema,
     },
@@ -143,6 +159,46 @@ configSchema = Schema({
             And(int, lambda x: x >= 0),
         Optional('audioOffsetCutoff', default=60):
             And(int, lambda x: x > 0),
+        Optional('chatParseWorkers', default=1):
+            And(int, lambda x: x >= 0),
+        Optional('groupMessageCacheSize', default=20000):
+            And(int, lambda x: x >= 0),
+        Optional('chatParseMode', default='full'):
+            And(str, lambda x: x in ('full', 'streaming', 'prefilter')),
+        Optional('renderPlanCacheSize', default=64):
+            And(int, lambda x: x >= 0),
+        Optional('probeWorkers', default=4):
+            And(int, lambda x: x >= 1),
+        Optional('prewarmProbeCache', default=True):
+            bool,
+        Optional('maxConcurrentRenderTasks', default=1):
+            And(int, lambda x: x >= 1),
+        Optional('maxParallelChunks', default=1):
+            And(int, lambda x: x >= 0),
+        Optional('preemptRenders', default=True):
+            bool,
+        Optional('maxConcurrentCopies', default=2):
+            And(int, lambda x: x >= 1),
+        Optional('scratchMinFreeGB', default=5):
+            And(Or(int, float), lambda x: x >= 0),
+        Optional('renderCoordinatorHost', default='127.0.0.1'):
+            str,
+        Optional('renderCoordinatorPort', default=0):
+            And(int, lambda x: 0 <= x < 65536),
+        Optional('renderLeaseSeconds', default=120):
+            And(int, lambda x: x >= 1),
+        Optional('remoteQueueSeconds', default=300):
+            And(int, lambda x: x >= 0),
+        Optional('maxRenderAttempts', default=3):
+            And(int, lambda x: x >= 1),
+        Optional('renderCpuSlots', default=0):
+            And(int, lambda x: x >= 0),
+        Optional('renderMemoryBudget', default=0):
+            And(int, lambda x: x >= 0),
+        Optional('renderSlotsPerInput', default=2):
+            And(int, lambda x: x >= 1),
+        Optional('renderMemoryPerInput', default=512):
+            And(int, lambda x: x >= 0),
         Optional('videoExts', default= [ ".mp4", ".mkv" ]):
             And([str], lambda x: len(x) >= 2 and all((ext.startswith('.') for ext in x))),
         Optional('infoExt', default= '.info.json'):
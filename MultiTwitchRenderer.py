@@ -8,8 +8,7 @@ import sys
 import json
 import numpy as np
 
-from datetime import datetime, timedelta, timezone
-from datetime import time as datetimetime
+from datetime import datetime
 from functools import reduce, partial
 from pprint import pformat, pprint
 from Session import Session
@@ -25,7 +24,10 @@ import scanned
 
 from SourceFile import SourceFile
 from ParsedChat import convertToDatetime
+from ProbeScheduler import prefetchVideoInfo
 from RenderConfig import RenderConfig
+from RenderPlan import RenderPlan, getMainSessionsOnDate, getRenderPlan, getTargetDateRange
+from SegmentMatrix import buildSegmentMatrices
 from SharedUtils import calcGameCounts, getVideoOutputPath
 from Session import Session
 
@@ -226,6 +228,7 @@ def filtergraphChunkedVersion(*, segmentFileMatrix: List[List[None|SourceFile]],
         # 12b. Build input options in order
     inputOptions = []
     inputVideoInfo = []
+    prefetchVideoInfo(inputFilesSorted)
     for i in range(len(inputFilesSorted)):
         file = inputFilesSorted[i]
         if useHardwareAcceleration & HW_DECODE != 0:
@@ -532,7 +535,7 @@ def filtergraphChunkedVersion(*, segmentFileMatrix: List[List[None|SourceFile]],
     return commandList
 
 
-def generateTilingCommandMultiSegment(mainStreamer, targetDate, renderConfig=RenderConfig(), outputFile=None) -> List[List[str]]:
+def buildRenderPlan(mainStreamer, targetDate, renderConfig=RenderConfig()) -> RenderPlan | None:
     otherStreamers = [
         name for name in scanned.allStreamersWithVideos if name != mainStreamer]
     #########
@@ -543,28 +546,19 @@ def generateTilingCommandMultiSegment(mainStreamer, targetDate, renderConfig=Ren
     sessionTrimLookbackSeconds = renderConfig.sessionTrimLookbackSeconds
     sessionTrimLookaheadSeconds = renderConfig.sessionTrimLookaheadSeconds
     minGapSize = renderConfig.minGapSize
-    useHardwareAcceleration = renderConfig.useHardwareAcceleration
-    maxHwaccelFiles = renderConfig.maxHwaccelFiles
     minimumTimeInVideo = renderConfig.minimumTimeInVideo
-    cutMode = renderConfig.cutMode
     useChat = renderConfig.useChat
     excludeStreamers = renderConfig.excludeStreamers
-    includeStreamers = renderConfig.includeStreamers
     nongroupGames = getConfig('main.nongroupGames')
-    ACTIVE_HWACCEL_VALUES = getActiveHwAccelValues()
     #########
     # 2. For a given day, target a streamer and find the start and end times of their sessions for the day
-    targetDateStartTime = datetime.combine(
-        datetime.fromisoformat(targetDate), datetimetime(0, 0, 0, tzinfo=getConfig('main.localTimezone')))
-    targetDateEndTime = targetDateStartTime + timedelta(days=1)
+    targetDateStartTime, targetDateEndTime = getTargetDateRange(targetDate)
     logger.info(f"{targetDate}, {targetDateStartTime}, {targetDateEndTime}")
     logger.info(f'other streamers{otherStreamers}')
-    mainSessionsOnTargetDate:List[Session] = list(filter(lambda x: targetDateStartTime <= datetime.fromtimestamp(
-        x.startTimestamp, tz=timezone(timedelta(hours=0))) <= targetDateEndTime, scanned.allStreamerSessions[mainStreamer]))
+    mainSessionsOnTargetDate:List[Session] = getMainSessionsOnDate(mainStreamer, targetDate)
     if len(mainSessionsOnTargetDate) == 0:
         raise ValueError(
             "Selected streamer does not have any sessions on the target date")
-    mainSessionsOnTargetDate.sort(key=lambda x: x.startTimestamp)
     logger.info(f"Step 2: {targetDateStartTime}, {targetDateEndTime}")
     logger.detail(pformat(mainSessionsOnTargetDate))
 
@@ -596,11 +590,13 @@ def generateTilingCommandMultiSegment(mainStreamer, targetDate, renderConfig=Ren
     secondarySessionsArray:List[Session] = []
     inputSessionsByStreamer:Dict[str, List[Session]] = {}
     inputSessionsByStreamer[mainStreamer] = mainSessionsOnTargetDate
+    mainRangeStart = mainSessionsOnTargetDate[0].startTimestamp
+    mainRangeEnd = max((session.endTimestamp for session in mainSessionsOnTargetDate))
     for streamer in scanned.allStreamerSessions.keys():
         if streamer == mainStreamer:
             continue
         inputSessionsByStreamer[streamer] = []
-        for session in scanned.allStreamerSessions[streamer]:
+        for session in scanned.sessionIndex.getOverlappingSessions(streamer, mainRangeStart, mainRangeEnd):
             if any((session.hasOverlapV2(x, useChat) for x in mainSessionsOnTargetDate)):
                 if excludeStreamers is not None and streamer in excludeStreamers.keys():
                     if excludeStreamers[streamer] is None or session.game in excludeStreamers[streamer]:
@@ -690,64 +686,9 @@ def generateTilingCommandMultiSegment(mainStreamer, targetDate, renderConfig=Ren
         # and the element in each column is either None or the indexed streamer's file(path) for that section of
         # time - should never be more than one
     numSegments = len(uniqueTimestampsSorted)-1
-    segmentFileMatrix:List[List[None|SourceFile]] = [[None for i in range(
-        len(allInputStreamers))] for j in range(numSegments)]
-    segmentSessionMatrix:List[List[None|List[Session]]] = [[None for i in range(
-        len(allInputStreamers))] for j in range(numSegments)]
-    for segIndex in range(numSegments):
-        # segmentsByStreamerIndex = segmentFileMatrix[segIndex]
-        segmentStartTime = uniqueTimestampsSorted[segIndex]
-        segmentEndTime = uniqueTimestampsSorted[segIndex+1]  # - 1
-
-        def addOverlappingSessions(sessionsList:List[Session], streamerIndex):
-            for session in sessionsList:
-                overlapStart = max(segmentStartTime, session.startTimestamp)
-                overlapEnd = min(segmentEndTime, session.endTimestamp)
-                overlapLength = max(0, overlapEnd - overlapStart)
-                if overlapLength > 0:
-                    if segmentFileMatrix[segIndex][streamerIndex] is None:
-                        segmentFileMatrix[segIndex][streamerIndex] = session.file
-                        segmentSessionMatrix[segIndex][streamerIndex] = [
-                            session]
-                    else:
-                        segmentSessionMatrix[segIndex][streamerIndex].append(
-                            session)
-                        logger.debug(f"{segmentSessionMatrix[segIndex][streamerIndex]}, {overlapStart}, {overlapEnd}, {segmentStartTime}, {segmentEndTime}")
-                        assert segmentFileMatrix[segIndex][streamerIndex] is session.file
-        addOverlappingSessions(mainSessionsOnTargetDate, 0)
-        if segmentFileMatrix[segIndex][0] is not None:
-            for streamerIndex in range(1, len(allInputStreamers)):
-                #addOverlappingSessions(inputSessionsByStreamer[allInputStreamers[i]], i)
-                for session in inputSessionsByStreamer[allInputStreamers[streamerIndex]]:
-                    if any((session.hasOverlapV2(mainSession, useChat=useChat, targetRange=(segmentStartTime, segmentEndTime)) for mainSession in segmentSessionMatrix[segIndex][0])):
-                        if segmentFileMatrix[segIndex][streamerIndex] is None:
-                            segmentFileMatrix[segIndex][streamerIndex] = session.file
-                            segmentSessionMatrix[segIndex][streamerIndex] = [
-                                session]
-                        else:
-                            segmentSessionMatrix[segIndex][streamerIndex].append(
-                                session)
-                            logger.debug(f"{segmentSessionMatrix[segIndex][streamerIndex]}")
-                            assert segmentFileMatrix[segIndex][streamerIndex] is session.file
-        else:
-            assert segIndex != 0
-            # Missing main streamer section, but the fact that we're not done yet means we have a small gap.
-            # Naively xtend previous segment's sessions to fill gap
-            for streamerIndex in range(1, len(allInputStreamers)):
-                streamerPrevFile = segmentFileMatrix[segIndex-1][streamerIndex]
-                if streamerPrevFile is not None:
-                    # Streamer was present in last segment, try to extend into this segment
-                    if streamerPrevFile.endTimestamp >= segmentEndTime:
-                        segmentFileMatrix[segIndex][streamerIndex] = streamerPrevFile
-                        segmentSessionMatrix[segIndex][streamerIndex] = []
-                        for session in inputSessionsByStreamer[allInputStreamers[streamerIndex]]:
-                            if session.startTimestamp < segmentEndTime and session.endTimestamp > segmentStartTime:
-                                segmentSessionMatrix[segIndex][streamerIndex].append(session)
-                        assert len(segmentSessionMatrix[segIndex][streamerIndex]) != 0
-                    else:
-                        #have to split this gap in two to accomodate partial file
-                        ...
-            
+    segmentFileMatrix, segmentSessionMatrix = buildSegmentMatrices(uniqueTimestampsSorted, allInputStreamers,
+                                                                   inputSessionsByStreamer, mainSessionsOnTargetDate, useChat)
+
     logger.info(f"Step 8: {allInputStreamers}")
     logger.trace(pformat(segmentFileMatrix))
     
@@ -987,8 +928,7 @@ def generateTilingCommandMultiSegment(mainStreamer, targetDate, renderConfig=Ren
                                 for j in range(gapStart, i):
                                     segmentStartTime = uniqueTimestampsSorted[j]
                                     segmentEndTime = uniqueTimestampsSorted[j]
-                                    missingSessions = [session for session in scanned.allStreamerSessions[streamer]
-                                                    if session.startTimestamp <= segmentEndTime and session.endTimestamp >= segmentStartTime]
+                                    missingSessions = scanned.sessionIndex.getOverlappingSessions(streamer, segmentStartTime, segmentEndTime)
                                     assert len(missingSessions) <= 1 or all((missingSessions[0].file == missingSessions[k].file for k in range(
                                         1, len(missingSessions)))), str(missingSessions)
                                     if len(missingSessions) >= 1:
@@ -1112,6 +1052,23 @@ def generateTilingCommandMultiSegment(mainStreamer, targetDate, renderConfig=Ren
             (session.game for item in segmentSessionMatrix[i][1:] if item is not None for session in item))
         logger.info(f"{tempMainGames}, {tempGames}, {str(convertToDatetime(uniqueTimestampsSorted[i]))[:-6]}, {str(convertToDatetime(uniqueTimestampsSorted[i+1]))[:-6]}")
 
+    return RenderPlan(mainStreamer, targetDate, allInputStreamers, uniqueTimestampsSorted, segmentFileMatrix, segmentSessionMatrix)
+
+
+def generateTilingCommandMultiSegment(mainStreamer, targetDate, renderConfig=RenderConfig(), outputFile=None) -> List[List[str]]:
+    plan = getRenderPlan(mainStreamer, targetDate, renderConfig, buildRenderPlan)
+    if plan is None:
+        return None
+    allInputStreamers = plan.allInputStreamers
+    uniqueTimestampsSorted = plan.uniqueTimestampsSorted
+    segmentFileMatrix = plan.segmentFileMatrix
+    segmentSessionMatrix = plan.segmentSessionMatrix
+    #########
+    useHardwareAcceleration = renderConfig.useHardwareAcceleration
+    maxHwaccelFiles = renderConfig.maxHwaccelFiles
+    cutMode = renderConfig.cutMode
+    ACTIVE_HWACCEL_VALUES = getActiveHwAccelValues()
+    #########
     # 12. Build a sorted array of unique filepaths from #8 - these will become the input stream indexes
     inputFilesSorted:List[SourceFile] = sorted(set([item for sublist in segmentFileMatrix for item in sublist if item is not None]),
                               key=lambda x: allInputStreamers.index(x.streamer))
@@ -1120,6 +1077,7 @@ def generateTilingCommandMultiSegment(mainStreamer, targetDate, renderConfig=Ren
         # 12b. Build input options in order
     inputOptions = []
     inputVideoInfo = []
+    prefetchVideoInfo(inputFilesSorted)
     for i in range(len(inputFilesSorted)):
         file = inputFilesSorted[i]
         if useHardwareAcceleration & HW_DECODE != 0:
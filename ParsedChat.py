@@ -1,108 +1,421 @@
-from typing import Dict, List, TYPE_CHECKING
+from bisect import bisect_left, bisect_right
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Tuple, TYPE_CHECKING
 from SharedUtils import convertToDatetime
 if TYPE_CHECKING:
     from SourceFile import SourceFile
+from collections import OrderedDict
+import hashlib
+import heapq
 import json
+import mmap
+import os
 import re
 from datetime import datetime
 from fuzzysearch import find_near_matches
 import scanned
+import FileCatalog
 
 from MTRConfig import getConfig
 
-def parsePlayersFromGroupMessage(message: str):
-    players = []
-    messageLowercase = message.lower()
-    streamerAliases = getConfig('streamerAliases')
-    for streamer in scanned.allFilesByStreamer.keys():
-        fuzzymatches = find_near_matches(
-            streamer.lower(), messageLowercase, max_l_dist=len(streamer)//5)
-        if len(fuzzymatches) > 0:
-            players.append(streamer)
-        elif streamer in streamerAliases.keys():
-            for alias in streamerAliases[streamer]:
-                fuzzymatches = find_near_matches(
-                    alias.lower(), messageLowercase, max_l_dist=len(alias)//5)
-                if len(fuzzymatches) > 0:
+def splitIntoPieces(name: str, pieceCount: int) -> List[str]:
+    pieces = []
+    for i in range(pieceCount):
+        pieces.append(name[len(name)*i//pieceCount:len(name)*(i+1)//pieceCount])
+    return pieces
+
+
+class PlayerMatcher:
+    """Finds which streamers are named in a group message, with the same results as running find_near_matches with
+    max_l_dist=len(name)//5 against every streamer name and alias. Since a name within k edits of some part of the
+    message must contain at least one of k+1 disjoint pieces of the name unchanged, the fuzzy search only has to run
+    for names where one of those pieces is found with a plain substring check."""
+    def __init__(self, knownStreamers: Iterable[str], streamerAliases: Dict[str, List[str]], cacheSize: int = 0):
+        # scanning and loading from the catalog find the streamers in different orders
+        knownStreamers = sorted(knownStreamers)
+        # streamer:[(lowercase name, max distance, pieces)], the streamer's own name first and then its aliases
+        self.namesByStreamer: List[Tuple[str, List[Tuple[str, int, List[str]]]]] = []
+        # Results only depend on the lowercased message and on the streamers and aliases, which this identifies
+        self.version = hashlib.sha1(json.dumps([knownStreamers,
+                                                sorted(((streamer, list(aliases)) for streamer, aliases in streamerAliases.items()))]
+                                               ).encode()).hexdigest()
+        self.cacheSize = cacheSize
+        self.cache: OrderedDict[str, Tuple[str]] = OrderedDict()  # lowercase message:players, least recently used first
+        self.newCacheEntries: Dict[str, List[str]] = {}  # not yet saved to the file catalog
+        self.cacheHits = 0
+        self.cacheMisses = 0
+        for streamer in knownStreamers:
+            names = [streamer] + list(streamerAliases.get(streamer, []))
+            namePatterns = []
+            for name in names:
+                name = name.lower()
+                maxDistance = len(name)//5
+                namePatterns.append((name, maxDistance, splitIntoPieces(name, maxDistance+1)))
+            self.namesByStreamer.append((streamer, namePatterns))
+
+    def findPlayers(self, message: str) -> List[str]:
+        messageLowercase = message.lower()
+        if self.cacheSize > 0:
+            cachedPlayers = self.cache.get(messageLowercase)
+            if cachedPlayers is not None:
+                self.cache.move_to_end(messageLowercase)
+                self.cacheHits += 1
+                return list(cachedPlayers)  # callers modify the list
+            self.cacheMisses += 1
+        players = self.matchPlayers(messageLowercase)
+        if self.cacheSize > 0:
+            self.addCacheEntries({messageLowercase: players}, isNew=True)
+        return players
+
+    def matchPlayers(self, messageLowercase: str) -> List[str]:
+        players = []
+        for streamer, namePatterns in self.namesByStreamer:
+            for name, maxDistance, pieces in namePatterns:
+                if not any((piece in messageLowercase for piece in pieces)):
+                    continue
+                # with no edits allowed, the only piece is the whole name, so it's already an exact match
+                if maxDistance == 0 or len(find_near_matches(name, messageLowercase, max_l_dist=maxDistance)) > 0:
                     players.append(streamer)
                     break
-    return players
+        return players
 
-class ParsedChat:
-    def __init__(self, parentFile: 'SourceFile', chatFile: str):
-        self.parentFile = parentFile
-        with open(chatFile) as chatFileContents:
-            chatJson = json.load(chatFileContents)
-        # print(chatFile)
-        nightbotGroupComments = []
-        groupEditComments = []
-        groups: List[Dict[str, datetime | List[str]]] = []
-        lastCommandComment = None
-        # self.chatJson = chatJson
-        # print(f"Parsed {len(chatJson)} comments")
-        for comment in chatJson:
-            commenter = comment['commenter']
-            user = commenter['displayName'] if commenter is not None else None
-            messageFragments = comment['message']['fragments']
-            if len(messageFragments) == 0:
+    def addCacheEntries(self, entries: Dict[str, List[str]], isNew: bool):
+        for messageLowercase, players in entries.items():
+            self.cache[messageLowercase] = tuple(players)
+            self.cache.move_to_end(messageLowercase)
+            if isNew:
+                self.newCacheEntries[messageLowercase] = players
+        while len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+
+    def takeNewCacheEntries(self) -> Dict[str, List[str]]:
+        entries = self.newCacheEntries
+        self.newCacheEntries = {}
+        return entries
+
+
+playerMatcherCache: Tuple[tuple, PlayerMatcher] | None = None
+
+# knownStreamers and streamerAliases can be passed in when called from a worker process, which has no scanned files or config
+def getPlayerMatcher(knownStreamers: Iterable[str] | None = None, streamerAliases: Dict[str, List[str]] | None = None,
+                     cacheSize: int | None = None, loadPersistedCache: bool = True) -> PlayerMatcher:
+    global playerMatcherCache
+    if streamerAliases is None:
+        streamerAliases = getConfig('streamerAliases')
+    if knownStreamers is None:
+        knownStreamers = scanned.allFilesByStreamer.keys()
+    # only rebuilt when the streamers or aliases change
+    key = (tuple(sorted(knownStreamers)), tuple(((streamer, tuple(aliases)) for streamer, aliases in sorted(streamerAliases.items()))))
+    cache = playerMatcherCache
+    if cache is None or cache[0] != key:
+        if cacheSize is None:
+            cacheSize = getConfig('internal.groupMessageCacheSize')
+        matcher = PlayerMatcher(key[0], streamerAliases, cacheSize)
+        if loadPersistedCache and cacheSize > 0:
+            matcher.addCacheEntries(FileCatalog.loadGroupMessages(matcher.version, cacheSize), isNew=False)
+        cache = (key, matcher)
+        playerMatcherCache = cache
+    return cache[1]
+
+
+def getGroupMessageCacheStats() -> Tuple[int, int, int]:
+    """Returns (hits, misses, entries) for the current player matcher"""
+    if playerMatcherCache is None:
+        return (0, 0, 0)
+    matcher = playerMatcherCache[1]
+    return (matcher.cacheHits, matcher.cacheMisses, len(matcher.cache))
+
+
+def initChatParseWorker(knownStreamers: List[str], streamerAliases: Dict[str, List[str]], cacheSize: int, cacheEntries: Dict[str, Tuple[str]]):
+    # seeded from the parent's cache, workers never touch the file catalog themselves
+    matcher = getPlayerMatcher(knownStreamers, streamerAliases, cacheSize, loadPersistedCache=False)
+    matcher.addCacheEntries(cacheEntries, isNew=False)
+    # a forked worker may have inherited the parent's matcher, only report what this worker does
+    matcher.cacheHits, matcher.cacheMisses = 0, 0
+    matcher.takeNewCacheEntries()
+
+
+def takeNewGroupMessageCacheEntries() -> Tuple[str, Dict[str, List[str]]] | None:
+    """Returns (version, entries) added to the cache since the last call, for saving to the file catalog"""
+    if playerMatcherCache is None:
+        return None
+    matcher = playerMatcherCache[1]
+    return matcher.version, matcher.takeNewCacheEntries()
+
+
+def toEpochTimestamp(timestamp: int | float | str | datetime) -> float:
+    if isinstance(timestamp, int) or isinstance(timestamp, float):
+        return float(timestamp)
+    return convertToDatetime(timestamp).timestamp()
+
+
+def parsePlayersFromGroupMessage(message: str, knownStreamers: Iterable[str] | None = None, streamerAliases: Dict[str, List[str]] | None = None):
+    return getPlayerMatcher(knownStreamers, streamerAliases).findPlayers(message)
+
+def trimComment(comment: dict) -> dict:
+    # only the fields parseChatComments looks at
+    commenter = comment['commenter']
+    message = comment['message']
+    return {'commenter': None if commenter is None else {'displayName': commenter['displayName']},
+            'message': {'fragments': [{'text': frag['text']} for frag in message['fragments']],
+                        'userBadges': [{'setID': badge['setID']} for badge in message['userBadges']]},
+            'contentOffsetSeconds': comment['contentOffsetSeconds'],
+            'createdAt': comment['createdAt']}
+
+
+def iterateChatComments(chatFile: str, chunkSize: int = 1024 * 1024) -> Iterator[dict]:
+    """Yields the (trimmed) comments of a rechat file one at a time, without decoding the whole array at once"""
+    decoder = json.JSONDecoder()
+    with open(chatFile) as chatFileContents:
+        buffer = ''
+        position = 0
+        started = False
+        endOfFile = False
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position >= len(buffer) or (not started and buffer[position] != '['):
+                if position < len(buffer):
+                    raise ValueError(f"Chat file {chatFile} does not contain a JSON array")
+                if endOfFile:
+                    raise ValueError(f"Chat file {chatFile} ended unexpectedly")
+                buffer = chatFileContents.read(chunkSize)
+                position = 0
+                endOfFile = len(buffer) == 0
+                continue
+            if not started:
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                comment, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # comment runs past the end of the buffer, pull in the next chunk and try again
+                if endOfFile:
+                    raise
+                nextChunk = chatFileContents.read(chunkSize)
+                endOfFile = len(nextChunk) == 0
+                buffer = buffer[position:] + nextChunk
+                position = 0
                 continue
-            firstMessageFrag = messageFragments[0]['text']
-            fullMessage = " ".join((frag['text'] for frag in messageFragments))
-            offset = comment['contentOffsetSeconds']
-            timestamp = comment['createdAt']
-            if user == 'Nightbot':
-                if lastCommandComment is not None and offset - lastCommandComment['contentOffsetSeconds'] < 4:
-                    nightbotGroupComments.append(comment)
-                    group = parsePlayersFromGroupMessage(fullMessage)
+            position = end
+            yield trimComment(comment)
+
+
+# Every comment parseChatFile can act on is from Nightbot or contains !who or !group (which covers !editcom and
+# !commands edit). Skipping all other comments is safe, since they never change the parser's state.
+# Kept as two patterns with literal prefixes, which re can search for much faster than one alternation or (?i)
+candidatePatterns = (re.compile(rb'Nightbot'),
+                     re.compile(rb'!(?:[Ww][Hh][Oo]|[Gg][Rr][Oo][Uu][Pp])'))
+MAX_COMMENT_BYTES = 1024 * 1024
+
+
+def decodeEnclosingComment(data: mmap.mmap, matchPosition: int, lowerBound: int):
+    """Finds the top level comment object containing matchPosition by trying each preceding '{' in turn.
+    Returns (comment, endPosition), or (None, None) if there isn't one."""
+    decoder = json.JSONDecoder()
+    searchEnd = matchPosition
+    while True:
+        start = data.rfind(b'{', lowerBound, searchEnd)
+        if start < 0:
+            return None, None
+        searchEnd = start
+        windowSize = 4096
+        comment = None
+        while windowSize <= MAX_COMMENT_BYTES:
+            # window may cut a multi-byte character at the end, which only matters if the object runs past it anyway
+            window = data[start:start+windowSize].decode('utf-8', errors='ignore')
+            try:
+                comment, endIndex = decoder.raw_decode(window)
+                break
+            except json.JSONDecodeError as ex:
+                truncated = ex.pos >= len(window) - 1 or ex.msg.startswith('Unterminated string')
+                if not truncated or start + windowSize >= len(data):
+                    break  # this '{' was inside a string, or is otherwise not the start of an object
+                windowSize *= 4
+        if isinstance(comment, dict) and 'contentOffsetSeconds' in comment.keys() and 'message' in comment.keys():
+            end = start + len(window[:endIndex].encode('utf-8'))
+            if end > matchPosition:
+                return comment, end
+
+
+def iterateCandidateComments(chatFile: str) -> Iterator[dict]:
+    """Yields the (trimmed) comments of a rechat file that could be relevant to parsing groups, in file order,
+    decoding only those instead of the whole file"""
+    with open(chatFile, 'rb') as chatFileContents:
+        if os.fstat(chatFileContents.fileno()).st_size == 0:
+            return
+        with mmap.mmap(chatFileContents.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            lastEnd = 0
+            matches = heapq.merge(*(pattern.finditer(data) for pattern in candidatePatterns), key=lambda x: x.start())
+            for match in matches:
+                if match.start() < lastEnd:
+                    continue  # already yielded the comment containing this match
+                comment, end = decodeEnclosingComment(data, match.start(), lastEnd)
+                if comment is None:
+                    continue
+                lastEnd = end
+                yield trimComment(comment)
+
+
+def loadChatComments(chatFile: str, parseMode: str) -> Iterable[dict]:
+    if parseMode == 'streaming':
+        return iterateChatComments(chatFile)
+    if parseMode == 'prefilter':
+        return iterateCandidateComments(chatFile)
+    with open(chatFile) as chatFileContents:
+        return json.load(chatFileContents)
+
+
+def parseChatFile(chatFile: str, streamer: str, knownStreamers: Iterable[str] | None = None, streamerAliases: Dict[str, List[str]] | None = None, parseMode: str | None = None):
+    """Returns (groups, nightbotGroupComments, groupEditComments)"""
+    if parseMode is None:
+        parseMode = getConfig('internal.chatParseMode')
+    chatJson = loadChatComments(chatFile, parseMode)
+    playerMatcher = getPlayerMatcher(knownStreamers, streamerAliases)
+    # print(chatFile)
+    nightbotGroupComments = []
+    groupEditComments = []
+    groups: List[Dict[str, datetime | List[str]]] = []
+    lastCommandComment = None
+    # self.chatJson = chatJson
+    # print(f"Parsed {len(chatJson)} comments")
+    for comment in chatJson:
+        commenter = comment['commenter']
+        user = commenter['displayName'] if commenter is not None else None
+        messageFragments = comment['message']['fragments']
+        if len(messageFragments) == 0:
+            continue
+        firstMessageFrag = messageFragments[0]['text']
+        fullMessage = " ".join((frag['text'] for frag in messageFragments))
+        offset = comment['contentOffsetSeconds']
+        timestamp = comment['createdAt']
+        if user == 'Nightbot':
+            if lastCommandComment is not None and offset - lastCommandComment['contentOffsetSeconds'] < 4:
+                nightbotGroupComments.append(comment)
+                group = playerMatcher.findPlayers(fullMessage)
+                # print(fullMessage)
+                # print(group)
+                if streamer in group:
+                    group.remove(streamer)
+                convertedTime = datetime.fromisoformat(timestamp)
+                # if len(groups) == 0 or set(group) != set(groups[-1].group):
+                groups.append({'group': group, 'time': convertedTime})
+            lastCommandComment = None
+        else:
+            if firstMessageFrag.lower().strip() in ('!who', '!group'):
+                lastCommandComment = comment
+            else:
+                sub = re.sub(r'\s+', ' ', fullMessage.lower())
+                if (any((badge['setID'] == 'moderator' for badge in comment['message']['userBadges'])) and
+                        (sub.startswith('!editcom !group') or sub.startswith('!commands edit !group'))):
+                    groupEditComments.append(comment)
+                    newCommandText = fullMessage[6 +
+                                                 fullMessage.lower().index('!group'):]
+                    group = playerMatcher.findPlayers(newCommandText)
+                    if streamer in group:
+                        group.remove(streamer)
                     # print(fullMessage)
-                    # print(group)
-                    if self.parentFile.streamer in group:
-                        group.remove(self.parentFile.streamer)
+                    # print(newCommandText)
+                    # print(sorted(group), end='\n\n')
                     convertedTime = datetime.fromisoformat(timestamp)
-                    # if len(groups) == 0 or set(group) != set(groups[-1].group):
                     groups.append({'group': group, 'time': convertedTime})
-                lastCommandComment = None
-            else:
-                if firstMessageFrag.lower().strip() in ('!who', '!group'):
-                    lastCommandComment = comment
-                else:
-                    sub = re.sub(r'\s+', ' ', fullMessage.lower())
-                    if (any((badge['setID'] == 'moderator' for badge in comment['message']['userBadges'])) and
-                            (sub.startswith('!editcom !group') or sub.startswith('!commands edit !group'))):
-                        groupEditComments.append(comment)
-                        newCommandText = fullMessage[6 +
-                                                     fullMessage.lower().index('!group'):]
-                        group = parsePlayersFromGroupMessage(newCommandText)
-                        if self.parentFile.streamer in group:
-                            group.remove(self.parentFile.streamer)
-                        # print(fullMessage)
-                        # print(newCommandText)
-                        # print(sorted(group), end='\n\n')
-                        convertedTime = datetime.fromisoformat(timestamp)
-                        groups.append({'group': group, 'time': convertedTime})
-        self.nightbotGroupComments = nightbotGroupComments
-        self.groupEditComments = groupEditComments
-        self.groups = groups
+    return groups, nightbotGroupComments, groupEditComments
+
+
+def parseChatGroups(chatFile: str, streamer: str, knownStreamers: List[str], streamerAliases: Dict[str, List[str]], parseMode: str):
+    """Process pool entry point, only sends the groups back since the matched comments are only used for debugging.
+    Returns (groups, new cache entries, cache hits, cache misses)"""
+    groups = parseChatFile(chatFile, streamer, knownStreamers, streamerAliases, parseMode)[0]
+    matcher = getPlayerMatcher(knownStreamers, streamerAliases)
+    cacheHits, cacheMisses = matcher.cacheHits, matcher.cacheMisses
+    matcher.cacheHits, matcher.cacheMisses = 0, 0
+    return groups, matcher.takeNewCacheEntries(), cacheHits, cacheMisses
+
+
+class ParsedChat:
+    def __init__(self, parentFile: 'SourceFile', chatFile: str | None = None, groups: List[Dict[str, datetime | List[str]]] | None = None):
+        self.parentFile = parentFile
+        if groups is not None:
+            # parsed elsewhere (worker process or file catalog), the matched comments themselves aren't kept
+            self.nightbotGroupComments = []
+            self.groupEditComments = []
+            self.groups = groups
+        else:
+            groups, nightbotGroupComments, groupEditComments = parseChatFile(chatFile, parentFile.streamer)
+            self.nightbotGroupComments = nightbotGroupComments
+            self.groupEditComments = groupEditComments
+            self.groups = groups
+        self.buildTimeline()
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        if 'groupTimes' not in state.keys():  # from the legacy pickle data file
+            self.buildTimeline()
+
+    def buildTimeline(self):
+        # stable sort, so groups with the same time keep their chat order
+        sortedGroups = sorted(self.groups, key=lambda x: x['time'])
+        self.groupTimes: List[float] = [group['time'].timestamp() for group in sortedGroups]
+        self.groupPlayers: List[List[str]] = [group['group'] for group in sortedGroups]
+        self.groupMembers: List[FrozenSet[str]] = [frozenset(players) for players in self.groupPlayers]
+        self.firstNonemptyGroupIndex: int | None = next((i for i, players in enumerate(self.groupPlayers) if len(players) > 0), None)
+        # streamer:running total of time spent in the group up to each entry, built on first use
+        self.inclusionPrefixSums: Dict[str, List[float]] = {}
+
+    def getInclusionPrefixSums(self, streamer: str) -> List[float]:
+        if streamer not in self.inclusionPrefixSums.keys():
+            prefixSums = [0.0]
+            for i in range(len(self.groupTimes)-1):
+                duration = self.groupTimes[i+1] - self.groupTimes[i] if streamer in self.groupMembers[i] else 0
+                prefixSums.append(prefixSums[-1] + duration)
+            self.inclusionPrefixSums[streamer] = prefixSums
+        return self.inclusionPrefixSums[streamer]
 
     def getGroupAtTimestamp(self, timestamp: int | float | str | datetime) -> List[str]:
-        dt = convertToDatetime(timestamp)
-        lastMatch = []
-        for group in self.groups:
-            if group['time'] < dt:
-                lastMatch = group['group']
-            else:
-                break
-        return lastMatch
+        index = bisect_left(self.groupTimes, toEpochTimestamp(timestamp))
+        return self.groupPlayers[index-1] if index > 0 else []
 
     def getAllPlayersOverRange(self, startTimestamp: int | float | str | datetime, endTimestamp: int | float | str | datetime) -> List[str]:
-        start = convertToDatetime(startTimestamp)
-        end = convertToDatetime(endTimestamp)
+        start = toEpochTimestamp(startTimestamp)
+        end = toEpochTimestamp(endTimestamp)
         allPlayers = set()
-        lastMatch = []
-        for group in self.groups:
-            if len(lastMatch) == 0 and group['time'] < start:
-                # get last group before this range, in case no commands are found
-                lastMatch = group['group']
-            if start < group['time'] < end:
-                allPlayers.update(group['group'])  # command is within range,
-        return allPlayers if len(allPlayers) > 0 else lastMatch
+        for i in range(bisect_right(self.groupTimes, start), bisect_left(self.groupTimes, end)):
+            allPlayers.update(self.groupMembers[i])  # command is within range
+        if len(allPlayers) > 0:
+            return allPlayers
+        # otherwise fall back to the first non-empty group before this range
+        firstIndex = self.firstNonemptyGroupIndex
+        if firstIndex is not None and self.groupTimes[firstIndex] < start:
+            return self.groupPlayers[firstIndex]
+        return []
+
+    def hasStreamerOverlap(self, streamer: str, overlapStart: float, overlapEnd: float, inclusionThreshold: float) -> bool:
+        """Whether the streamer is in the group for at least inclusionThreshold of the overlap time"""
+        times = self.groupTimes
+        members = self.groupMembers
+        if len(times) == 0:
+            return False
+        if overlapEnd <= times[0]:
+            return streamer in members[0]
+        if times[-1] <= overlapStart:
+            return streamer in members[-1]
+        # If we haven't returned yet, we have at least one group entry within the overlap time,
+        # we need to calculate how much of the overlap time has the matching streamer
+        firstContained = bisect_left(times, overlapStart)
+        firstTrailing = bisect_left(times, overlapEnd)
+        if firstContained == firstTrailing:
+            # no entries within the overlap, use the one before it (or after it, if there isn't one)
+            return streamer in members[firstContained-1 if firstContained > 0 else firstTrailing]
+        lastContained = firstTrailing - 1
+        inclusionDuration: float = 0
+        leadingEntry = firstContained-1 if firstContained > 0 else firstContained
+        if streamer in members[leadingEntry]:
+            inclusionDuration += times[firstContained] - overlapStart
+        prefixSums = self.getInclusionPrefixSums(streamer)
+        inclusionDuration += prefixSums[lastContained] - prefixSums[firstContained]
+        if streamer in members[lastContained]:
+            inclusionDuration += overlapEnd - times[lastContained]
+        inclusionFraction = inclusionDuration / (overlapEnd - overlapStart)
+        return inclusionFraction >= inclusionThreshold
@@ -0,0 +1,122 @@
+from concurrent.futures import Future
+import itertools
+import json
+import os
+import queue
+import threading
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+from MTRConfig import getConfig
+import FileCatalog
+from ProcessEngine import getProcessEngine
+
+from MTRLogging import getLogger
+logger = getLogger('ProbeScheduler')
+
+if TYPE_CHECKING:
+    from SourceFile import SourceFile
+
+PROBE_TIMEOUT_SECONDS = 120  # a probe stuck on an unreachable network file would otherwise hold its thread forever
+
+# the only ffprobe fields used when building render commands, everything else is dropped before caching
+PROBE_FORMAT_FIELDS = ('duration', 'format_name')
+PROBE_STREAM_FIELDS = ('index', 'codec_type', 'codec_name', 'width', 'height', 'avg_frame_rate', 'sample_rate', 'duration')
+
+
+def trimProbeInfo(info: dict) -> dict:
+    return {'format': {key: value for key, value in info.get('format', {}).items() if key in PROBE_FORMAT_FIELDS},
+            'streams': [{key: value for key, value in stream.items() if key in PROBE_STREAM_FIELDS}
+                        for stream in info.get('streams', [])]}
+
+
+def probeVideoFile(videoFile: str):
+    probe = getProcessEngine().start(['ffprobe', '-v', 'quiet',
+                                      '-print_format', 'json=c=1',
+                                      '-show_format', '-show_streams',
+                                      videoFile], captureStdout=True, timeout=PROBE_TIMEOUT_SECONDS)
+    if probe.wait() != 0:
+        return None
+    info = json.loads(probe.stdout.decode())
+    return trimProbeInfo(info)
+
+
+def getVideoInfo(videoFile: str):
+    try:
+        stat = os.stat(videoFile)
+    except OSError:
+        return None
+    # stat before probing, so a file that changes in the meantime just gets probed again next time
+    probeKey = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+    info = FileCatalog.loadProbe(videoFile, *probeKey)
+    if info is None:
+        info = probeVideoFile(videoFile)
+        if info is not None:
+            FileCatalog.saveProbe(videoFile, *probeKey, info, commit=True)
+    return info
+
+
+# probes needed to build render commands go ahead of background prewarming
+PRIORITY_RENDER = 0
+PRIORITY_BACKGROUND = 1
+
+probeQueue: queue.PriorityQueue[Tuple[int, int, str, Future]] = queue.PriorityQueue()
+probeSequence = itertools.count()
+# path:(future, priority) of a probe that's queued or running, so the same file is never probed twice at once
+inFlightProbes: Dict[str, Tuple[Future, int]] = {}
+probeWorkerThreads: List[threading.Thread] = []
+probeSchedulerLock = threading.RLock()
+
+
+def probeWorker():
+    while True:
+        _, _, videoFile, future = probeQueue.get()
+        with probeSchedulerLock:
+            # already started from a higher priority entry for the same file
+            if future.running() or future.done() or not future.set_running_or_notify_cancel():
+                continue
+        try:
+            future.set_result(getVideoInfo(videoFile))
+        except Exception as ex:
+            future.set_exception(ex)
+        finally:
+            with probeSchedulerLock:
+                if videoFile in inFlightProbes.keys() and inFlightProbes[videoFile][0] is future:
+                    del inFlightProbes[videoFile]
+
+
+def submitProbe(videoFile: str, priority: int = PRIORITY_BACKGROUND) -> Future:
+    with probeSchedulerLock:
+        while len(probeWorkerThreads) < getConfig('internal.probeWorkers'):
+            thread = threading.Thread(target=probeWorker, name=f"probeWorker{len(probeWorkerThreads)}", daemon=True)
+            probeWorkerThreads.append(thread)
+            thread.start()
+        if videoFile in inFlightProbes.keys():
+            future, queuedPriority = inFlightProbes[videoFile]
+            if priority >= queuedPriority or future.running():
+                return future
+        else:
+            future = Future()
+        # a second entry for a file that's already queued, whichever is reached first runs the probe
+        inFlightProbes[videoFile] = (future, priority)
+        probeQueue.put((priority, next(probeSequence), videoFile, future))
+        return future
+
+
+def prewarmProbeCache(files: List['SourceFile'], wait: bool = True) -> int:
+    """Queues every video file to be probed. Returns how many have probe info, or 0 without waiting."""
+    futures = [submitProbe(file.videoFile) for file in files]
+    if len(futures) == 0 or not wait:
+        return 0
+    logger.info(f"Probing {len(futures)} video files")
+    probedCount = sum((future.result() is not None for future in futures))
+    logger.info(f"Done probing video files, {len(futures) - probedCount} could not be probed")
+    return probedCount
+
+
+def prefetchVideoInfo(files: List['SourceFile']):
+    """Probes all of the files at once instead of one at a time as getVideoFileInfo is called on each"""
+    pendingFiles = [file for file in files if file.videoInfo is None]
+    futures = [submitProbe(file.videoFile if file.localVideoFile is None else file.localVideoFile, PRIORITY_RENDER)
+               for file in pendingFiles]
+    for file, future in zip(pendingFiles, futures):
+        file.videoInfo = future.result()
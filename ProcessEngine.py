@@ -0,0 +1,169 @@
+import asyncio
+import subprocess
+import threading
+from concurrent.futures import Future
+from typing import Callable, List, Set
+
+from MTRLogging import getLogger
+logger = getLogger('ProcessEngine')
+
+TERMINATE_GRACE_SECONDS = 10  # before a process that ignores terminate gets killed
+
+
+class CancelToken:
+    """Stops every process started with it, from any thread. Processes started after cancelling are stopped right away."""
+    def __init__(self):
+        self.cancelled = False
+        self.handles: Set['ProcessHandle'] = set()
+        self.lock = threading.Lock()
+
+    def register(self, handle: 'ProcessHandle'):
+        with self.lock:
+            self.handles.add(handle)
+            cancelled = self.cancelled
+        if cancelled:
+            handle.cancel()
+
+    def unregister(self, handle: 'ProcessHandle'):
+        with self.lock:
+            self.handles.discard(handle)
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            handles = list(self.handles)
+        for handle in handles:
+            handle.cancel()
+
+
+class ProcessHandle:
+    def __init__(self, engine: 'ProcessEngine', command: List[str]):
+        self.engine = engine
+        self.command = command
+        self.process: asyncio.subprocess.Process | None = None
+        self.future: Future | None = None
+        self.stdout = b''  # only filled in with captureStdout
+        self.cancelRequested = False
+        self.timedOut = False
+
+    def wait(self, timeout: float | None = None) -> int:
+        """Blocks until the process exits and returns its return code"""
+        return self.future.result(timeout)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def cancel(self):
+        """Terminates the process, and kills it if it's still running after TERMINATE_GRACE_SECONDS"""
+        self.cancelRequested = True
+        asyncio.run_coroutine_threadsafe(self.stop(), self.engine.loop)
+
+    async def stop(self):
+        if self.process is None or self.process.returncode is not None:
+            return
+        try:
+            self.process.terminate()
+            await asyncio.wait_for(self.process.wait(), TERMINATE_GRACE_SECONDS)
+        except ProcessLookupError:
+            pass
+        except asyncio.TimeoutError:
+            logger.info(f"{self} did not stop within {TERMINATE_GRACE_SECONDS} seconds of terminating, killing instead")
+            self.process.kill()
+            await self.process.wait()
+
+    def __repr__(self):
+        return f"ProcessHandle(command={self.command[0]}, pid={self.process.pid if self.process is not None else None})"
+
+
+class ProcessEngine:
+    """Runs ffmpeg and ffprobe child processes on a single asyncio event loop in its own thread, so any number of them
+    can be supervised without a thread blocked on each one. Worker threads start processes and wait on the returned
+    handles, output is streamed to callbacks and log files as it arrives."""
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.handles: Set[ProcessHandle] = set()
+        self.lock = threading.Lock()
+        self.shutdownToken = CancelToken()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='process engine', daemon=True)
+        self.thread.start()
+
+    def start(self, command: List, onStdoutLine: Callable[[bytes], None] | None = None, logPath: str | None = None,
+              captureStdout: bool = False, timeout: float | None = None, cancelToken: CancelToken | None = None) -> ProcessHandle:
+        """Starts the command, with each line of its output passed to onStdoutLine (called on the event loop thread, so
+        it has to be quick) or kept in handle.stdout, and stderr appended to logPath. Stopped after timeout seconds."""
+        handle = ProcessHandle(self, [str(x) for x in command])
+        with self.lock:
+            self.handles.add(handle)
+        handle.future = asyncio.run_coroutine_threadsafe(self.runProcess(handle, onStdoutLine, logPath, captureStdout, timeout),
+                                                         self.loop)
+        tokens = [token for token in (self.shutdownToken, cancelToken) if token is not None]
+        for token in tokens:
+            token.register(handle)
+
+        def onDone(_):
+            with self.lock:
+                self.handles.discard(handle)
+            for token in tokens:
+                token.unregister(handle)
+        handle.future.add_done_callback(onDone)
+        return handle
+
+    async def readOutput(self, handle: ProcessHandle, onStdoutLine: Callable[[bytes], None] | None, captureStdout: bool):
+        if handle.process.stdout is not None:
+            if captureStdout:
+                handle.stdout = await handle.process.stdout.read()
+            else:
+                async for line in handle.process.stdout:
+                    try:
+                        onStdoutLine(line)
+                    except Exception as ex:
+                        logger.warning(f"Error handling output of {handle}: {ex}")
+        await handle.process.wait()
+
+    async def runProcess(self, handle: ProcessHandle, onStdoutLine: Callable[[bytes], None] | None, logPath: str | None,
+                         captureStdout: bool, timeout: float | None) -> int:
+        logFile = open(logPath, 'a') if logPath is not None else None
+        try:
+            readStdout = captureStdout or onStdoutLine is not None
+            handle.process = await asyncio.create_subprocess_exec(*handle.command,
+                                                                  stdin=subprocess.DEVNULL,
+                                                                  stdout=subprocess.PIPE if readStdout else subprocess.DEVNULL,
+                                                                  stderr=logFile if logFile is not None else subprocess.DEVNULL)
+            if handle.cancelRequested:
+                # cancelled before it got started
+                await handle.stop()
+            try:
+                await asyncio.wait_for(self.readOutput(handle, onStdoutLine, captureStdout), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"{handle} timed out after {timeout} seconds, stopping it")
+                handle.timedOut = True
+                await handle.stop()
+            return handle.process.returncode
+        finally:
+            if logFile is not None:
+                logFile.close()
+
+    def getActiveHandles(self) -> List[ProcessHandle]:
+        with self.lock:
+            return list(self.handles)
+
+    def terminateAll(self):
+        """Stops every running process and waits for them to exit"""
+        self.shutdownToken.cancel()
+        for handle in self.getActiveHandles():
+            try:
+                handle.wait()
+            except Exception as ex:
+                logger.warning(f"Error stopping {handle}: {ex}")
+
+
+processEngine: ProcessEngine | None = None
+processEngineLock = threading.Lock()
+
+
+def getProcessEngine() -> ProcessEngine:
+    global processEngine
+    with processEngineLock:
+        if processEngine is None:
+            processEngine = ProcessEngine()
+        return processEngine
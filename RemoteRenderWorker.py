@@ -0,0 +1,115 @@
+# Renders chunk commands handed out by a MultiTwitchRenderer render coordinator (see RenderCoordinator.py).
+# Runs on its own, without the config file: the input files have to be reachable at the same paths as on the
+# coordinator (e.g. the same network share mounted in the same place), the rendered chunk is uploaded back.
+import argparse
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import time
+from collections import deque
+from typing import Any, Dict
+
+logger = logging.getLogger('RemoteRenderWorker')
+
+LOG_LINES = 50  # lines of ffmpeg output sent back with the result
+
+
+class CoordinatorConnection:
+    def __init__(self, host: str, port: int):
+        self.socket = socket.create_connection((host, port))
+        self.file = self.socket.makefile('rwb')
+
+    def send(self, message: Dict[str, Any], uploadPath: str | None = None) -> Dict[str, Any]:
+        self.file.write((json.dumps(message) + '\n').encode())
+        if uploadPath is not None:
+            with open(uploadPath, 'rb') as uploadFile:
+                shutil.copyfileobj(uploadFile, self.file)
+        self.file.flush()
+        reply = self.file.readline()
+        if len(reply) == 0:
+            raise ConnectionError("Coordinator closed the connection")
+        return json.loads(reply)
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+def runJob(connection: CoordinatorConnection, workerName: str, job: Dict[str, Any], ffmpegPath: str, tempDir: str):
+    jobId = job['jobId']
+    command = list(job['command'])
+    command[0] = ffmpegPath
+    outpath = os.path.join(tempDir, f"{workerName} job {jobId}{os.path.splitext(command[-1])[1]}")
+    command[-1] = outpath
+    logger.info(f"Running job {jobId}: {command}")
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    lastLines = deque(maxlen=LOG_LINES)
+    buffer = b''
+    lost = False
+    # ffmpeg ends its stats lines with \r, every -stats_period seconds
+    for chunk in iter(lambda: process.stderr.read1(4096), b''):
+        lines = (buffer + chunk).replace(b'\r', b'\n').split(b'\n')
+        buffer = lines.pop()
+        for line in (line.decode(errors='replace').strip() for line in lines):
+            if len(line) == 0:
+                continue
+            lastLines.append(line)
+            if line.startswith('frame=') or line.startswith('size='):
+                if connection.send({'type': 'progress', 'worker': workerName, 'jobId': jobId, 'line': line})['type'] == 'lost':
+                    logger.warning(f"Lost the lease on job {jobId}, stopping it")
+                    lost = True
+                    process.terminate()
+                    break
+        if lost:
+            break
+    returncode = process.wait()
+    try:
+        if lost:
+            return
+        if buffer.strip() != b'':
+            lastLines.append(buffer.decode(errors='replace').strip())
+        size = os.path.getsize(outpath) if returncode == 0 else 0
+        reply = connection.send({'type': 'result', 'worker': workerName, 'jobId': jobId, 'returncode': returncode,
+                                 'size': size, 'log': list(lastLines)},
+                                uploadPath=outpath if returncode == 0 else None)
+        logger.info(f"Job {jobId} finished with return code {returncode}, coordinator replied {reply['type']}")
+    finally:
+        if os.path.isfile(outpath):
+            os.remove(outpath)
+
+
+def workerLoop(host: str, port: int, workerName: str, ffmpegPath: str, tempDir: str, pollInterval: float):
+    connection = None
+    while True:
+        try:
+            if connection is None:
+                connection = CoordinatorConnection(host, port)
+                logger.info(f"Connected to coordinator at {host}:{port}")
+            reply = connection.send({'type': 'lease', 'worker': workerName})
+            if reply['type'] == 'job':
+                runJob(connection, workerName, reply, ffmpegPath, tempDir)
+            else:
+                time.sleep(pollInterval)
+        except (ConnectionError, OSError) as ex:
+            logger.warning(f"Lost connection to coordinator: {ex}")
+            if connection is not None:
+                connection.close()
+                connection = None
+            time.sleep(pollInterval)
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser(description="Remote render worker for MultiTwitchRenderer")
+    argParser.add_argument('--host', default='127.0.0.1', help="Host the render coordinator listens on")
+    argParser.add_argument('--port', type=int, required=True, help="Port the render coordinator listens on (renderCoordinatorPort)")
+    argParser.add_argument('--name', dest='workerName', default=socket.gethostname(), help="Name the coordinator knows this worker by")
+    argParser.add_argument('--ffmpeg', dest='ffmpegPath', default='ffmpeg', help="Path to ffmpeg on this machine")
+    argParser.add_argument('--temp-dir', dest='tempDir', default='./remoteTemp', help="Where chunks are rendered before they are uploaded")
+    argParser.add_argument('--poll-interval', dest='pollInterval', type=float, default=5, help="Seconds to wait when there is no work")
+    args = argParser.parse_args()
+    logging.basicConfig(format='%(name)s : %(levelname)s [%(asctime)s] %(message)s', level=logging.INFO)
+    os.makedirs(args.tempDir, exist_ok=True)
+    workerLoop(args.host, args.port, args.workerName, args.ffmpegPath, args.tempDir, args.pollInterval)
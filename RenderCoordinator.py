@@ -0,0 +1,231 @@
+import json
+import socketserver
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List
+
+from MTRConfig import getConfig
+
+from MTRLogging import getLogger
+logger = getLogger('RenderCoordinator')
+
+# Remote render workers (see RemoteRenderWorker.py) connect over TCP and send one JSON object per line:
+#   {"type": "lease", "worker": name}
+#       -> {"type": "job", "jobId": id, "command": [...], "leaseSeconds": n} or {"type": "none"}
+#   {"type": "progress", "worker": name, "jobId": id, "line": ffmpeg stats line}
+#       -> {"type": "ok"}, renews the lease, or {"type": "lost"} if the lease was given to another worker
+#   {"type": "result", "worker": name, "jobId": id, "returncode": n, "size": bytes, "log": [last output lines]}
+#       followed by size bytes of the output file -> {"type": "ok"} or {"type": "lost"}
+# The last element of the command is the output path, the worker renders to a path of its own and uploads the file.
+# There is no authentication, anyone who can connect can take jobs and write the output files they were given.
+
+MAX_ATTEMPTS = 3  # leases that can expire before the job fails
+
+
+class RemoteJob:
+    def __init__(self, jobId: int, command: List[str], logPath: str, onProgress: Callable[[str], None] | None = None):
+        self.jobId = jobId
+        self.command = command
+        self.outpath = command[-1]
+        self.logPath = logPath
+        self.onProgress = onProgress  # called with each stats line the worker reports
+        self.state = 'QUEUED'  # QUEUED, LEASED, UPLOADING, FINISHED, ERRORED
+        self.worker: str | None = None
+        self.leaseExpiry = 0.
+        self.queuedTime = time.time()  # when it last went back to waiting for a worker
+        self.attempts = 0
+        self.returncode: int | None = None
+        self.finished = threading.Event()
+
+    def __repr__(self):
+        return f"RemoteJob(jobId={self.jobId}, outpath={self.outpath}, state={self.state}, worker={self.worker}, attempts={self.attempts})"
+
+
+def readUpload(rfile, size: int, outFile=None):
+    remaining = size
+    while remaining > 0:
+        chunk = rfile.read(min(remaining, 1 << 20))
+        if len(chunk) == 0:
+            raise ConnectionError("Connection closed during upload")
+        if outFile is not None:
+            outFile.write(chunk)
+        remaining -= len(chunk)
+
+
+class CoordinatorRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        coordinator: RenderCoordinator = self.server.coordinator
+        try:
+            for line in self.rfile:
+                if len(line.strip()) == 0:
+                    continue
+                reply = coordinator.handleMessage(json.loads(line), self.rfile)
+                self.wfile.write((json.dumps(reply) + '\n').encode())
+                self.wfile.flush()
+        except (ConnectionError, json.JSONDecodeError) as ex:
+            logger.info(f"Connection from {self.client_address} closed: {ex}")
+
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class RenderCoordinator:
+    """Hands chunk commands out to remote render workers. A worker holds a lease on its job that it renews by reporting
+    progress, and jobs whose lease runs out are queued again for another worker."""
+    def __init__(self, host: str, port: int, leaseSeconds: int, queueSeconds: int):
+        self.leaseSeconds = leaseSeconds
+        self.queueSeconds = queueSeconds
+        self.jobs: Dict[int, RemoteJob] = {}
+        self.queuedJobs: Deque[RemoteJob] = deque()
+        self.nextJobId = 0
+        self.lastWorkerContact = 0.
+        self.lock = threading.RLock()
+        self.server = CoordinatorServer((host, port), CoordinatorRequestHandler)
+        self.server.coordinator = self
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='render coordinator', daemon=True).start()
+        threading.Thread(target=self.leaseWorker, name='render coordinator leases', daemon=True).start()
+        logger.info(f"Render coordinator listening on {self.server.server_address}")
+
+    def submit(self, command: List[str], logPath: str, onProgress: Callable[[str], None] | None = None) -> RemoteJob:
+        with self.lock:
+            job = RemoteJob(self.nextJobId, command, logPath, onProgress)
+            self.nextJobId += 1
+            self.jobs[job.jobId] = job
+            self.queuedJobs.append(job)
+            return job
+
+    def waitForJob(self, job: RemoteJob) -> int | None:
+        """Returns the return code of the job, or None if no worker leased it within queueSeconds and it was taken back
+        to be rendered locally"""
+        while not job.finished.wait(5 if self.queueSeconds > 0 else None):
+            with self.lock:
+                if job.state == 'QUEUED' and time.time() - job.queuedTime > self.queueSeconds:
+                    logger.warning(f"No remote worker took {job} within {self.queueSeconds} seconds, rendering it locally")
+                    self.queuedJobs.remove(job)
+                    del self.jobs[job.jobId]
+                    return None
+        return job.returncode
+
+    def finishJob(self, job: RemoteJob, returncode: int):
+        with self.lock:
+            job.returncode = returncode
+            job.state = 'FINISHED' if returncode == 0 else 'ERRORED'
+            del self.jobs[job.jobId]
+        job.finished.set()
+
+    def getLeasedJob(self, message: Dict[str, Any]) -> RemoteJob | None:
+        with self.lock:
+            job = self.jobs.get(message.get('jobId'))
+            if job is None or job.state != 'LEASED' or job.worker != message.get('worker'):
+                return None
+            return job
+
+    def hasWorkers(self) -> bool:
+        """Whether any worker was in touch within the lease time. Idle workers keep polling for jobs, so chunks are only
+        sent to the coordinator while this is True."""
+        with self.lock:
+            return time.time() - self.lastWorkerContact < self.leaseSeconds
+
+    def handleMessage(self, message: Dict[str, Any], rfile) -> Dict[str, Any]:
+        messageType = message.get('type')
+        with self.lock:
+            self.lastWorkerContact = time.time()
+        if messageType == 'lease':
+            with self.lock:
+                if len(self.queuedJobs) == 0:
+                    return {'type': 'none'}
+                job = self.queuedJobs.popleft()
+                job.state = 'LEASED'
+                job.worker = message['worker']
+                job.leaseExpiry = time.time() + self.leaseSeconds
+                job.attempts += 1
+            logger.info(f"Leased {job} to {job.worker}")
+            return {'type': 'job', 'jobId': job.jobId, 'command': job.command, 'leaseSeconds': self.leaseSeconds}
+        elif messageType == 'progress':
+            with self.lock:
+                job = self.getLeasedJob(message)
+                if job is None:
+                    return {'type': 'lost'}
+                job.leaseExpiry = time.time() + self.leaseSeconds
+            with open(job.logPath, 'a') as logFile:
+                logFile.write(f"[{job.worker}] {message.get('line', '')}\n")
+            if job.onProgress is not None:
+                job.onProgress(message.get('line', ''))
+            return {'type': 'ok'}
+        elif messageType == 'result':
+            size = message.get('size', 0)
+            with self.lock:
+                job = self.getLeasedJob(message)
+                if job is not None:
+                    job.state = 'UPLOADING'  # keeps the lease from expiring in the middle of the upload
+            if job is None:
+                # still have to read the upload to keep the connection usable
+                readUpload(rfile, size)
+                return {'type': 'lost'}
+            returncode = message.get('returncode', -1)
+            with open(job.logPath, 'a') as logFile:
+                for line in message.get('log', []):
+                    logFile.write(f"[{job.worker}] {line}\n")
+            try:
+                if returncode == 0:
+                    with open(job.outpath, 'wb') as outFile:
+                        readUpload(rfile, size, outFile)
+                else:
+                    readUpload(rfile, size)
+            except Exception:
+                # worker went away mid upload, let another one have the job
+                self.requeue(job)
+                raise
+            logger.info(f"{job} finished on {job.worker} with return code {returncode}")
+            self.finishJob(job, returncode)
+            return {'type': 'ok'}
+        return {'type': 'error', 'message': f"Unknown message type {messageType}"}
+
+    def requeue(self, job: RemoteJob):
+        with self.lock:
+            if job.attempts >= MAX_ATTEMPTS:
+                logger.error(f"{job} failed, no worker finished it after {job.attempts} attempts")
+                self.finishJob(job, -1)
+                return
+            job.state = 'QUEUED'
+            job.worker = None
+            job.queuedTime = time.time()
+            self.queuedJobs.appendleft(job)
+
+    def leaseWorker(self):
+        while True:
+            time.sleep(5)
+            now = time.time()
+            with self.lock:
+                expiredJobs = [job for job in self.jobs.values() if job.state == 'LEASED' and job.leaseExpiry < now]
+                for job in expiredJobs:
+                    logger.warning(f"Lease on {job} expired, assuming {job.worker} was lost")
+                    self.requeue(job)
+
+    def getJobInfo(self) -> List[RemoteJob]:
+        with self.lock:
+            return list(self.jobs.values())
+
+
+renderCoordinator: RenderCoordinator | None = None
+renderCoordinatorLock = threading.Lock()
+
+
+def getRenderCoordinator() -> RenderCoordinator | None:
+    """The coordinator remote workers connect to, or None if remote rendering is disabled"""
+    global renderCoordinator
+    port = getConfig('internal.renderCoordinatorPort')
+    if port == 0:
+        return None
+    with renderCoordinatorLock:
+        if renderCoordinator is None:
+            renderCoordinator = RenderCoordinator(getConfig('internal.renderCoordinatorHost'), port,
+                                                  getConfig('internal.renderLeaseSeconds'),
+                                                  getConfig('internal.remoteQueueSeconds'))
+            renderCoordinator.start()
+        return renderCoordinator
@@ -0,0 +1,70 @@
+import threading
+from typing import Dict, List, TYPE_CHECKING
+
+from ProbeScheduler import getVideoInfo
+from RenderPlan import getRenderPlan
+from RenderTelemetry import getCodecKey, getPredictedSpeed
+from MultiTwitchRenderer import buildRenderPlan
+
+from MTRLogging import getLogger
+logger = getLogger('RenderCost')
+
+if TYPE_CHECKING:
+    from RenderConfig import RenderConfig
+    from SourceFile import SourceFile
+
+REFERENCE_PIXEL_RATE = 1920 * 1080 * 60
+# seconds of video per second for a single 1080p60 tile, only used until there are render samples for the layout
+FALLBACK_TILE_SPEED = 4.
+
+# video file:pixels per second
+inputPixelRates: Dict[str, float] = {}
+inputPixelRatesLock = threading.Lock()
+
+
+def getInputPixelRate(file: 'SourceFile') -> float:
+    with inputPixelRatesLock:
+        if file.videoFile in inputPixelRates.keys():
+            return inputPixelRates[file.videoFile]
+    pixelRate = REFERENCE_PIXEL_RATE
+    info = getVideoInfo(file.videoFile)
+    if info is not None:
+        for stream in info['streams']:
+            if stream.get('codec_type') != 'video':
+                continue
+            try:
+                numerator, _, denominator = stream['avg_frame_rate'].partition('/')
+                fps = float(numerator) / float(denominator or 1)
+                if fps > 0:
+                    pixelRate = stream['width'] * stream['height'] * fps
+            except (KeyError, ValueError, ZeroDivisionError):
+                pass
+            break
+    with inputPixelRatesLock:
+        inputPixelRates[file.videoFile] = pixelRate
+    return pixelRate
+
+
+def estimateSegmentSeconds(duration: float, rowFiles: List['SourceFile'], codecKey: str) -> float:
+    tileCount = max(1, len(rowFiles))
+    speed = getPredictedSpeed(codecKey, tileCount)
+    if speed is not None:
+        # the samples already reflect typical inputs for this layout
+        return duration / speed
+    inputLoad = sum((getInputPixelRate(file) for file in rowFiles)) / REFERENCE_PIXEL_RATE
+    return duration * max(1., inputLoad) / FALLBACK_TILE_SPEED
+
+
+def estimateRenderSeconds(mainStreamer: str, fileDate: str, renderConfig: 'RenderConfig') -> float | None:
+    """How long rendering the day should take, from its segment layout and past render speeds. None if it can't be rendered."""
+    plan = getRenderPlan(mainStreamer, fileDate, renderConfig, buildRenderPlan)
+    if plan is None:
+        return None
+    codecKey = getCodecKey(renderConfig.outputCodec, renderConfig.encodingSpeedPreset)
+    totalSeconds = 0.
+    for segIndex in range(len(plan.segmentFileMatrix)):
+        duration = plan.uniqueTimestampsSorted[segIndex+1] - plan.uniqueTimestampsSorted[segIndex]
+        rowFiles = [file for file in plan.segmentFileMatrix[segIndex] if file is not None]
+        if duration > 0 and len(rowFiles) > 0:
+            totalSeconds += estimateSegmentSeconds(duration, rowFiles, codecKey)
+    return totalSeconds
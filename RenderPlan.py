@@ -0,0 +1,116 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from datetime import time as datetimetime
+from typing import Callable, List, Tuple, TYPE_CHECKING
+
+from MTRConfig import getConfig
+import scanned
+
+from MTRLogging import getLogger
+logger = getLogger('RenderPlan')
+
+if TYPE_CHECKING:
+    from RenderConfig import RenderConfig
+    from Session import Session
+    from SourceFile import SourceFile
+
+
+class RenderPlan:
+    """The segment layout of a render, everything generateTilingCommandMultiSegment decides before building commands"""
+    def __init__(self, mainStreamer: str, targetDate: str, allInputStreamers: List[str],
+                 uniqueTimestampsSorted: List[int | float], segmentFileMatrix: List[List['None | SourceFile']],
+                 segmentSessionMatrix: List[List['None | List[Session]']]):
+        self.mainStreamer = mainStreamer
+        self.targetDate = targetDate
+        self.allInputStreamers = allInputStreamers
+        self.uniqueTimestampsSorted = uniqueTimestampsSorted
+        self.segmentFileMatrix = segmentFileMatrix
+        self.segmentSessionMatrix = segmentSessionMatrix
+
+    def __repr__(self):
+        return f"RenderPlan(mainStreamer={self.mainStreamer}, targetDate={self.targetDate}, allInputStreamers={self.allInputStreamers}, numSegments={len(self.segmentFileMatrix)})"
+
+
+# (mainStreamer, targetDate, renderConfig hash):(input fingerprint, plan or None)
+renderPlanCache: OrderedDict[Tuple[str, str, str], Tuple[str, RenderPlan | None]] = OrderedDict()
+renderPlanCacheLock = threading.RLock()
+renderPlanCacheHits = 0
+renderPlanCacheMisses = 0
+
+
+def hashRenderConfig(renderConfig: 'RenderConfig') -> str:
+    values = json.dumps(renderConfig.__dict__, sort_keys=True, default=str)
+    return hashlib.sha1(values.encode()).hexdigest()
+
+
+def getTargetDateRange(targetDate: str) -> Tuple[datetime, datetime]:
+    targetDateStartTime = datetime.combine(
+        datetime.fromisoformat(targetDate), datetimetime(0, 0, 0, tzinfo=getConfig('main.localTimezone')))
+    return targetDateStartTime, targetDateStartTime + timedelta(days=1)
+
+
+def getMainSessionsOnDate(mainStreamer: str, targetDate: str) -> List['Session']:
+    """Sessions of the main streamer starting on the target date, sorted by start time. Used for both the plan and its
+    input fingerprint, so they always agree on which sessions a render covers."""
+    targetDateStartTime, targetDateEndTime = getTargetDateRange(targetDate)
+    startTimestamp = targetDateStartTime.timestamp()
+    endTimestamp = targetDateEndTime.timestamp()
+    return sorted((session for session in scanned.allStreamerSessions.get(mainStreamer, [])
+                   if startTimestamp <= session.startTimestamp <= endTimestamp), key=lambda x: x.startTimestamp)
+
+
+def getInputFingerprint(mainStreamer: str, targetDate: str) -> str:
+    """Hash of every file that could end up in the plan, changes when one is added, replaced or has its chat parsed"""
+    mainSessions = getMainSessionsOnDate(mainStreamer, targetDate)
+    files = set((session.file for session in mainSessions))
+    if len(mainSessions) > 0:
+        rangeStart = min((session.startTimestamp for session in mainSessions))
+        rangeEnd = max((session.endTimestamp for session in mainSessions))
+        for streamer in scanned.allStreamerSessions.keys():
+            if streamer != mainStreamer:
+                files.update((session.file for session in scanned.sessionIndex.getOverlappingSessions(streamer, rangeStart, rangeEnd)))
+    fileKeys = sorted(((file.videoId, file.downloadTime.timestamp(), file.chatParsed) for file in files))
+    hasher = hashlib.sha1(repr(fileKeys).encode())
+    hasher.update(repr(getConfig('main.nongroupGames')).encode())
+    return hasher.hexdigest()
+
+
+def getRenderPlan(mainStreamer: str, targetDate: str, renderConfig: 'RenderConfig',
+                  buildPlan: Callable[[str, str, 'RenderConfig'], RenderPlan | None]) -> RenderPlan | None:
+    global renderPlanCacheHits
+    global renderPlanCacheMisses
+    key = (mainStreamer, targetDate, hashRenderConfig(renderConfig))
+    with renderPlanCacheLock:
+        fingerprint = getInputFingerprint(mainStreamer, targetDate)
+        if key in renderPlanCache.keys():
+            cachedFingerprint, plan = renderPlanCache[key]
+            if cachedFingerprint == fingerprint:
+                renderPlanCache.move_to_end(key)
+                renderPlanCacheHits += 1
+                logger.detail(f"Using cached render plan for {mainStreamer} {targetDate}")
+                return plan
+            logger.detail(f"Inputs changed for {mainStreamer} {targetDate}, rebuilding render plan")
+            del renderPlanCache[key]
+        renderPlanCacheMisses += 1
+    # built outside the lock, this can take a while
+    plan = buildPlan(mainStreamer, targetDate, renderConfig)
+    cacheSize = getConfig('internal.renderPlanCacheSize')
+    if cacheSize > 0:
+        with renderPlanCacheLock:
+            renderPlanCache[key] = (fingerprint, plan)
+            while len(renderPlanCache) > cacheSize:
+                renderPlanCache.popitem(last=False)
+    return plan
+
+
+def clearRenderPlanCache():
+    with renderPlanCacheLock:
+        renderPlanCache.clear()
+
+
+def getRenderPlanCacheStats() -> Tuple[int, int, int]:
+    with renderPlanCacheLock:
+        return renderPlanCacheHits, renderPlanCacheMisses, len(renderPlanCache)
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import pickle
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+from MTRLogging import getLogger
+logger = getLogger('RenderQueueStore')
+
+if TYPE_CHECKING:
+    from RenderTask import RenderTask
+
+renderQueueSchema = """
+CREATE TABLE IF NOT EXISTS renderTasks (
+    mainStreamer TEXT NOT NULL,
+    fileDate TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    task BLOB NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    queuedTime REAL NOT NULL,
+    PRIMARY KEY (mainStreamer, fileDate)
+);
+CREATE TABLE IF NOT EXISTS renderChunks (
+    mainStreamer TEXT NOT NULL,
+    fileDate TEXT NOT NULL,
+    chunkIndex INTEGER NOT NULL,
+    commandHash TEXT NOT NULL,
+    outpath TEXT NOT NULL,
+    finishedTime REAL NOT NULL,
+    PRIMARY KEY (mainStreamer, fileDate, chunkIndex)
+);
+"""
+
+
+def getCommandHash(command: List) -> str:
+    """Identifies a chunk command independent of where it writes its output"""
+    return hashlib.sha1(json.dumps([str(x) for x in command[:-1]]).encode()).hexdigest()
+
+
+class PersistentRenderQueue(queue.PriorityQueue):
+    """PriorityQueue of (priority, RenderTask) that keeps every task in a SQLite database until it's finished or
+    discarded, along with which of its chunks have been rendered and how many times it was started, so a restart can
+    pick up where it left off. Getting an item doesn't remove it from the database, only discard does."""
+    def __init__(self, filepath: str):
+        super().__init__()
+        self.filepath = filepath
+        self.connection: sqlite3.Connection | None = None
+        self.connectionLock = threading.RLock()
+
+    def getConnection(self) -> sqlite3.Connection:
+        with self.connectionLock:
+            if self.connection is None:
+                logger.info(f"Opening render queue database {self.filepath}")
+                # used from the session, copy, render and command threads, all access goes through connectionLock
+                self.connection = sqlite3.connect(self.filepath, check_same_thread=False)
+                self.connection.execute("PRAGMA journal_mode = WAL")
+                self.connection.executescript(renderQueueSchema)
+                self.connection.commit()
+            return self.connection
+
+    def _put(self, item: Tuple[int, 'RenderTask']):
+        super()._put(item)
+        self.store(*item)
+
+    def store(self, priority: int, task: 'RenderTask'):
+        """Records a task as queued without putting it in this queue, for tasks that go through the copy queue first"""
+        with self.connectionLock:
+            connection = self.getConnection()
+            connection.execute("""INSERT INTO renderTasks (mainStreamer, fileDate, priority, task, state, queuedTime)
+                                  VALUES (?, ?, ?, ?, 'QUEUED', ?)
+                                  ON CONFLICT (mainStreamer, fileDate) DO UPDATE SET priority = excluded.priority,
+                                      task = excluded.task, state = 'QUEUED'""",
+                               (task.mainStreamer, task.fileDate, priority, pickle.dumps(task), time.time()))
+            connection.commit()
+
+    def discard(self, task: 'RenderTask'):
+        """Forgets a task once it's finished, or when it was taken out of the queue and won't be rendered"""
+        with self.connectionLock:
+            connection = self.getConnection()
+            connection.execute("DELETE FROM renderTasks WHERE mainStreamer = ? AND fileDate = ?", (task.mainStreamer, task.fileDate))
+            connection.execute("DELETE FROM renderChunks WHERE mainStreamer = ? AND fileDate = ?", (task.mainStreamer, task.fileDate))
+            connection.commit()
+
+    def markStarted(self, task: 'RenderTask') -> int:
+        """Returns how many times the task has been started, including this one"""
+        with self.connectionLock:
+            connection = self.getConnection()
+            connection.execute("""UPDATE renderTasks SET state = 'RENDERING', attempts = attempts + 1
+                                  WHERE mainStreamer = ? AND fileDate = ?""", (task.mainStreamer, task.fileDate))
+            connection.commit()
+            row = connection.execute("SELECT attempts FROM renderTasks WHERE mainStreamer = ? AND fileDate = ?",
+                                     (task.mainStreamer, task.fileDate)).fetchone()
+            return 1 if row is None else row[0]
+
+    def markSuspended(self, task: 'RenderTask'):
+        """Undoes markStarted for a task that was preempted, being suspended isn't a failed attempt"""
+        with self.connectionLock:
+            connection = self.getConnection()
+            connection.execute("""UPDATE renderTasks SET state = 'QUEUED', attempts = MAX(0, attempts - 1)
+                                  WHERE mainStreamer = ? AND fileDate = ?""", (task.mainStreamer, task.fileDate))
+            connection.commit()
+
+    def markChunkFinished(self, task: 'RenderTask', chunkIndex: int, command: List, outpath: str):
+        with self.connectionLock:
+            connection = self.getConnection()
+            connection.execute("""INSERT OR REPLACE INTO renderChunks (mainStreamer, fileDate, chunkIndex, commandHash, outpath, finishedTime)
+                                  VALUES (?, ?, ?, ?, ?, ?)""",
+                               (task.mainStreamer, task.fileDate, chunkIndex, getCommandHash(command), outpath, time.time()))
+            connection.commit()
+
+    def getFinishedChunks(self, task: 'RenderTask') -> Dict[int, Tuple[str, str]]:
+        """chunk index:(command hash, output path) of the chunks rendered in earlier attempts"""
+        with self.connectionLock:
+            rows = self.getConnection().execute("""SELECT chunkIndex, commandHash, outpath FROM renderChunks
+                                                   WHERE mainStreamer = ? AND fileDate = ?""",
+                                                (task.mainStreamer, task.fileDate)).fetchall()
+        return {chunkIndex: (commandHash, outpath) for chunkIndex, commandHash, outpath in rows}
+
+    def loadStoredTasks(self) -> List[Tuple[int, 'RenderTask', int]]:
+        """(priority, task, attempts) of every task that was queued or rendering, unreadable entries are dropped"""
+        with self.connectionLock:
+            connection = self.getConnection()
+            rows = connection.execute("""SELECT mainStreamer, fileDate, priority, task, attempts FROM renderTasks
+                                         ORDER BY priority, queuedTime""").fetchall()
+            storedTasks = []
+            for mainStreamer, fileDate, priority, taskData, attempts in rows:
+                try:
+                    storedTasks.append((priority, pickle.loads(taskData), attempts))
+                except Exception as ex:
+                    logger.warning(f"Dropping stored render task {mainStreamer} {fileDate}, it could not be loaded: {ex}")
+                    connection.execute("DELETE FROM renderTasks WHERE mainStreamer = ? AND fileDate = ?", (mainStreamer, fileDate))
+                    connection.execute("DELETE FROM renderChunks WHERE mainStreamer = ? AND fileDate = ?", (mainStreamer, fileDate))
+            connection.commit()
+            return storedTasks
@@ -0,0 +1,150 @@
+import os
+import threading
+from typing import Callable, List, Tuple
+
+from MTRConfig import getConfig
+
+from MTRLogging import getLogger
+logger = getLogger('RenderScheduler')
+
+
+class RenderJob:
+    def __init__(self, name: str, target: Callable[[], bool], cpuSlots: int, memory: int, dependencies: List['RenderJob'] = ()):
+        self.name = name
+        self.target = target  # returns True on success
+        self.cpuSlots = cpuSlots
+        self.memory = memory  # MB
+        self.dependencies = list(dependencies)
+        self.state = 'WAITING'  # WAITING, RUNNING, FINISHED, ERRORED, CANCELLED
+        self.finished = threading.Event()
+        self.onFinished: Callable[['RenderJob'], None] | None = None  # called once the job has its final state
+
+    def succeeded(self) -> bool:
+        return self.state == 'FINISHED'
+
+    def __repr__(self):
+        return f"RenderJob(name={self.name}, state={self.state}, cpuSlots={self.cpuSlots}, memory={self.memory})"
+
+
+class RenderScheduler:
+    """Runs jobs on their own threads as soon as their dependencies have finished and there are enough CPU slots and
+    memory left in the budget. Jobs start in the order they were submitted, so a large job is never starved by smaller ones."""
+    def __init__(self, cpuSlots: int, memoryBudget: int):
+        self.cpuSlots = cpuSlots
+        self.memoryBudget = memoryBudget  # MB, 0 for unlimited
+        self.usedCpuSlots = 0
+        self.usedMemory = 0
+        self.pendingJobs: List[RenderJob] = []
+        self.runningJobs: List[RenderJob] = []
+        self.lock = threading.RLock()
+
+    def getJobWeight(self, job: RenderJob) -> Tuple[int, int]:
+        # anything bigger than the whole budget gets to run on its own
+        cpuSlots = min(job.cpuSlots, self.cpuSlots)
+        memory = job.memory if self.memoryBudget == 0 else min(job.memory, self.memoryBudget)
+        return cpuSlots, memory
+
+    def canStart(self, job: RenderJob) -> bool:
+        cpuSlots, memory = self.getJobWeight(job)
+        if self.usedCpuSlots + cpuSlots > self.cpuSlots:
+            return False
+        return self.memoryBudget == 0 or self.usedMemory + memory <= self.memoryBudget
+
+    def submit(self, job: RenderJob) -> RenderJob:
+        with self.lock:
+            self.pendingJobs.append(job)
+            self.startReadyJobs()
+        return job
+
+    def startReadyJobs(self):
+        with self.lock:
+            for job in list(self.pendingJobs):
+                if any((dependency.state in ('ERRORED', 'CANCELLED') for dependency in job.dependencies)):
+                    self.pendingJobs.remove(job)
+                    self.setFinalState(job, 'CANCELLED')
+                    continue
+                if not all((dependency.succeeded() for dependency in job.dependencies)):
+                    continue
+                if not self.canStart(job):
+                    break
+                self.pendingJobs.remove(job)
+                cpuSlots, memory = self.getJobWeight(job)
+                self.usedCpuSlots += cpuSlots
+                self.usedMemory += memory
+                job.state = 'RUNNING'
+                self.runningJobs.append(job)
+                logger.detail(f"Starting {job.name} ({self.usedCpuSlots}/{self.cpuSlots} CPU slots in use)")
+                threading.Thread(target=self.runJob, args=(job,), name=job.name, daemon=True).start()
+
+    def runJob(self, job: RenderJob):
+        try:
+            success = job.target()
+        except Exception as ex:
+            logger.error(f"{job.name} failed: {ex}")
+            success = False
+        with self.lock:
+            cpuSlots, memory = self.getJobWeight(job)
+            self.usedCpuSlots -= cpuSlots
+            self.usedMemory -= memory
+            self.runningJobs.remove(job)
+            self.setFinalState(job, 'FINISHED' if success else 'ERRORED')
+            self.startReadyJobs()
+
+    def setFinalState(self, job: RenderJob, state: str):
+        job.state = state
+        if job.onFinished is not None:
+            try:
+                job.onFinished(job)
+            except Exception as ex:
+                logger.error(f"onFinished of {job.name} failed: {ex}")
+        job.finished.set()
+
+    def cancel(self, jobs: List[RenderJob]):
+        """Cancels any of the jobs that haven't started yet"""
+        with self.lock:
+            for job in jobs:
+                if job in self.pendingJobs:
+                    self.pendingJobs.remove(job)
+                    self.setFinalState(job, 'CANCELLED')
+            self.startReadyJobs()
+
+    def getRunningJobs(self) -> List[RenderJob]:
+        with self.lock:
+            return list(self.runningJobs)
+
+
+def waitForJobs(jobs: List[RenderJob]) -> bool:
+    for job in jobs:
+        job.finished.wait()
+    return all((job.succeeded() for job in jobs))
+
+
+def countVideoInputs(command: List) -> int:
+    inputCount = 0
+    for i in range(len(command)):
+        # generated silent audio inputs cost next to nothing
+        if command[i] == '-i' and not (i >= 2 and command[i-2] == '-f' and command[i-1] == 'lavfi'):
+            inputCount += 1
+    return inputCount
+
+
+def estimateCommandWeight(command: List) -> Tuple[int, int]:
+    """(CPU slots, memory in MB) for an ffmpeg command, based on how many video files it decodes"""
+    inputCount = countVideoInputs(command)
+    if '-c' in command and command[command.index('-c')+1] == 'copy':
+        return 1, getConfig('internal.renderMemoryPerInput')  # concat, no decoding or encoding
+    return (max(1, inputCount * getConfig('internal.renderSlotsPerInput')),
+            max(1, inputCount) * getConfig('internal.renderMemoryPerInput'))
+
+
+renderScheduler: RenderScheduler | None = None
+renderSchedulerLock = threading.Lock()
+
+
+def getRenderScheduler() -> RenderScheduler:
+    global renderScheduler
+    with renderSchedulerLock:
+        if renderScheduler is None:
+            cpuSlots = getConfig('internal.renderCpuSlots')
+            renderScheduler = RenderScheduler(cpuSlots if cpuSlots > 0 else os.cpu_count(), getConfig('internal.renderMemoryBudget'))
+        return renderScheduler
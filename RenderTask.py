@@ -2,6 +2,7 @@ import re
 import threading
 import pickle
 import os
+import time
 
 from MTRConfig import getConfig
 import scanned
@@ -20,6 +21,10 @@ class RenderTask:
         self.mainStreamer = mainStreamer
         self.renderConfig = renderConfig
         self.outputPath = outputPath
+        self.queuedTime = time.time()
+        self.estimatedSeconds = None
+        self.sortKey = (1, 0)  # from the queue policy, set by updateSortKey before the task is queued
+        self.stagedFiles = []  # local copies of source files made for this task, see FileStaging
         # self.commandArray = commandArray
         # self.outputPath = [command for command in commandArray if 'ffmpeg' in command[0]][-1][-1]
         # allInputFiles = [filepath for command in commandArray for filepath in extractInputFiles(command) if type(filepath)==str and 'anullsrc' not in filepath]
@@ -28,25 +33,64 @@ class RenderTask:
         # self.sourceFiles = [filesBySourceVideoPath[filepath] for filepath in allInputFiles if filepath not in allOutputFiles]
         # self.intermediateFiles = set([command[-1] for command in commandArray[:-1]])
 
+    def __setstate__(self, state):
+        # tasks stored before the cost model was added
+        state.setdefault('queuedTime', time.time())
+        state.setdefault('estimatedSeconds', None)
+        state.setdefault('sortKey', (1, 0))
+        state.setdefault('stagedFiles', [])
+        self.__dict__.update(state)
+
+    def updateSortKey(self):
+        """Estimates how long the task takes to render and updates its place in the queue order. Builds the render plan,
+        so call it before putting the task in a queue, never from the comparisons the queue makes while it's locked."""
+        policy = getConfig('main.queuePolicy')
+        if policy == 'date':
+            self.sortKey = (0, 0)
+            return
+        from RenderCost import estimateRenderSeconds
+        try:
+            self.estimatedSeconds = estimateRenderSeconds(self.mainStreamer, self.fileDate, self.renderConfig)
+        except Exception as ex:
+            logger.warning(f"Unable to estimate render time for {self}: {ex}")
+            self.estimatedSeconds = None
+        if self.estimatedSeconds is None:
+            # tasks without an estimate go after all the ones with one
+            self.sortKey = (1, 0)
+        elif policy == 'shortestFirst':
+            self.sortKey = (0, self.estimatedSeconds)
+        else:
+            # deadline: least slack first, the latest it can start and still finish by its deadline
+            self.sortKey = (0, self.queuedTime + getConfig('main.renderDeadlineHours')*3600 - self.estimatedSeconds)
+
     # Since there's no way to reverse the sort order of a PriorityQueue, the easiest way to change the order is to change the
     #     comparison functions that sort will use. Is it hacky and terrible? Yes. Does it work? Also yes.
+    # The queue policy goes first, dates only break ties.
     def __lt__(self, cmp):
+        if self.sortKey != cmp.sortKey:
+            return self.sortKey < cmp.sortKey
         return (self.fileDate < cmp.fileDate) if getConfig('main.queueOldestFirst') else (self.fileDate > cmp.fileDate)
 
     def __gt__(self, cmp):
+        if self.sortKey != cmp.sortKey:
+            return self.sortKey > cmp.sortKey
         return (self.fileDate > cmp.fileDate) if getConfig('main.queueOldestFirst') else (self.fileDate < cmp.fileDate)
 
     def __lte__(self, cmp):
+        if self.sortKey != cmp.sortKey:
+            return self.sortKey < cmp.sortKey
         return (self.fileDate <= cmp.fileDate) if getConfig('main.queueOldestFirst') else (self.fileDate >= cmp.fileDate)
 
     def __gte__(self, cmp):
+        if self.sortKey != cmp.sortKey:
+            return self.sortKey > cmp.sortKey
         return (self.fileDate >= cmp.fileDate) if getConfig('main.queueOldestFirst') else (self.fileDate <= cmp.fileDate)
 
     def __str__(self):
         return f"{self.mainStreamer} {self.fileDate}"
 
     def __repr__(self):
-        return f"QueueItem(mainStreamer={self.mainStreamer}, fileDate={self.fileDate}, renderConfig={self.renderConfig}, outputPath={self.outputPath})"
+        return f"QueueItem(mainStreamer={self.mainStreamer}, fileDate={self.fileDate}, renderConfig={self.renderConfig}, outputPath={self.outputPath}, estimatedSeconds={self.estimatedSeconds})"
 
 statusFilePath = getConfig('main.statusFilePath')
 renderStatuses = {}
@@ -61,8 +105,6 @@ if os.path.isfile(statusFilePath):
             del renderStatuses[key]
 # renderStatuses = {}
 renderStatusLock = threading.RLock()
-localFileReferenceCounts = {}
-localFileRefCountLock = threading.RLock()
 MAXIMUM_PRIORITY = 9999
 DEFAULT_PRIORITY = 1000
 MANUAL_PRIORITY = 500
@@ -72,34 +114,6 @@ def saveRenderStatuses():
         with open(statusFilePath, 'wb') as statusFile:
             pickle.dump(renderStatuses, statusFile)
 
-def incrFileRefCount(filename:str):
-    assert filename.startswith(getConfig('main.localBasepath'))
-    localFileRefCountLock.acquire()
-    ret = 0
-    if filename not in localFileReferenceCounts.keys():
-        localFileReferenceCounts[filename] = 1
-        ret = 1
-    else:
-        localFileReferenceCounts[filename] += 1
-        ret = localFileReferenceCounts[filename]
-    localFileRefCountLock.release()
-    return ret
-
-
-def decrFileRefCount(filename:str):
-    assert filename.startswith(getConfig('main.localBasepath'))
-    localFileRefCountLock.acquire()
-    ret = 0
-    if filename not in localFileReferenceCounts.keys():
-        localFileReferenceCounts[filename] = 1
-        ret = 1
-    else:
-        localFileReferenceCounts[filename] += 1
-        ret = localFileReferenceCounts[filename]
-    localFileRefCountLock.release()
-    return ret
-
-
 def setRenderStatus(streamer:str, date:str, status:str):
     assert status in ("RENDERING", "RENDER_QUEUE",
                       "COPY_QUEUE", "COPYING", "FINISHED", "ERRORED", "SOLO")
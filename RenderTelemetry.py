@@ -0,0 +1,274 @@
+import re
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, Dict, List, Set, Tuple, TYPE_CHECKING
+
+import FileCatalog
+from RenderScheduler import countVideoInputs
+
+from MTRLogging import getLogger
+logger = getLogger('RenderTelemetry')
+
+if TYPE_CHECKING:
+    from RenderTask import RenderTask
+
+SPEED_SAMPLE_COUNT = 20  # recent renders averaged to predict the speed of a layout
+statsLinePattern = re.compile(r"(\w+)=\s*(\S+)")
+
+
+def getRenderDuration(command: List) -> float | None:
+    """Length of the video a chunk command renders, from the trim filter in its filtergraph"""
+    try:
+        filtergraph = command[command.index("-filter_complex")+1]
+        trimStr = "trim=duration="
+        trimIndex = filtergraph.index(trimStr)
+        commaIndex = filtergraph.index(",", trimIndex)
+        return float(filtergraph[trimIndex+len(trimStr):commaIndex])
+    except ValueError:
+        return None
+
+
+def getCodecKey(codec: str, preset: str | None) -> str:
+    return codec if preset is None else f"{codec} {preset}"
+
+
+def getCommandLayout(command: List) -> Tuple[str, int]:
+    """(video codec and preset, tile count), what render speed mostly depends on"""
+    if '-c:v' not in command:
+        return 'copy', countVideoInputs(command)
+    preset = str(command[command.index('-preset')+1]) if '-preset' in command else None
+    return getCodecKey(str(command[command.index('-c:v')+1]), preset), countVideoInputs(command)
+
+
+def parseTimestamp(timestamp: str) -> float | None:
+    try:
+        hours, minutes, seconds = timestamp.split(':')
+        return abs(int(hours))*3600 + int(minutes)*60 + float(seconds)
+    except ValueError:
+        return None
+
+
+def parseStatsLine(line: str) -> Dict[str, str]:
+    """Converts an ffmpeg stats line (frame= ... speed=1.5x) to the keys -progress uses"""
+    stats = dict(statsLinePattern.findall(line))
+    values = {}
+    if 'fps' in stats:
+        values['fps'] = stats['fps']
+    if 'speed' in stats:
+        values['speed'] = stats['speed']
+    if 'bitrate' in stats:
+        values['bitrate'] = stats['bitrate']
+    if 'time' in stats:
+        outTime = parseTimestamp(stats['time'])
+        if outTime is not None:
+            values['out_time_us'] = str(int(outTime * 1000000))
+    # older ffmpeg versions print kB, newer ones KiB
+    sizeUnit = next((unit for unit in ('KiB', 'kB') if stats.get('size', '').endswith(unit)), None)
+    if sizeUnit is not None:
+        try:
+            values['total_size'] = str(int(float(stats['size'][:-len(sizeUnit)]) * 1024))
+        except ValueError:
+            pass
+    return values
+
+
+speedCache: Dict[Tuple[str, int], float | None] = {}
+speedCacheLock = threading.Lock()
+
+
+def getPredictedSpeed(codec: str, tileCount: int) -> float | None:
+    with speedCacheLock:
+        key = (codec, tileCount)
+        if key not in speedCache:
+            speedCache[key] = FileCatalog.loadRenderSpeed(codec, tileCount, SPEED_SAMPLE_COUNT)
+        return speedCache[key]
+
+
+def getPredictedSpeeds(layouts: Set[Tuple[str, int]]) -> Dict[Tuple[str, int], float | None]:
+    return {layout: getPredictedSpeed(*layout) for layout in layouts}
+
+
+class ChunkProgress:
+    def __init__(self, chunkIndex: int, expectedDuration: float | None, codec: str, tileCount: int):
+        self.chunkIndex = chunkIndex
+        self.expectedDuration = expectedDuration
+        self.codec = codec
+        self.tileCount = tileCount
+        self.outTime = 0.  # seconds of video rendered so far
+        self.fps = 0.
+        self.speed = 0.
+        self.totalSize = 0
+        self.bitrate = None
+        self.startTime = time.time()
+        self.finished = False
+
+    def update(self, values: Dict[str, str]):
+        try:
+            if values.get('out_time_us', 'N/A') != 'N/A':
+                self.outTime = max(0., int(values['out_time_us']) / 1000000)
+            if values.get('fps', 'N/A') != 'N/A':
+                self.fps = float(values['fps'])
+            if values.get('speed', 'N/A').rstrip('x') not in ('N/A', ''):
+                self.speed = float(values['speed'].rstrip('x'))
+            if values.get('total_size', 'N/A') != 'N/A':
+                self.totalSize = int(values['total_size'])
+            if values.get('bitrate', 'N/A') != 'N/A':
+                self.bitrate = values['bitrate']
+        except ValueError as ex:
+            logger.debug(f"Unreadable progress values {values}: {ex}")
+
+    def getEta(self, predictedSpeeds: Dict[Tuple[str, int], float | None], fallbackSpeed: float | None = None) -> float | None:
+        """Seconds until the chunk is done, from its current speed or the speed of earlier renders like it, looked up
+        with getPredictedSpeeds beforehand"""
+        if self.expectedDuration is None:
+            return None
+        if self.codec == 'copy' and self.speed <= 0:
+            return 0.  # a concat takes next to no time compared to the chunks
+        speed = self.speed if self.speed > 0 else predictedSpeeds.get((self.codec, self.tileCount))
+        if speed is None:
+            speed = fallbackSpeed
+        if speed is None or speed <= 0:
+            return None
+        return max(0., self.expectedDuration - self.outTime) / speed
+
+
+class TaskProgress:
+    def __init__(self, task: 'RenderTask', commands: Dict[int, List]):
+        self.task = task
+        self.chunks: Dict[int, ChunkProgress] = {}
+        for chunkIndex, command in commands.items():
+            self.chunks[chunkIndex] = ChunkProgress(chunkIndex, getRenderDuration(command), *getCommandLayout(command))
+        # the concat doesn't have a trim, its output is as long as all the chunks together
+        lastIndex = max(commands.keys(), default=None)
+        if lastIndex is not None and self.chunks[lastIndex].expectedDuration is None:
+            durations = [chunk.expectedDuration for chunk in self.chunks.values() if chunk.chunkIndex != lastIndex]
+            if len(durations) > 0 and all((duration is not None for duration in durations)):
+                self.chunks[lastIndex].expectedDuration = sum(durations)
+        self.runningChunks: Dict[int, ChunkProgress] = {}
+        self.startTime = time.time()
+
+    def getFinishedCount(self) -> int:
+        return len([chunk for chunk in self.chunks.values() if chunk.finished])
+
+    def getEta(self, predictedSpeeds: Dict[Tuple[str, int], float | None]) -> float | None:
+        # rough, assumes the remaining chunks get split evenly between as many as are running now
+        remainingSeconds = 0.
+        # without any history, chunks that haven't started are guessed to go as fast as the ones running now
+        runningSpeeds = [chunk.speed for chunk in self.runningChunks.values() if chunk.speed > 0]
+        fallbackSpeed = sum(runningSpeeds) / len(runningSpeeds) if len(runningSpeeds) > 0 else None
+        for chunk in self.chunks.values():
+            if chunk.finished:
+                continue
+            eta = chunk.getEta(predictedSpeeds, fallbackSpeed)
+            if eta is None:
+                return None
+            remainingSeconds += eta
+        return remainingSeconds / max(1, len(self.runningChunks))
+
+
+activeTaskProgress: Dict['RenderTask', TaskProgress] = {}
+telemetryLock = threading.Lock()
+
+
+def startTaskProgress(task: 'RenderTask', commands: Dict[int, List]):
+    with telemetryLock:
+        activeTaskProgress[task] = TaskProgress(task, commands)
+
+
+def finishTaskProgress(task: 'RenderTask'):
+    with telemetryLock:
+        activeTaskProgress.pop(task, None)
+
+
+def skipChunkProgress(task: 'RenderTask', chunkIndex: int):
+    with telemetryLock:
+        if task in activeTaskProgress.keys() and chunkIndex in activeTaskProgress[task].chunks.keys():
+            activeTaskProgress[task].chunks[chunkIndex].finished = True
+
+
+def startChunkProgress(task: 'RenderTask', chunkIndex: int) -> ChunkProgress | None:
+    with telemetryLock:
+        taskProgress = activeTaskProgress.get(task)
+        if taskProgress is None or chunkIndex not in taskProgress.chunks.keys():
+            return None
+        chunk = taskProgress.chunks[chunkIndex]
+        chunk.startTime = time.time()
+        taskProgress.runningChunks[chunkIndex] = chunk
+        return chunk
+
+
+def finishChunkProgress(task: 'RenderTask', chunk: ChunkProgress | None, success: bool):
+    if chunk is None:
+        return
+    with telemetryLock:
+        taskProgress = activeTaskProgress.get(task)
+        if taskProgress is not None:
+            taskProgress.runningChunks.pop(chunk.chunkIndex, None)
+        chunk.finished = success
+        chunk.speed = 0.
+        chunk.fps = 0.
+    renderSeconds = time.time() - chunk.startTime
+    if success and chunk.expectedDuration is not None and renderSeconds > 0 and chunk.codec != 'copy':
+        FileCatalog.saveRenderSample(chunk.codec, chunk.tileCount, chunk.expectedDuration, renderSeconds, time.time())
+        with speedCacheLock:
+            speedCache.pop((chunk.codec, chunk.tileCount), None)
+
+
+def createProgressReader(chunk: ChunkProgress | None) -> Callable[[bytes], None]:
+    """Takes the lines of ffmpeg's -progress output, blocks of key=value lines ending in progress=continue|end"""
+    values = {}
+
+    def readLine(line: bytes):
+        key, _, value = line.decode(errors='replace').strip().partition('=')
+        if key == 'progress':
+            if chunk is not None:
+                with telemetryLock:
+                    chunk.update(values)
+            values.clear()
+        elif key != '':
+            values[key] = value
+    return readLine
+
+
+def updateFromStatsLine(chunk: ChunkProgress | None, line: str):
+    if chunk is not None:
+        with telemetryLock:
+            chunk.update(parseStatsLine(line))
+
+
+def formatSeconds(seconds: float | None) -> str:
+    return 'unknown' if seconds is None else str(timedelta(seconds=round(seconds)))
+
+
+def formatSize(size: int) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def getActiveRenderProgress() -> List[TaskProgress]:
+    with telemetryLock:
+        return list(activeTaskProgress.values())
+
+
+def formatRenderProgress() -> str:
+    lines = []
+    with telemetryLock:
+        layouts = set(((chunk.codec, chunk.tileCount) for taskProgress in activeTaskProgress.values()
+                       for chunk in taskProgress.chunks.values() if not chunk.finished))
+    # may read the file catalog, which mustn't hold up progress updates waiting on telemetryLock
+    predictedSpeeds = getPredictedSpeeds(layouts)
+    with telemetryLock:
+        for taskProgress in activeTaskProgress.values():
+            runningChunks = sorted(taskProgress.runningChunks.values(), key=lambda x: x.chunkIndex)
+            totalSize = sum((chunk.totalSize for chunk in taskProgress.chunks.values()))
+            lines.append(f"{taskProgress.task}: {taskProgress.getFinishedCount()}/{len(taskProgress.chunks)} commands done, "
+                         f"{sum((chunk.fps for chunk in runningChunks)):.1f} fps, {sum((chunk.speed for chunk in runningChunks)):.2f}x, "
+                         f"{formatSize(totalSize)}, ETA {formatSeconds(taskProgress.getEta(predictedSpeeds))}")
+            for chunk in runningChunks:
+                lines.append(f"    part {chunk.chunkIndex}: {chunk.fps:.1f} fps, {chunk.speed:.2f}x, {formatSize(chunk.totalSize)}, "
+                             f"{formatSeconds(chunk.outTime)}/{formatSeconds(chunk.expectedDuration)}, ETA {formatSeconds(chunk.getEta(predictedSpeeds))}")
+    return '\n'.join(lines) if len(lines) > 0 else "No active renders"
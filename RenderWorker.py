@@ -2,14 +2,12 @@ from functools import partial
 import shutil
 import time
 import signal
-import queue
 import threading
 import gc
-import subprocess
 import sys
 import os
 from shlex import quote
-from typing import Any, Tuple
+from typing import Any, Dict, List, Set, Tuple
 
 from MTRConfig import getConfig
 
@@ -19,16 +17,24 @@ logger = getLogger('RenderWorker')
 
 from RenderTask import RenderTask, getRenderStatus
 from SharedUtils import insertSuffix
-from SourceFile import getVideoInfo
-from RenderTask import setRenderStatus, getRenderStatus, decrFileRefCount
+from ProbeScheduler import getVideoInfo
+from RenderTask import setRenderStatus, getRenderStatus
 from MultiTwitchRenderer import generateTilingCommandMultiSegment
+from RenderScheduler import RenderJob, estimateCommandWeight, getRenderScheduler, waitForJobs
+from RenderCoordinator import getRenderCoordinator
+from ProcessEngine import getProcessEngine
+from FileStaging import getFileStager
+from ScratchSpace import getScratchSpace
+from RenderQueueStore import PersistentRenderQueue, getCommandHash
+from RenderTelemetry import ChunkProgress, createProgressReader, finishChunkProgress, finishTaskProgress, getRenderDuration, \
+    skipChunkProgress, startChunkProgress, startTaskProgress, updateFromStatsLine
 
 renderThread:threading.Thread = None
-activeRenderTask:RenderTask = None
-activeRenderTaskSubindex:int|None = None
-activeRenderSubprocess:subprocess.Popen = None
+# task:indexes of the commands it's currently running
+activeRenderTasks:Dict[RenderTask, Set[int]] = {}
+activeRenderLock = threading.Lock()
 
-renderQueue: queue.PriorityQueue[Tuple[int, RenderTask]] = queue.PriorityQueue()
+renderQueue: PersistentRenderQueue = PersistentRenderQueue(getConfig('main.renderQueueFilepath'))
 renderQueueLock = threading.Lock()
 
 def formatCommand(command):
@@ -43,22 +49,89 @@ def startRenderThread():
 def renderThreadStarted():
     return renderThread is not None and renderThread.is_alive()
 
-def getActiveRenderTaskInfo() -> Tuple[RenderTask, int, subprocess.Popen]:
-    return (activeRenderTask, activeRenderTaskSubindex, activeRenderSubprocess)
+def getActiveRenderTaskInfo() -> List[Tuple[RenderTask, List[int]]]:
+    with activeRenderLock:
+        return [(task, sorted(subindexes)) for task, subindexes in activeRenderTasks.items()]
+
+def setActiveRenderTaskSubindex(task:RenderTask, subindex:int, active:bool):
+    with activeRenderLock:
+        if active:
+            activeRenderTasks[task].add(subindex)
+        else:
+            activeRenderTasks[task].discard(subindex)
+
+def existingRenderMatches(outpath:str, command:List, renderLog) -> bool:
+    try:
+        # compare expected duration to actual duration
+        videoInfo = getVideoInfo(outpath)
+        fileDuration = float(videoInfo['format']['duration'])
+        renderDuration = getRenderDuration(command)
+        if renderDuration is None:
+            raise ValueError(f"No trim duration in command for {outpath}")
+        logger.info(f"{fileDuration=} {renderDuration=}")
+        return abs(renderDuration - fileDuration) < 1
+    except Exception as ex:
+        logger.detail(str(ex))
+        if renderLog is not None:
+            renderLog(str(ex))
+        return False
+
+def runLocalCommand(command:List, logPath:str, chunkProgress:ChunkProgress|None) -> int:
+    # -progress pipe:1 writes progress to stdout, the usual output still goes to the log
+    return getProcessEngine().start(command, onStdoutLine=createProgressReader(chunkProgress), logPath=logPath).wait()
+
+def createCommandJob(task:RenderTask, subindex:int, command:List, logPath:str, trueOutpath:str|None, renderLog,
+                     dependencies:List[RenderJob]=(), remote:bool=False) -> RenderJob:
+    """Job that runs the command, and moves its output from the temp file to trueOutpath if set.
+    Remote jobs are handed to the render coordinator instead of being run here."""
+    def runCommand():
+        setActiveRenderTaskSubindex(task, subindex, True)
+        chunkProgress = startChunkProgress(task, subindex)
+        returncode = -1
+        try:
+            if remote:
+                coordinator = getRenderCoordinator()
+                returncode = coordinator.waitForJob(coordinator.submit([str(x) for x in command], logPath,
+                                                                       partial(updateFromStatsLine, chunkProgress)))
+            else:
+                returncode = runLocalCommand(command, logPath, chunkProgress)
+        finally:
+            setActiveRenderTaskSubindex(task, subindex, False)
+            finishChunkProgress(task, chunkProgress, returncode == 0)
+        if returncode is None:
+            # no worker took it after all, render it here as a job of its own that waits for room in the local budget
+            localJob = getRenderScheduler().submit(createCommandJob(task, subindex, command, logPath, trueOutpath, renderLog))
+            localJob.finished.wait()
+            return localJob.succeeded()
+        if returncode != 0:
+            if returncode != 130:  # ctrl-c on UNIX (?)
+                logger.error("Render errored! Printing current command:")
+                logger.error(formatCommand(command))
+            return False
+        if trueOutpath is not None:
+            shutil.move(command[-1], trueOutpath)
+        logger.info(f"Render to {trueOutpath if trueOutpath is not None else command[-1]} complete!")
+        if renderLog is not None:
+            renderLog(f"Render to {trueOutpath if trueOutpath is not None else command[-1]} complete!")
+        return True
+    # remote jobs don't use any of the local budget
+    cpuSlots, memory = (0, 0) if remote else estimateCommandWeight(command)
+    return RenderJob(f"{task} part {subindex}", runCommand, cpuSlots, memory, dependencies)
 
 def renderWorker(stats_period=30,  # 30 seconds between encoding stats printing
                  overwrite_intermediate=getConfig('main.overwriteIntermediateFiles'),
                  overwrite_output=getConfig('main.overwriteOutputFiles'),
                  renderLog=None):
     #renderLog = renderText.addLine
-    global activeRenderTask
-    global activeRenderTaskSubindex
-    global activeRenderSubprocess
     queueEmpty = False
-    logFolder = getConfig('main.logFolder')
-    localBasepath = getConfig('main.localBasepath')
+    taskThreads:List[threading.Thread] = []
+    getRenderCoordinator()  # start listening for remote workers right away
     while True:
         # sessionText, copyText, renderText = bufferedTexts
+        taskThreads = [thread for thread in taskThreads if thread.is_alive()]
+        if len(taskThreads) >= getConfig('internal.maxConcurrentRenderTasks'):
+            time.sleep(1)
+            continue
         if renderQueue.empty():
             if not queueEmpty:
                 logger.detail("Render queue empty, sleeping")
@@ -69,182 +142,220 @@ def renderWorker(stats_period=30,  # 30 seconds between encoding stats printing
         renderQueueLock.acquire()  # block if user is editing queue
         priority, task = renderQueue.get(block=False)
         renderQueueLock.release()
+        taskThread = threading.Thread(target=runRenderTask, args=(task, priority, stats_period, overwrite_intermediate, overwrite_output, renderLog),
+                                      name=f"render {task}", daemon=True)
+        taskThread.start()
+        taskThreads.append(taskThread)
+        if __debug__:
+            taskThread.join()
+            break
 
-        assert getRenderStatus(
-            task.mainStreamer, task.fileDate) == 'RENDER_QUEUE'
-        activeRenderTask = task
-        taskCommands = generateTilingCommandMultiSegment(task.mainStreamer,
-                                                         task.fileDate,
-                                                         task.renderConfig,
-                                                         task.outputPath)
-        renderCommands = [
-            command for command in taskCommands if command[0].endswith('ffmpeg')]
-        if not overwrite_output:
-            outpath = renderCommands[-1][-1]
-            count = 1
-            suffix = ""
-            while os.path.isfile(insertSuffix(outpath, suffix)):
-                suffix = f" ({count})"
-                count += 1
-            renderCommands[-1][-1] = insertSuffix(outpath, suffix)
-        finalOutpath = renderCommands[-1][-1]
-        # shutil.move(tempOutpath, insertSuffix(outpath, suffix))
-        # print(renderCommands)
-        # pathSplitIndex = outpath.rindex('.')
-        # tempOutpath = outpath[:pathSplitIndex]+'.temp'+outpath[pathSplitIndex:]
-        # tempOutpath = insertSuffix(outpath, '.temp')
-        # print(outpath, tempOutpath)
-        # renderCommands[-1][-1] = tempOutpath # output to temp file, so final filename will always be a complete file
-        for i in range(len(renderCommands)):
-            renderCommands[i].insert(-1, "-stats_period")
-            renderCommands[i].insert(-1, str(stats_period))
-            # overwrite (temp) file if it exists
-            renderCommands[i].insert(-1, '-y')
-        setRenderStatus(task.mainStreamer, task.fileDate, 'RENDERING')
-        hasError = False
-        gc.collect()
-        tempFiles = []
-        doneSkipping = False
-        for i in range(len(taskCommands)):
-            activeRenderTaskSubindex = i
-            # TODO: add preemptive scheduling
-            with open(os.path.join(logFolder, f"{task.mainStreamer}_{task.fileDate}{'' if len(renderCommands)==1 else f'_{i}'}.log"), 'a') as logFile:
-                currentCommand = taskCommands[i]
-                trueOutpath = None
-                #if 'ffmpeg' in currentCommand[0]:
-                if currentCommand[0].endswith('ffmpeg'):
-                    if not overwrite_intermediate and not doneSkipping:
-                        trueOutpath = currentCommand[-1]
-                        if trueOutpath != finalOutpath:
-                            assert trueOutpath.startswith(localBasepath)
-                            tempFiles.append(trueOutpath)
-                        if os.path.isfile(trueOutpath):
-                            shouldSkip = True
-                            try:
-                                # compare expected duration to actual duration
-                                videoInfo = getVideoInfo(trueOutpath)
-                                fileDuration = float(videoInfo['format']['duration'])
-                                filtergraph = currentCommand[currentCommand.index("-filter_complex")+1]
-                                trimStr = "trim=duration="
-                                trimIndex  = filtergraph.index(trimStr)
-                                commaIndex = filtergraph.index(",", trimIndex)
-                                renderDurationStr = filtergraph[trimIndex+len(trimStr):commaIndex]
-                                renderDuration = float(renderDurationStr)
-                                logger.info(f"{fileDuration=} {renderDuration=}")
-                                shouldSkip = abs(renderDuration - fileDuration) < 1
-                                if not shouldSkip:
-                                    doneSkipping = True
-                            except Exception as ex:
-                                logger.detail(str(ex))
-                                if renderLog is not None:
-                                    renderLog(str(ex))
-                                shouldSkip = False
-                            if shouldSkip:
-                                logger.info(f"Skipping render to file {trueOutpath}, file already exists")
-                                if renderLog is not None:
-                                    renderLog(f"Skipping render to file {trueOutpath}, file already exists")
-                                continue
-                        else:
-                            currentCommand[-1] = insertSuffix(
-                                trueOutpath, '.temp')
-                            doneSkipping = True
-                    else:  # overwrite_intermediate
-                        currentOutpath = currentCommand[-1]
-                        if currentOutpath.startswith(localBasepath):
-                            tempFiles.append(currentOutpath)
-                    # if task.renderConfig.logLevel > 0:
-                    logger.info(f"Running render to file {trueOutpath if trueOutpath is not None else currentCommand[-1]} ...")
-                    if renderLog is not None:
-                        renderLog(f"Running render to file {trueOutpath if trueOutpath is not None else currentCommand[-1]} ...")
+def runRenderTask(task:RenderTask, priority:int, stats_period, overwrite_intermediate, overwrite_output, renderLog):
+    suspended = False
+    try:
+        suspended = renderTask(task, priority, stats_period, overwrite_intermediate, overwrite_output, renderLog)
+    except Exception as ex:
+        logger.error(f"Render task {task} failed: {ex}")
+        if renderLog is not None:
+            renderLog(f"Render task {task} failed: {ex}")
+    finally:
+        with activeRenderLock:
+            activeRenderTasks.pop(task, None)
+        finishTaskProgress(task)
+        if suspended:
+            # back in line behind the task that preempted it, resuming from the first unfinished chunk with its local
+            # copies still held
+            task.updateSortKey()
+            with renderQueueLock:
+                renderQueue.put((priority, task))
+        else:
+            releaseStagedFiles(task)
+        renderQueue.task_done()
 
-                # TODO: figure out how to replace with asyncio processes - need to run from one thread and interrupt from another
+def releaseStagedFiles(task:RenderTask):
+    """Drops the task's references to its local copies, which stay in the scratch space for other tasks until their
+    space is needed"""
+    for file in task.stagedFiles:
+        getScratchSpace().release(file)
+    task.stagedFiles = []
 
-                try:
-                    process = subprocess.Popen([str(command) for command in currentCommand],
-                                               stdin=subprocess.DEVNULL,
-                                               stdout=logFile,
-                                               stderr=subprocess.STDOUT)
-                    activeRenderSubprocess = process
-                    returncode = process.wait()
-                    activeRenderSubprocess = None
-                except KeyboardInterrupt:
-                    logger.info("Keyboard interrupt detected, stopping active render!")
-                    if renderLog is not None:
-                        renderLog(
-                        "Keyboard interrupt detected, stopping active render!")
-                    process.kill()
-                    process.wait()
-                    logger.info("Render terminated!")
-                    if renderLog is not None:
-                        renderLog("Render terminated!")
-                    return
-                except Exception as ex:
-                    logger.error(str(ex))
-                    if renderLog is not None:
-                        renderLog(str(ex))
-                    returncode = -1
-                    activeRenderSubprocess = None
+def shouldPreempt(task:RenderTask, priority:int) -> bool:
+    """Whether a task with a higher priority is waiting for a free task slot"""
+    with activeRenderLock:
+        if len(activeRenderTasks) < getConfig('internal.maxConcurrentRenderTasks'):
+            return False
+    with renderQueue.mutex:
+        return len(renderQueue.queue) > 0 and renderQueue.queue[0][0] < priority
 
-                if returncode != 0:
-                    hasError = True
-                    if returncode != 130:  # ctrl-c on UNIX (?)
-                        logger.error("Render errored! Printing current command:")
-                        logger.error(formatCommand(currentCommand))
-                    break
-                else:
-                    if trueOutpath is not None:
-                        shutil.move(currentCommand[-1], trueOutpath)
-                        logger.info(f"Render to {trueOutpath} complete!")
-                        if renderLog is not None:
-                            renderLog(f"Render to {trueOutpath} complete!")
-                    else:
-                        logger.info(f"Render to {currentCommand[-1]} complete!")
-                        if renderLog is not None:
-                            renderLog(f"Render to {currentCommand[-1]} complete!")
-        if not hasError:
-            logger.info("Render task finished, cleaning up temp files:")
-            logger.detail(tempFiles)
-            setRenderStatus(task.mainStreamer, task.fileDate, 'FINISHED')
-            if getConfig('main.copyFiles'):
-                for file in (f for f in task.sourceFiles if f.videoFile.startswith(localBasepath)):
-                    remainingRefs = decrFileRefCount(file.localVideoPath)
-                    if remainingRefs == 0:
-                        logger.detail(f"Removing local file {file}")
-                        if renderLog is not None:
-                            renderLog(f"Removing local file {file}")
-                        os.remove(file)
-            # intermediateFiles = set([command[-1] for command in renderCommands[:-1] if command[0].endswith('ffmpeg')])
-            # for file in intermediateFiles:
-            for file in tempFiles:
-                logger.detail(f"Removing intermediate file {file}")
+def renderTask(task:RenderTask, priority:int, stats_period, overwrite_intermediate, overwrite_output, renderLog) -> bool:
+    """Returns whether the task was suspended for a higher priority one and has to be queued again"""
+    logFolder = getConfig('main.logFolder')
+    localBasepath = getConfig('main.localBasepath')
+    assert getRenderStatus(
+        task.mainStreamer, task.fileDate) == 'RENDER_QUEUE'
+    with activeRenderLock:
+        activeRenderTasks[task] = set()
+    attempt = renderQueue.markStarted(task)
+    if attempt > 1:
+        logger.info(f"Resuming render task {task}, attempt {attempt}")
+    finishedChunks = renderQueue.getFinishedChunks(task)
+    taskCommands = generateTilingCommandMultiSegment(task.mainStreamer,
+                                                     task.fileDate,
+                                                     task.renderConfig,
+                                                     task.outputPath)
+    renderCommands = [
+        command for command in taskCommands if command[0].endswith('ffmpeg')]
+    if not overwrite_output:
+        outpath = renderCommands[-1][-1]
+        count = 1
+        suffix = ""
+        while os.path.isfile(insertSuffix(outpath, suffix)):
+            suffix = f" ({count})"
+            count += 1
+        renderCommands[-1][-1] = insertSuffix(outpath, suffix)
+    finalOutpath = renderCommands[-1][-1]
+    # shutil.move(tempOutpath, insertSuffix(outpath, suffix))
+    # print(renderCommands)
+    # pathSplitIndex = outpath.rindex('.')
+    # tempOutpath = outpath[:pathSplitIndex]+'.temp'+outpath[pathSplitIndex:]
+    # tempOutpath = insertSuffix(outpath, '.temp')
+    # print(outpath, tempOutpath)
+    # renderCommands[-1][-1] = tempOutpath # output to temp file, so final filename will always be a complete file
+    for i in range(len(renderCommands)):
+        renderCommands[i].insert(-1, "-stats_period")
+        renderCommands[i].insert(-1, str(stats_period))
+        renderCommands[i].insert(-1, "-progress")
+        renderCommands[i].insert(-1, "pipe:1")
+        # overwrite (temp) file if it exists
+        renderCommands[i].insert(-1, '-y')
+    setRenderStatus(task.mainStreamer, task.fileDate, 'RENDERING')
+    gc.collect()
+    tempFiles = []
+    # Every command but the last renders one chunk, and the chunks are independent of each other. The last command
+    # concatenates them, so it waits for all of them.
+    scheduler = getRenderScheduler()
+    maxParallelChunks = getConfig('internal.maxParallelChunks')
+    chunkSlots = threading.Semaphore(maxParallelChunks if maxParallelChunks > 0 else len(taskCommands))
+    startTaskProgress(task, {i:taskCommands[i] for i in range(len(taskCommands)) if taskCommands[i][0].endswith('ffmpeg')})
+    jobs:List[RenderJob] = []
+    renderedChunk = False
+    suspended = False
+    hasError = False
+    for i in range(len(taskCommands)):
+        currentCommand = taskCommands[i]
+        logPath = os.path.join(logFolder, f"{task.mainStreamer}_{task.fileDate}{'' if len(renderCommands)==1 else f'_{i}'}.log")
+        isLastCommand = i == len(taskCommands)-1
+        trueOutpath = None
+        #if 'ffmpeg' in currentCommand[0]:
+        if currentCommand[0].endswith('ffmpeg'):
+            # chunks finished by an earlier attempt at this task don't need to be checked again
+            if not isLastCommand and finishedChunks.get(i) == (getCommandHash(currentCommand), currentCommand[-1]) and \
+                    os.path.isfile(currentCommand[-1]):
+                tempFiles.append(currentCommand[-1])
+                skipChunkProgress(task, i)
+                logger.info(f"Skipping render to file {currentCommand[-1]}, finished by an earlier attempt")
                 if renderLog is not None:
-                    renderLog(f"Removing intermediate file {file}")
-                assert getConfig('main.basepath') not in file
-                os.remove(file)
-        activeRenderTask = None
-        activeRenderTaskSubindex = None
-        renderQueue.task_done()
-        if __debug__:
+                    renderLog(f"Skipping render to file {currentCommand[-1]}, finished by an earlier attempt")
+                continue
+            if not overwrite_intermediate:
+                trueOutpath = currentCommand[-1]
+                if trueOutpath != finalOutpath:
+                    assert trueOutpath.startswith(localBasepath)
+                    tempFiles.append(trueOutpath)
+                # the concat has to run again if any of its chunks did
+                if os.path.isfile(trueOutpath) and not (isLastCommand and renderedChunk) and existingRenderMatches(trueOutpath, currentCommand, renderLog):
+                    skipChunkProgress(task, i)
+                    logger.info(f"Skipping render to file {trueOutpath}, file already exists")
+                    if renderLog is not None:
+                        renderLog(f"Skipping render to file {trueOutpath}, file already exists")
+                    continue
+                # render to a temp file and move it into place when done, so the output is always a complete file
+                currentCommand[-1] = insertSuffix(trueOutpath, '.temp')
+            else:  # overwrite_intermediate
+                currentOutpath = currentCommand[-1]
+                if currentOutpath.startswith(localBasepath):
+                    tempFiles.append(currentOutpath)
+        if not isLastCommand:
+            chunkSlots.acquire()
+            # don't start any more chunks once one has failed
+            if any((job.state == 'ERRORED' for job in jobs)):
+                hasError = True
+                break
+            # Let a more urgent task have this task's place. The finished chunks are recorded, so nothing is lost.
+            if getConfig('internal.preemptRenders') and shouldPreempt(task, priority):
+                logger.info(f"Suspending render task {task} after {i} commands, a higher priority task is waiting")
+                if renderLog is not None:
+                    renderLog(f"Suspending render task {task} after {i} commands, a higher priority task is waiting")
+                chunkSlots.release()
+                suspended = True
+                break
+        # chunks only go to the coordinator while workers are polling it, otherwise they'd sit in its queue until they
+        # time out and get rendered here anyway
+        remote = not isLastCommand and getRenderCoordinator() is not None and getRenderCoordinator().hasWorkers()
+        # with copyFiles the inputs may still be copying, wait for the ones this command reads
+        if getConfig('main.copyFiles') and not remote and not getFileStager().waitForInputs(currentCommand):
+            logger.error(f"Copying the input files of {currentCommand[-1]} failed")
+            if renderLog is not None:
+                renderLog(f"Copying the input files of {currentCommand[-1]} failed")
+            if not isLastCommand:
+                chunkSlots.release()
+            hasError = True
             break
+        runCommand = currentCommand
+        if getConfig('main.copyFiles'):
+            # local copies of the inputs are only on this machine
+            runCommand = getFileStager().getOriginalCommand(currentCommand) if remote else getFileStager().localizeCommand(currentCommand)
+        if currentCommand[0].endswith('ffmpeg'):
+            # if task.renderConfig.logLevel > 0:
+            logger.info(f"Running render to file {trueOutpath if trueOutpath is not None else currentCommand[-1]} ...")
+            if renderLog is not None:
+                renderLog(f"Running render to file {trueOutpath if trueOutpath is not None else currentCommand[-1]} ...")
+        if isLastCommand:
+            jobs.append(scheduler.submit(createCommandJob(task, i, runCommand, logPath, trueOutpath, renderLog,
+                                                          dependencies=list(jobs))))
+        else:
+            job = createCommandJob(task, i, runCommand, logPath, trueOutpath, renderLog, remote=remote)
+            def chunkFinished(job:RenderJob, chunkIndex=i, command=currentCommand,
+                              outpath=trueOutpath if trueOutpath is not None else currentCommand[-1]):
+                chunkSlots.release()
+                if job.succeeded():
+                    renderQueue.markChunkFinished(task, chunkIndex, command, outpath)
+            job.onFinished = chunkFinished
+            jobs.append(scheduler.submit(job))
+            renderedChunk = True
+    if not waitForJobs(jobs):
+        hasError = True
+    if suspended and not hasError:
+        renderQueue.markSuspended(task)
+        setRenderStatus(task.mainStreamer, task.fileDate, 'RENDER_QUEUE')
+        return True
+    if not hasError:
+        logger.info("Render task finished, cleaning up temp files:")
+        logger.detail(tempFiles)
+        setRenderStatus(task.mainStreamer, task.fileDate, 'FINISHED')
+        renderQueue.discard(task)
+        # intermediateFiles = set([command[-1] for command in renderCommands[:-1] if command[0].endswith('ffmpeg')])
+        # for file in intermediateFiles:
+        for file in tempFiles:
+            logger.detail(f"Removing intermediate file {file}")
+            if renderLog is not None:
+                renderLog(f"Removing intermediate file {file}")
+            assert getConfig('main.basepath') not in file
+            os.remove(file)
+    return False
 
 def endRendersAndExit():
     logger.info("Shutting down!")
     print('Shutting down, please wait at least 15 seconds before manually killing...')
     signal.signal(signal.SIGINT, signal.SIG_IGN)
-    if activeRenderSubprocess is not None:
-        logger.info("Terminating render thread")
-        print("Terminating render thread")
-        activeRenderSubprocess.terminate()
-        activeRenderSubprocess.wait(10)
-        if activeRenderSubprocess.poll() is None:
-            logger.info("Terminating render thread did not complete within 10 seconds, killing instead")
-            print(
-                "Terminating render thread did not complete within 10 seconds, killing instead")
-            activeRenderSubprocess.kill()
-            activeRenderSubprocess.wait()
-        if activeRenderSubprocess.poll() is not None:
-            logger.info("Active render stopped successfully")
-            print("Active render stopped successfully")
+    processEngine = getProcessEngine()
+    if len(processEngine.getActiveHandles()) > 0:
+        logger.info("Terminating active renders")
+        print("Terminating active renders")
+        # anything that ignores being terminated for 10 seconds gets killed
+        processEngine.terminateAll()
+        logger.info("Active renders stopped successfully")
+        print("Active renders stopped successfully")
     signal.signal(signal.SIGINT, signal.SIG_DFL)
     print("Stopping!")
     logger.info("Stopping!")
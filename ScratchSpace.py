@@ -0,0 +1,182 @@
+import os
+import shutil
+import threading
+import time
+from typing import Callable, Dict, List
+
+from MTRConfig import getConfig
+
+from MTRLogging import getLogger
+logger = getLogger('ScratchSpace')
+
+MAX_IDLE_DAYS = 7  # unreferenced files not used for this long are removed at startup
+ADMISSION_WAIT_SECONDS = 300  # how long a copy waits for running renders to free up space before giving up
+
+
+class ScratchEntry:
+    def __init__(self, size: int, lastUsed: float):
+        self.size = size
+        self.lastUsed = lastUsed
+        self.refs = 0
+        self.pending = False  # admitted but not written yet, its space isn't taken on the disk yet
+
+
+class ScratchSpace:
+    """Keeps track of the staged source files and extracted audio in localBasepath, and how many queued or running tasks
+    need each of them. Files no task needs are kept for reuse until space is needed, least recently used go first.
+    New files are only admitted once they fit in the budget and leave minFree bytes free on the disk.
+    Render intermediates in localBasepath/temp aren't managed here, they only count towards the disk usage."""
+    def __init__(self, basepath: str, budget: int, minFree: int):
+        self.basepath = basepath
+        self.budget = budget
+        self.minFree = minFree
+        self.entries: Dict[str, ScratchEntry] = {}
+        self.evictionListeners: List[Callable[[str], None]] = []
+        self.condition = threading.Condition(threading.RLock())
+        self.scanExistingFiles()
+
+    def scanExistingFiles(self):
+        tempFolder = os.path.join(self.basepath, 'temp')
+        idleCutoff = time.time() - MAX_IDLE_DAYS * (24 * 60 * 60)
+        for root, _, files in os.walk(self.basepath):
+            if root == tempFolder or root.startswith(tempFolder + os.sep):
+                continue
+            for filepath in (os.path.join(root, file) for file in files):
+                try:
+                    stat = os.stat(filepath)
+                    if stat.st_atime < idleCutoff or filepath.endswith('.temp') or '.temp.' in os.path.basename(filepath):
+                        # unused for a long time, or left over from a copy that was interrupted
+                        os.remove(filepath)
+                    else:
+                        self.entries[filepath] = ScratchEntry(stat.st_size, stat.st_atime)
+                except OSError as ex:
+                    logger.warning(f"Unable to check scratch file {filepath}: {ex}")
+        logger.info(f"Scratch space holds {len(self.entries)} files, {self.getUsedBytes() / 1024**3:.1f} GB")
+
+    def getUsedBytes(self) -> int:
+        with self.condition:
+            return sum((entry.size for entry in self.entries.values()))
+
+    def fits(self, size: int) -> bool:
+        if self.budget > 0 and self.getUsedBytes() + size > self.budget:
+            return False
+        with self.condition:
+            pendingBytes = sum((entry.size for entry in self.entries.values() if entry.pending))
+        return shutil.disk_usage(self.basepath).free - pendingBytes - size >= self.minFree
+
+    def evictFor(self, size: int) -> List[str]:
+        """Removes unreferenced files, least recently used first, until size more bytes fit. Call with the lock held."""
+        evicted = []
+        candidates = sorted((path for path, entry in self.entries.items() if entry.refs == 0),
+                            key=lambda path: self.entries[path].lastUsed)
+        for path in candidates:
+            if self.fits(size):
+                break
+            logger.detail(f"Evicting {path} from scratch space")
+            del self.entries[path]
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            evicted.append(path)
+        return evicted
+
+    def notifyEvicted(self, evicted: List[str]):
+        # outside the lock, listeners take their own locks
+        for path in evicted:
+            for listener in self.evictionListeners:
+                listener(path)
+
+    def admit(self, path: str, size: int) -> bool:
+        """Reserves size bytes for a new file and takes a reference to it. Waits for space to free up if other tasks hold
+        it, returns False if there still isn't room, and the file shouldn't be copied."""
+        deadline = time.time() + ADMISSION_WAIT_SECONDS
+        evicted = []
+        try:
+            with self.condition:
+                if path in self.entries.keys():
+                    self.entries[path].refs += 1
+                    self.entries[path].lastUsed = time.time()
+                    return True
+                while True:
+                    evicted.extend(self.evictFor(size))
+                    if self.fits(size):
+                        entry = ScratchEntry(size, time.time())
+                        entry.refs = 1
+                        entry.pending = True
+                        self.entries[path] = entry
+                        return True
+                    # only files other tasks still need are left, wait for them to finish unless that can't help
+                    referencedBytes = sum((entry.size for entry in self.entries.values() if entry.refs > 0))
+                    remaining = deadline - time.time()
+                    if referencedBytes == 0 or remaining <= 0:
+                        logger.warning(f"Not enough scratch space for {path} ({size / 1024**3:.1f} GB)")
+                        return False
+                    self.condition.wait(remaining)
+        finally:
+            self.notifyEvicted(evicted)
+
+    def acquire(self, path: str) -> bool:
+        """Takes a reference to a file that is already in scratch space, False if it was evicted"""
+        with self.condition:
+            entry = self.entries.get(path)
+            if entry is None:
+                return False
+            entry.refs += 1
+            entry.lastUsed = time.time()
+            return True
+
+    def release(self, path: str):
+        """Drops a reference, the file stays until its space is needed"""
+        with self.condition:
+            entry = self.entries.get(path)
+            if entry is None:
+                return
+            entry.refs = max(0, entry.refs - 1)
+            entry.lastUsed = time.time()
+            self.condition.notify_all()
+
+    def register(self, path: str):
+        """Records the actual size of a file once it's written, adding it if it wasn't admitted first, and frees space
+        if it went over budget"""
+        evicted = []
+        with self.condition:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return
+            entry = self.entries.setdefault(path, ScratchEntry(size, time.time()))
+            entry.size = size
+            entry.pending = False
+            entry.lastUsed = time.time()
+            if not self.fits(0):
+                evicted = self.evictFor(0)
+        self.notifyEvicted(evicted)
+
+    def touch(self, path: str):
+        with self.condition:
+            if path in self.entries.keys():
+                self.entries[path].lastUsed = time.time()
+
+    def discard(self, path: str):
+        """Forgets a file that failed to be written"""
+        with self.condition:
+            self.entries.pop(path, None)
+            self.condition.notify_all()
+
+    def contains(self, path: str) -> bool:
+        with self.condition:
+            return path in self.entries.keys()
+
+
+scratchSpace: ScratchSpace | None = None
+scratchSpaceLock = threading.Lock()
+
+
+def getScratchSpace() -> ScratchSpace:
+    global scratchSpace
+    with scratchSpaceLock:
+        if scratchSpace is None:
+            scratchSpace = ScratchSpace(getConfig('main.localBasepath'), int(getConfig('main.scratchBudgetGB') * 1024**3),
+                                        int(getConfig('internal.scratchMinFreeGB') * 1024**3))
+        return scratchSpace
@@ -0,0 +1,144 @@
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from MTRLogging import getLogger
+logger = getLogger('SegmentMatrix')
+
+if TYPE_CHECKING:
+    from Session import Session
+    from SourceFile import SourceFile
+
+SegmentFileMatrix = List[List['None | SourceFile']]
+SegmentSessionMatrix = List[List['None | List[Session]']]
+
+
+def getSessionTimes(sessions: List['Session']) -> Tuple[np.ndarray, np.ndarray]:
+    starts = np.array([session.startTimestamp for session in sessions], dtype=np.float64)
+    ends = np.array([session.endTimestamp for session in sessions], dtype=np.float64)
+    return starts, ends
+
+
+def getSegmentPresence(timestamps: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Segments x sessions, True where the session overlaps the segment by more than zero"""
+    # segment j is [timestamps[j], timestamps[j+1]), so it overlaps a session if it ends after the start and starts before the end
+    firstSegments = np.searchsorted(timestamps, starts, side='right') - 1
+    endSegments = np.searchsorted(timestamps, ends, side='left')
+    segmentIndexes = np.arange(len(timestamps)-1)[:, None]
+    return (segmentIndexes >= firstSegments[None, :]) & (segmentIndexes < endSegments[None, :]) & (ends > starts)[None, :]
+
+
+def setSegmentSessions(segmentFileMatrix: SegmentFileMatrix, segmentSessionMatrix: SegmentSessionMatrix,
+                       segIndex: int, streamerIndex: int, sessions: List['Session']):
+    segmentFileMatrix[segIndex][streamerIndex] = sessions[0].file
+    segmentSessionMatrix[segIndex][streamerIndex] = sessions
+    if len(sessions) > 1:
+        logger.debug(f"{sessions}")
+        assert all((session.file is sessions[0].file for session in sessions))
+
+
+def fillMainStreamerGap(segmentFileMatrix: SegmentFileMatrix, segmentSessionMatrix: SegmentSessionMatrix, segIndex: int,
+                        segmentStartTime: int | float, segmentEndTime: int | float, allInputStreamers: List[str],
+                        inputSessionsByStreamer: Dict[str, List['Session']]):
+    assert segIndex != 0
+    # Missing main streamer section, but the fact that we're not done yet means we have a small gap.
+    # Naively xtend previous segment's sessions to fill gap
+    for streamerIndex in range(1, len(allInputStreamers)):
+        streamerPrevFile = segmentFileMatrix[segIndex-1][streamerIndex]
+        if streamerPrevFile is not None:
+            # Streamer was present in last segment, try to extend into this segment
+            if streamerPrevFile.endTimestamp >= segmentEndTime:
+                segmentFileMatrix[segIndex][streamerIndex] = streamerPrevFile
+                segmentSessionMatrix[segIndex][streamerIndex] = []
+                for session in inputSessionsByStreamer[allInputStreamers[streamerIndex]]:
+                    if session.startTimestamp < segmentEndTime and session.endTimestamp > segmentStartTime:
+                        segmentSessionMatrix[segIndex][streamerIndex].append(session)
+                assert len(segmentSessionMatrix[segIndex][streamerIndex]) != 0
+            else:
+                #have to split this gap in two to accomodate partial file
+                ...
+
+
+def buildSegmentMatrices(uniqueTimestampsSorted: List[int | float], allInputStreamers: List[str],
+                         inputSessionsByStreamer: Dict[str, List['Session']], mainSessions: List['Session'],
+                         useChat: bool) -> Tuple[SegmentFileMatrix, SegmentSessionMatrix]:
+    numSegments = len(uniqueTimestampsSorted)-1
+    segmentFileMatrix: SegmentFileMatrix = [[None for i in range(len(allInputStreamers))] for j in range(numSegments)]
+    segmentSessionMatrix: SegmentSessionMatrix = [[None for i in range(len(allInputStreamers))] for j in range(numSegments)]
+    timestamps = np.array(uniqueTimestampsSorted, dtype=np.float64)
+    mainStarts, mainEnds = getSessionTimes(mainSessions)
+    mainPresence = getSegmentPresence(timestamps, mainStarts, mainEnds)
+    for segIndex in np.flatnonzero(mainPresence.any(axis=1)):
+        setSegmentSessions(segmentFileMatrix, segmentSessionMatrix, segIndex, 0,
+                           [mainSessions[i] for i in np.flatnonzero(mainPresence[segIndex])])
+    mainGames = [session.game for session in mainSessions]
+    mainHasChat = np.array([session.file.parsedChat is not None for session in mainSessions], dtype=bool)
+    for streamerIndex in range(1, len(allInputStreamers)):
+        sessions = inputSessionsByStreamer[allInputStreamers[streamerIndex]]
+        if len(sessions) == 0:
+            continue
+        starts, ends = getSessionTimes(sessions)
+        presence = getSegmentPresence(timestamps, starts, ends)
+        # the session and the main session also have to overlap each other, not just the segment
+        pairOverlap = (starts[:, None] < mainEnds[None, :]) & (mainStarts[None, :] < ends[:, None])
+        # segments x sessions x main sessions with a time overlap, the same triples hasOverlapV2 doesn't reject outright
+        candidates = presence[:, :, None] & mainPresence[:, None, :] & pairOverlap[None, :, :]
+        sameGame = np.array([[session.game == game for game in mainGames] for session in sessions], dtype=bool)
+        if useChat:
+            hasChat = np.array([session.file.parsedChat is not None for session in sessions], dtype=bool)[:, None] | mainHasChat[None, :]
+            matches = (candidates & ~hasChat[None, :, :] & sameGame[None, :, :]).any(axis=2)
+            # the chat check depends on the exact overlap, so only that part is done per candidate
+            chatCandidates = candidates & hasChat[None, :, :]
+            for segIndex, sessionIndex in zip(*np.nonzero(chatCandidates.any(axis=2) & ~matches)):
+                targetRange = (uniqueTimestampsSorted[segIndex], uniqueTimestampsSorted[segIndex+1])
+                session = sessions[sessionIndex]
+                matches[segIndex, sessionIndex] = any((session.hasOverlapV2(mainSessions[i], useChat=True, targetRange=targetRange)
+                                                       for i in np.flatnonzero(chatCandidates[segIndex, sessionIndex])))
+        else:
+            matches = (candidates & sameGame[None, :, :]).any(axis=2)
+        for segIndex in np.flatnonzero(matches.any(axis=1)):
+            setSegmentSessions(segmentFileMatrix, segmentSessionMatrix, segIndex, streamerIndex,
+                               [sessions[i] for i in np.flatnonzero(matches[segIndex])])
+    # gaps depend on the previous segment, so these go in order once everything else is filled in
+    for segIndex in range(numSegments):
+        if segmentFileMatrix[segIndex][0] is None:
+            fillMainStreamerGap(segmentFileMatrix, segmentSessionMatrix, segIndex, uniqueTimestampsSorted[segIndex],
+                                uniqueTimestampsSorted[segIndex+1], allInputStreamers, inputSessionsByStreamer)
+    return segmentFileMatrix, segmentSessionMatrix
+
+
+# The original per-segment loop, kept as the reference for buildSegmentMatrices
+def buildSegmentMatricesLegacy(uniqueTimestampsSorted: List[int | float], allInputStreamers: List[str],
+                               inputSessionsByStreamer: Dict[str, List['Session']], mainSessions: List['Session'],
+                               useChat: bool) -> Tuple[SegmentFileMatrix, SegmentSessionMatrix]:
+    numSegments = len(uniqueTimestampsSorted)-1
+    segmentFileMatrix: SegmentFileMatrix = [[None for i in range(len(allInputStreamers))] for j in range(numSegments)]
+    segmentSessionMatrix: SegmentSessionMatrix = [[None for i in range(len(allInputStreamers))] for j in range(numSegments)]
+    for segIndex in range(numSegments):
+        segmentStartTime = uniqueTimestampsSorted[segIndex]
+        segmentEndTime = uniqueTimestampsSorted[segIndex+1]  # - 1
+        for session in mainSessions:
+            overlapStart = max(segmentStartTime, session.startTimestamp)
+            overlapEnd = min(segmentEndTime, session.endTimestamp)
+            overlapLength = max(0, overlapEnd - overlapStart)
+            if overlapLength > 0:
+                if segmentFileMatrix[segIndex][0] is None:
+                    segmentFileMatrix[segIndex][0] = session.file
+                    segmentSessionMatrix[segIndex][0] = [session]
+                else:
+                    segmentSessionMatrix[segIndex][0].append(session)
+                    assert segmentFileMatrix[segIndex][0] is session.file
+        if segmentFileMatrix[segIndex][0] is not None:
+            for streamerIndex in range(1, len(allInputStreamers)):
+                for session in inputSessionsByStreamer[allInputStreamers[streamerIndex]]:
+                    if any((session.hasOverlapV2(mainSession, useChat=useChat, targetRange=(segmentStartTime, segmentEndTime)) for mainSession in segmentSessionMatrix[segIndex][0])):
+                        if segmentFileMatrix[segIndex][streamerIndex] is None:
+                            segmentFileMatrix[segIndex][streamerIndex] = session.file
+                            segmentSessionMatrix[segIndex][streamerIndex] = [session]
+                        else:
+                            segmentSessionMatrix[segIndex][streamerIndex].append(session)
+                            assert segmentFileMatrix[segIndex][streamerIndex] is session.file
+        else:
+            fillMainStreamerGap(segmentFileMatrix, segmentSessionMatrix, segIndex, segmentStartTime, segmentEndTime,
+                                allInputStreamers, inputSessionsByStreamer)
+    return segmentFileMatrix, segmentSessionMatrix
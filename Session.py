@@ -1,7 +1,6 @@
 from typing import TYPE_CHECKING
 
-from datetime import datetime
-from typing import TYPE_CHECKING, Dict, List, Tuple
+from typing import TYPE_CHECKING, Tuple
 
 from SharedUtils import getTimeOverlap
 if TYPE_CHECKING:
@@ -67,58 +66,13 @@ class Session:
         # If we didn't return False, we at least have some time overlap
         if useChat:
             overlapStart, overlapEnd = overlapTimes
-            def hasChatOverlap(groupsList:List[Dict[str, datetime|List[str]]], matchStreamer:str):
-                sortedGroups = sorted(groupsList, key=lambda x: x['time'])
-                if len(sortedGroups) == 0:
-                    return False
-                if overlapEnd <= sortedGroups[0]['time'].timestamp():
-                    return matchStreamer in sortedGroups[0]['group']
-                if sortedGroups[-1]['time'].timestamp() <= overlapStart:
-                    return matchStreamer in sortedGroups[-1]['group']
-                # If we haven't returned yet, we have at least one group entry within the overlap time,
-                # we need to calculate how much of the overlap time has the matching streamer
-                overlapDuration = overlapEnd - overlapStart
-                inclusionDuration: float = 0
-                leadingGroupEntry = None
-                containedGroupEntries = []
-                trailingGroupEntry = None
-                for i in range(len(sortedGroups)):
-                    entryTime = sortedGroups[i]['time'].timestamp()
-                    if entryTime < overlapStart:
-                        leadingGroupEntry = sortedGroups[i]
-                    elif overlapStart <= entryTime < overlapEnd:
-                        containedGroupEntries.append(sortedGroups[i])
-                    elif entryTime >= overlapEnd:
-                        if trailingGroupEntry is None:
-                            trailingGroupEntry = sortedGroups[i]
-                if len(containedGroupEntries) == 0:
-                    if leadingGroupEntry is not None:
-                        return matchStreamer in leadingGroupEntry['group']
-                    assert trailingGroupEntry is not None
-                    return matchStreamer in trailingGroupEntry['group']
-                if leadingGroupEntry is not None:
-                    if matchStreamer in leadingGroupEntry['group']:
-                        inclusionDuration += containedGroupEntries[0]['time'].timestamp() - overlapStart
-                else:
-                    if matchStreamer in containedGroupEntries[0]['group']:
-                        inclusionDuration += containedGroupEntries[0]['time'].timestamp() - overlapStart
-                for i in range(len(containedGroupEntries)-1):
-                    entry1 = containedGroupEntries[i]
-                    entry2 = containedGroupEntries[i+1]
-                    if matchStreamer in entry1['group']:
-                        inclusionDuration += entry2['time'].timestamp() - entry1['time'].timestamp()
-                if matchStreamer in containedGroupEntries[-1]['group']:
-                    inclusionDuration += overlapEnd - containedGroupEntries[-1]['time'].timestamp()
-                inclusionFraction = inclusionDuration / overlapDuration
-                return inclusionFraction >= inclusionThreshold
-            
             foundOverlap = None
             if self.file.parsedChat is not None:
-                foundOverlap = hasChatOverlap(self.file.parsedChat.groups, cmp.file.streamer)
+                foundOverlap = self.file.parsedChat.hasStreamerOverlap(cmp.file.streamer, overlapStart, overlapEnd, inclusionThreshold)
                 if foundOverlap:
                     return True
             if cmp.file.parsedChat is not None:
-                foundOverlap = hasChatOverlap(cmp.file.parsedChat.groups, self.file.streamer)
+                foundOverlap = cmp.file.parsedChat.hasStreamerOverlap(self.file.streamer, overlapStart, overlapEnd, inclusionThreshold)
             return foundOverlap if foundOverlap is not None else (self.game == cmp.game)
         else:
             return self.game == cmp.game
@@ -0,0 +1,51 @@
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from Session import Session
+
+
+class StreamerSessionIndex:
+    def __init__(self):
+        # parallel lists sorted by start time
+        self.starts: List[float] = []
+        self.sessions: List['Session'] = []
+        # running maximum of the end times, non-decreasing so it can be bisected
+        self.maxEnds: List[float] = []
+
+    def add(self, session: 'Session'):
+        index = bisect_right(self.starts, session.startTimestamp)
+        end = session.endTimestamp
+        self.starts.insert(index, session.startTimestamp)
+        self.sessions.insert(index, session)
+        self.maxEnds.insert(index, end if index == 0 else max(self.maxEnds[index-1], end))
+        # sessions are almost always added in order, so this rarely goes past the new entry
+        for i in range(index+1, len(self.maxEnds)):
+            if self.maxEnds[i] >= end:
+                break
+            self.maxEnds[i] = end
+
+    def getOverlapping(self, start: float, end: float) -> List['Session']:
+        first = bisect_left(self.maxEnds, start)  # everything before this ends before start
+        last = bisect_right(self.starts, end)
+        return [self.sessions[i] for i in range(first, last) if self.sessions[i].endTimestamp >= start]
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+class SessionIndex:
+    def __init__(self):
+        self.indexesByStreamer: Dict[str, StreamerSessionIndex] = {}
+
+    def add(self, session: 'Session'):
+        streamer = session.file.streamer
+        if streamer not in self.indexesByStreamer.keys():
+            self.indexesByStreamer[streamer] = StreamerSessionIndex()
+        self.indexesByStreamer[streamer].add(session)
+
+    def getOverlappingSessions(self, streamer: str, start: float, end: float) -> List['Session']:
+        """Sessions of the streamer with startTimestamp <= end and endTimestamp >= start, sorted by start time"""
+        if streamer not in self.indexesByStreamer.keys():
+            return []
+        return self.indexesByStreamer[streamer].getOverlapping(start, end)
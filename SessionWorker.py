@@ -9,7 +9,8 @@ from SharedUtils import convertToDatetime, getVideoOutputPath
 from MTRConfig import getConfig
 import scanned
 
-from SourceFile import initialize, saveFiledata, scanFiles
+from SourceFile import initialize, saveFiledata, scanFiles, scanPaths
+from DirectoryWatcher import createDirectoryWatcher
 from RenderTask import DEFAULT_PRIORITY, RenderTask, setRenderStatus, getRenderStatus
 from RenderConfig import RenderConfig
 from RenderWorker import renderQueue
@@ -40,6 +41,25 @@ def scanForExistingVideos() -> None:
         else:
             logger.info(f"Streamer {streamer} not known")
 
+def restoreRenderQueue() -> None:
+    """Queues the renders that were queued or in progress when the program last stopped"""
+    COPY_FILES = getConfig('main.copyFiles')
+    for priority, task, attempts in renderQueue.loadStoredTasks():
+        if task.mainStreamer not in scanned.allStreamersWithVideos or getRenderStatus(task.mainStreamer, task.fileDate) in ('FINISHED', 'ERRORED'):
+            renderQueue.discard(task)
+            continue
+        if attempts >= getConfig('internal.maxRenderAttempts'):
+            logger.error(f"Render for streamer {task.mainStreamer} from {task.fileDate} was started {attempts} times without finishing, marking it as errored")
+            setRenderStatus(task.mainStreamer, task.fileDate, 'ERRORED')
+            renderQueue.discard(task)
+            continue
+        logger.info(f"Restoring render for streamer {task.mainStreamer} from {task.fileDate}")
+        # scratch space references don't survive a restart, copying takes them again
+        task.stagedFiles = []
+        task.updateSortKey()
+        (copyQueue if COPY_FILES else renderQueue).put((priority, task))
+        setRenderStatus(task.mainStreamer, task.fileDate, "COPY_QUEUE" if COPY_FILES else "RENDER_QUEUE")
+
     """Days will be sorted with the most recent first
     """
 def getAllStreamingDaysByStreamer() -> Dict[str, str]:
@@ -47,7 +67,7 @@ def getAllStreamingDaysByStreamer() -> Dict[str, str]:
     for streamer in sorted(scanned.allFilesByStreamer.keys()):
         days = set()
         for file in scanned.allFilesByStreamer[streamer]:
-            chapters = file.infoJson['chapters']
+            chapters = file.chapters
             fileStartTimestamp = file.startTimestamp
             for chapter in chapters:
                 startTime = datetime.fromtimestamp(
@@ -64,7 +84,7 @@ def getAllStreamingDaysByStreamer() -> Dict[str, str]:
 
 def sessionWorker(monitorStreamers=getConfig('main.monitorStreamers'),
                   maxLookbackDays: int = getConfig('main.sessionLookbackDays'),
-                  dataFilepath=getConfig('main.dataFilepath'),
+                  catalogFilepath=getConfig('main.catalogFilepath'),
                   renderConfig=RenderConfig(),
                   sessionLog = None):
     #sessionLog = sessionText.addLine
@@ -72,37 +92,56 @@ def sessionWorker(monitorStreamers=getConfig('main.monitorStreamers'),
     #global allFilesByStreamer
     #allFilesByStreamer = SourceFile.allFilesByStreamer
     maxLookback = timedelta(days=maxLookbackDays)
+    # started before the initial scan, so nothing written while it runs is missed
+    watcher = createDirectoryWatcher()
     if len(scanned.allFilesByVideoId) == 0:
-        # loadFiledata(dataFilepath)
+        # loadFiledata(catalogFilepath)
         initialize()
     scanForExistingVideos()
+    restoreRenderQueue()
     changeCount = 0
     prevChangeCount = 0
     COPY_FILES = getConfig('main.copyFiles')
+    minimumDelay = timedelta(hours=getConfig('main.minimumSessionWorkerDelayHours'))
+    firstPass = True
+    waitTimeout = 60*60
     while True:
         oldFileCount = len(scanned.allFilesByVideoId)
         logger.debug(f"{oldFileCount=}")
-        scanFiles()
+        if watcher is None or firstPass:
+            scanFiles()
+        else:
+            changedPaths = watcher.waitForChanges(waitTimeout)
+            if changedPaths is None or len(changedPaths) == 0:
+                # events were lost, or nothing changed for a while; the scan journal keeps this cheap and catches
+                # anything inotify can't see, like files written to a network share by another machine
+                scanFiles()
+            else:
+                scanPaths(changedPaths)
+        firstPass = False
         newFileCount = len(scanned.allFilesByVideoId)
         logger.debug(f"{newFileCount=}")
         if oldFileCount != newFileCount:
             changeCount += 1
-            saveFiledata(dataFilepath)
-        latestDownloadTime = max(
-            (x.downloadTime for x in scanned.allFilesByVideoId.values()))
+        # only writes what changed, so this is cheap when nothing did
+        saveFiledata(catalogFilepath)
+        latestDownloadTime = scanned.latestDownloadTime
+        if watcher is not None and watcher.lastEventTime is not None and \
+                (latestDownloadTime is None or watcher.lastEventTime > latestDownloadTime):
+            latestDownloadTime = watcher.lastEventTime
         currentTime = datetime.now(timezone.utc)
         if changeCount != prevChangeCount:
             logger.info(f'Current time={str(currentTime)}, latest download time={str(latestDownloadTime)}')
             if sessionLog is not None:
                 sessionLog(
                     f'Current time={str(currentTime)}, latest download time={str(latestDownloadTime)}')
-        timeSinceLastDownload = currentTime - latestDownloadTime
+        timeSinceLastDownload = currentTime - latestDownloadTime if latestDownloadTime is not None else timedelta.max
         #if changeCount != prevChangeCount:
         logger.info(f'Time since last download= {str(timeSinceLastDownload)}')
         if sessionLog is not None:
             sessionLog(
                 f'Time since last download= {str(timeSinceLastDownload)}')
-        if __debug__ or timeSinceLastDownload > timedelta(hours=getConfig('main.minimumSessionWorkerDelayHours')):
+        if __debug__ or timeSinceLastDownload > minimumDelay:
             streamingDays = getAllStreamingDaysByStreamer()
             oldestFirst = getConfig('main.queueOldestFirst')
             for streamer in monitorStreamers:
@@ -155,6 +194,7 @@ def sessionWorker(monitorStreamers=getConfig('main.monitorStreamers'),
                         setRenderStatus(streamer, day, "SOLO")
                         continue
                     item = RenderTask(streamer, day, renderConfig) #, outPath)
+                    item.updateSortKey()
                     logger.info(f"Adding render for streamer {streamer} from {day}")
                     if sessionLog is not None:
                         sessionLog(
@@ -171,5 +211,12 @@ def sessionWorker(monitorStreamers=getConfig('main.monitorStreamers'),
         prevChangeCount = changeCount
         if __debug__:
             break
-        logger.detail("Reached end of session worker loop, sleeping!")
-        time.sleep(60*60)  # *24)
+        if watcher is None:
+            logger.detail("Reached end of session worker loop, sleeping!")
+            time.sleep(60*60)  # *24)
+        else:
+            # wake up when the newest files become old enough, even if nothing else changes
+            waitTimeout = 60*60
+            if timeSinceLastDownload <= minimumDelay:
+                waitTimeout = min(waitTimeout, max(60, (minimumDelay - timeSinceLastDownload).total_seconds()))
+            logger.detail(f"Reached end of session worker loop, waiting up to {waitTimeout} seconds for new files")
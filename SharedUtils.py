@@ -55,7 +55,7 @@ def calcGameCounts():
     #global allFilesByStreamer
     for streamer in sorted(scanned.allFilesByStreamer.keys()):
         for file in scanned.allFilesByStreamer[streamer]:
-            chapters = file.infoJson['chapters']
+            chapters = file.chapters
             for chapter in chapters:
                 game = chapter['title']
                 if game not in allGames.keys():
@@ -69,7 +69,7 @@ def calcGameTimes():
     allGames = {}
     for streamer in sorted(scanned.allFilesByStreamer.keys()):
         for file in scanned.allFilesByStreamer[streamer]:
-            chapters = file.infoJson['chapters']
+            chapters = file.chapters
             for chapter in chapters:
                 game = chapter['title']
                 length = chapter['end_time'] - chapter['start_time']
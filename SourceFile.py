@@ -1,37 +1,31 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import repeat
 import os
 import pickle
 import re
-import subprocess
 import json
 from typing import Dict, List, Set
 import scanned
+import FileCatalog
 
 from MTRConfig import getConfig
 
 from Session import Session
-from ParsedChat import ParsedChat, convertToDatetime
+from SessionIndex import SessionIndex
+from RenderPlan import clearRenderPlanCache
+from ProbeScheduler import getVideoInfo, prewarmProbeCache
+from ParsedChat import (ParsedChat, convertToDatetime, getGroupMessageCacheStats, getPlayerMatcher, initChatParseWorker,
+                        parseChatGroups, takeNewGroupMessageCacheEntries)
 
 from MTRLogging import getLogger
 logger = getLogger('SourceFile')
 
-def getVideoInfo(videoFile: str):
-    probeResult = subprocess.run(['ffprobe', '-v', 'quiet',
-                                  '-print_format', 'json=c=1',
-                                  '-show_format', '-show_streams',
-                                  videoFile], capture_output=True)
-    # print(probeResult)
-    if probeResult.returncode != 0:
-        return None
-    info = json.loads(probeResult.stdout.decode())
-    return info
-
-
 def scanSessionsFromFile(file: 'SourceFile'):
     streamer = file.streamer
     if streamer not in scanned.allStreamerSessions.keys():
         scanned.allStreamerSessions[streamer] = []
-    chapters = file.infoJson['chapters']
+    chapters = file.chapters
     startTime = file.startTimestamp
     for chapter in chapters:
         game = chapter['title']
@@ -39,6 +33,7 @@ def scanSessionsFromFile(file: 'SourceFile'):
         chapterEnd = startTime + chapter['end_time']
         session = Session(file, game, chapterStart, chapterEnd)
         scanned.allStreamerSessions[streamer].append(session)
+        scanned.sessionIndex.add(session)
 
 
 def trimInfoDict(infoDict: dict):
@@ -53,6 +48,11 @@ def trimInfoDict(infoDict: dict):
         del newDict['http_headers']
     return newDict
 
+
+def trimChapters(chapters: List[dict]):
+    return [{'title': chapter['title'], 'start_time': chapter['start_time'], 'end_time': chapter['end_time']}
+            for chapter in chapters]
+
 class SourceFile:
     duration:int
     startTimestamp:int
@@ -64,6 +64,10 @@ class SourceFile:
         assert infoFile is None or os.path.isabs(infoFile)
         self.streamer:str = streamer
         self.videoId:str = videoId
+        self._infoJson:dict|None = None
+        self.chapters:List[dict]|None = None
+        self._parsedChat:ParsedChat|None = None
+        self.chatParsed:bool = False
         self.videoFile:str = None
         if videoFile is not None:
             self.setVideoFile(videoFile)
@@ -73,10 +77,64 @@ class SourceFile:
         if infoFile is not None:
             self.setInfoFile(infoFile)
         self.chatFile:str|None = None
-        self.parsedChat:ParsedChat|None = None
         if chatFile is not None:
             self.setChatFile(chatFile)
 
+    @classmethod
+    def fromCatalogRow(cls, row, chapters:List[dict]) -> 'SourceFile':
+        file = cls.__new__(cls)
+        file.streamer = row['streamer']
+        file.videoId = row['videoId']
+        file.videoFile = row['videoFile']
+        file.localVideoFile = None
+        file.videoInfo = None
+        file.infoFile = row['infoFile']
+        file._infoJson = None
+        file.chapters = chapters
+        file.duration = row['duration']
+        file.startTimestamp = row['startTimestamp']
+        file.endTimestamp = row['endTimestamp']
+        file.downloadTime = convertToDatetime(row['downloadTime'])
+        file.chatFile = row['chatFile']
+        file._parsedChat = None
+        file.chatParsed = bool(row['chatParsed'])
+        return file
+
+    def __setstate__(self, state:dict):
+        # files from the legacy pickle data file hold these as plain attributes
+        for name in ('infoJson', 'parsedChat'):
+            if name in state.keys():
+                state['_'+name] = state.pop(name)
+        if 'chapters' not in state.keys():
+            state['chapters'] = trimChapters(state['_infoJson']['chapters'])
+        if 'chatParsed' not in state.keys():
+            state['chatParsed'] = state['_parsedChat'] is not None
+        self.__dict__.update(state)
+
+    # Files loaded from the catalog only keep their chapters in memory, the full info and chat are read on first use
+    @property
+    def infoJson(self) -> dict:
+        if self._infoJson is None and self.infoFile is not None:
+            self._infoJson = FileCatalog.loadInfoJson(self.videoId)
+        return self._infoJson
+
+    @infoJson.setter
+    def infoJson(self, infoJson:dict):
+        self._infoJson = infoJson
+
+    @property
+    def parsedChat(self) -> ParsedChat | None:
+        if self._parsedChat is None and self.chatParsed:
+            groups = [{'group': players, 'time': datetime.fromisoformat(time)}
+                      for time, players in FileCatalog.loadChatGroups(self.videoId)]
+            self._parsedChat = ParsedChat(self, groups=groups)
+        return self._parsedChat
+
+    @parsedChat.setter
+    def parsedChat(self, parsedChat:ParsedChat|None):
+        self._parsedChat = parsedChat
+        self.chatParsed = parsedChat is not None
+
     def __repr__(self):
         return f"SourceFile(streamer=\"{self.streamer}\", videoId=\"{self.videoId}\", videoFile=\"{self.videoFile}\", infoFile=\"{self.infoFile}\", chatFile=\"{self.chatFile}\")"
 
@@ -93,11 +151,12 @@ class SourceFile:
         self.infoFile = infoFile
         with open(infoFile) as file:
             self.infoJson = trimInfoDict(json.load(file))
+        self.chapters = trimChapters(self.infoJson['chapters'])
         self.duration = self.infoJson['duration']
         self.startTimestamp = self.infoJson['timestamp']
         self.endTimestamp = self.duration + self.startTimestamp
 
-    def setVideoFile(self, videoFile:str):
+    def setVideoFile(self, videoFile:str, mtime:float|None=None):
         if self.videoFile == videoFile:
             return
         if self.videoFile is not None:
@@ -105,7 +164,7 @@ class SourceFile:
         assert any((videoFile.endswith(videoExt) for videoExt in getConfig('internal.videoExts'))
                    ) and os.path.isfile(videoFile) and os.path.isabs(videoFile)
         self.videoFile = videoFile
-        self.downloadTime = convertToDatetime(os.path.getmtime(videoFile))
+        self.downloadTime = convertToDatetime(os.path.getmtime(videoFile) if mtime is None else mtime)
 
     def setChatFile(self, chatFile:str):
         if self.chatFile == chatFile:
@@ -120,131 +179,156 @@ class SourceFile:
         if self.streamer in getConfig('main.streamersParseChatList'):
             if self.chatFile is not None:
                 self.parsedChat = ParsedChat(self, self.chatFile)
+                scanned.dirtyVideoIds.add(self.videoId)
                 return True
         return False
 
     def getVideoFileInfo(self):
         if self.videoInfo is None:
-            self.videoInfo = getVideoInfo(
-                self.videoFile if self.localVideoFile is None else self.localVideoFile)
+            path = self.videoFile if self.localVideoFile is None else self.localVideoFile
+            self.videoInfo = getVideoInfo(path)
         return self.videoInfo
 
 
-def scanFiles():
-    # newFiles = set()
-    # newFilesByStreamer = dict()
-    newFilesByVideoId:Dict[str, SourceFile] = dict()
-    basepath = getConfig('main.basepath')
-    outputDirectory = getConfig('main.outputDirectory')
-    videoExts = getConfig('internal.videoExts')
-    videoIdRegex = getConfig('internal.videoIdRegex')
-    chatExt = getConfig('internal.chatExt')
+def getScannedExts():
+    return tuple(getConfig('internal.videoExts') + [getConfig('internal.infoExt'), getConfig('internal.chatExt')])
+
+
+def scanSingleFile(streamer: str, filepath: str, mtime: float | None, newStreamerFiles: Dict[str, 'SourceFile']):
+    videoExts = tuple(getConfig('internal.videoExts'))
     infoExt = getConfig('internal.infoExt')
-    globalAllStreamers = [name for name in os.listdir(basepath) if
-                      (name not in ("NA", outputDirectory) and 
-                       os.path.isdir(os.path.join(basepath, name)))]
-    for streamer in sorted(globalAllStreamers):
-        logger.info(f"Scanning streamer {streamer} ")
-        newStreamerFiles:List[SourceFile] = []
-        streamerBasePath = os.path.join(basepath, streamer, 'S1')
-        count = 0
-        for filename in (x for x in os.listdir(streamerBasePath) if any((x.endswith(ext) for ext in (videoExts + [infoExt, chatExt])))):
-            filepath = os.path.join(streamerBasePath, filename)
-            if filepath in scanned.allScannedFiles:
-                continue
-            filenameSegments = re.split(videoIdRegex, filename)
-            # print(filenameSegments)
-            if len(filenameSegments) < 3:
-                continue
-            assert len(filenameSegments) >= 3
-            videoId = filenameSegments[-2]
-            # print(videoId, filepath, sep=' '*8)
-            file = None
-            if videoId not in scanned.allFilesByVideoId.keys() and videoId not in newFilesByVideoId.keys():
-                if any((filename.endswith(videoExt) for videoExt in videoExts)):
-                    file = SourceFile(streamer, videoId, videoFile=filepath)
-                    # filesBySourceVideoPath[filepath] = file
-                elif filename.endswith(infoExt):
-                    try:
-                        file = SourceFile(streamer, videoId, infoFile=filepath)
-                    except Exception as ex:
-                        logger.error(f"Unable to parse info file {filepath}")
-                        logger.exception(ex)
-                else:
-                    assert filename.endswith(chatExt)
-                    file = SourceFile(streamer, videoId, chatFile=filepath)
-                # scanned.allFilesByVideoId[videoId] = file
-                newFilesByVideoId[videoId] = file
-                newStreamerFiles.append(file)
-            else:
-                file = scanned.allFilesByVideoId[videoId] if videoId in scanned.allFilesByVideoId.keys(
-                ) else newFilesByVideoId[videoId]
-                if any((filename.endswith(videoExt) for videoExt in videoExts)):
-                    file.setVideoFile(filepath)
-                    # filesBySourceVideoPath[filepath] = file
-                elif filename.endswith(infoExt):
-                    try:
-                        file.setInfoFile(filepath)
-                    except Exception as ex:
-                        logger.error(f"Unable to parse info file {filepath}")
-                        logger.exception(ex)
-                else:
-                    assert filename.endswith(chatExt)
-                    file.setChatFile(filepath)
-                    # if streamer in streamersParseChatList:
-                    #    file.parsedChat = ParsedChat(filepath)
-                # if file.isComplete():
-                #    newFiles.add(file)
-            # allScannedFiles.add(filepath)
+    chatExt = getConfig('internal.chatExt')
+    filename = os.path.basename(filepath)
+    if filepath in scanned.allScannedFiles:
+        return
+    filenameSegments = re.split(getConfig('internal.videoIdRegex'), filename)
+    # print(filenameSegments)
+    if len(filenameSegments) < 3:
+        return
+    assert len(filenameSegments) >= 3
+    videoId = filenameSegments[-2]
+    # print(videoId, filepath, sep=' '*8)
+    file = None
+    if videoId not in scanned.allFilesByVideoId.keys() and videoId not in scanned.pendingFilesByVideoId.keys():
+        if filename.endswith(videoExts):
+            file = SourceFile(streamer, videoId)
+            file.setVideoFile(filepath, mtime=mtime)
+            # filesBySourceVideoPath[filepath] = file
+        elif filename.endswith(infoExt):
+            try:
+                file = SourceFile(streamer, videoId, infoFile=filepath)
+            except Exception as ex:
+                logger.error(f"Unable to parse info file {filepath}")
+                logger.exception(ex)
+                return
+        else:
+            assert filename.endswith(chatExt)
+            file = SourceFile(streamer, videoId, chatFile=filepath)
+        # scanned.allFilesByVideoId[videoId] = file
+        scanned.pendingFilesByVideoId[videoId] = file
+        newStreamerFiles[videoId] = file
+    else:
+        if videoId in scanned.allFilesByVideoId.keys():
+            file = scanned.allFilesByVideoId[videoId]
+            scanned.dirtyVideoIds.add(videoId)
+        else:
+            file = scanned.pendingFilesByVideoId[videoId]
+            newStreamerFiles[videoId] = file
+        if filename.endswith(videoExts):
+            file.setVideoFile(filepath, mtime=mtime)
+            # filesBySourceVideoPath[filepath] = file
+        elif filename.endswith(infoExt):
+            try:
+                file.setInfoFile(filepath)
+            except Exception as ex:
+                logger.error(f"Unable to parse info file {filepath}")
+                logger.exception(ex)
+        else:
+            assert filename.endswith(chatExt)
+            file.setChatFile(filepath)
+            # if streamer in streamersParseChatList:
+            #    file.parsedChat = ParsedChat(filepath)
+
+
+def addScannedFiles(streamer: str, newStreamerFiles: Dict[str, 'SourceFile'], newCompleteFiles: List['SourceFile']):
+    """Moves newly completed files out of the pending set. Returns True if any incomplete files remain."""
+    count = 0
+    streamerCompleteFiles = []
+    hasIncompleteFiles = False
+    for file in reversed(list(newStreamerFiles.values())):
+        if file.isComplete():
+            if file.streamer not in scanned.allStreamersWithVideos:
+                scanned.allFilesByStreamer[file.streamer] = []
+                scanned.allStreamersWithVideos.append(file.streamer)
+            scanned.allScannedFiles.add(file.videoFile)
+            scanned.allScannedFiles.add(file.infoFile)
+            if file.chatFile is not None:
+                scanned.allScannedFiles.add(file.chatFile)
+            scanned.filesBySourceVideoPath[file.videoFile] = file
+            scanned.allFilesByVideoId[file.videoId] = file
+            del scanned.pendingFilesByVideoId[file.videoId]
+            scanned.dirtyVideoIds.add(file.videoId)
+            if scanned.latestDownloadTime is None or file.downloadTime > scanned.latestDownloadTime:
+                scanned.latestDownloadTime = file.downloadTime
             count += 1
-        count = 0
-        newCompleteFiles = []
-        for i in reversed(range(len(newStreamerFiles))):
-            file = newStreamerFiles[i]
-            if file.isComplete():
-                if file.streamer not in scanned.allStreamersWithVideos:
-                    scanned.allFilesByStreamer[file.streamer] = []
-                    scanned.allStreamersWithVideos.append(file.streamer)
-                scanned.allScannedFiles.add(file.videoFile)
-                scanned.allScannedFiles.add(file.infoFile)
-                if file.chatFile is not None:
-                    scanned.allScannedFiles.add(file.chatFile)
-                scanned.filesBySourceVideoPath[file.videoFile] = file
-                scanned.allFilesByVideoId[file.videoId] = file
-                count += 1
-                scanSessionsFromFile(file)
-                newCompleteFiles.append(file)
-                # if file.chatFile is not None and streamer in streamersParseChatList:
-                # if file.parsedChat is None:
-                #    file.parsedChat = ParsedChat(file.chatFile)
-                #    if log and count % 10 == 0:
-                #        print('.', end='')
-                #    count += 1
-                # else:
-                #    file.parsedChat = None
-                # filesBySourceVideoPath[file.videoPath] = file
-            # else:
-                # print(f"Deleting incomplete file at index {i}: {streamerFiles[i]}")
-            #    if file.videoFile is not None:
-            #        del filesBySourceVideoPath[file.videoFile]
-            #    del scanned.allFilesByVideoId[file.videoId]
-            #    del streamerFiles[i]
-        logger.info(f"Scanned streamer {streamer} with {count} files")
-        if len(newStreamerFiles) > 0:
-            if streamer not in scanned.allFilesByStreamer.keys():
-                # scanned.allStreamersWithVideos.append(streamer)
-                scanned.allFilesByStreamer[streamer] = newCompleteFiles
-            else:  # streamer already had videos scanned in
-                scanned.allFilesByStreamer[streamer].extend(newCompleteFiles)
+            scanSessionsFromFile(file)
+            streamerCompleteFiles.append(file)
+        else:
+            # Incomplete files stay pending until their other half shows up
+            hasIncompleteFiles = True
+    logger.info(f"Scanned streamer {streamer} with {count} files")
+    if len(streamerCompleteFiles) > 0:
+        if streamer not in scanned.allFilesByStreamer.keys():
+            # scanned.allStreamersWithVideos.append(streamer)
+            scanned.allFilesByStreamer[streamer] = streamerCompleteFiles
+        else:  # streamer already had videos scanned in
+            scanned.allFilesByStreamer[streamer].extend(streamerCompleteFiles)
+    newCompleteFiles.extend(streamerCompleteFiles)
+    return hasIncompleteFiles
+
+
+def parseChatFiles(files: List['SourceFile']) -> int:
+    streamersParseChatList = getConfig('main.streamersParseChatList')
+    chatFiles = [file for file in files if file.streamer in streamersParseChatList and file.chatFile is not None]
+    workerCount = getConfig('internal.chatParseWorkers')
+    if workerCount == 1 or len(chatFiles) <= 1:
+        for file in chatFiles:
+            file.tryParsingChatFile()
+        return len(chatFiles)
+    # workers don't share our scanned files or config, so they get everything they need passed in
+    knownStreamers = list(scanned.allFilesByStreamer.keys())
+    streamerAliases = getConfig('streamerAliases')
+    matcher = getPlayerMatcher(knownStreamers, streamerAliases)
+    with ProcessPoolExecutor(max_workers=workerCount if workerCount > 0 else None,
+                             initializer=initChatParseWorker,
+                             initargs=(knownStreamers, streamerAliases, matcher.cacheSize, dict(matcher.cache))) as executor:
+        # map yields results in submission order, regardless of which worker finishes first
+        allGroups = executor.map(parseChatGroups,
+                                 [file.chatFile for file in chatFiles],
+                                 [file.streamer for file in chatFiles],
+                                 repeat(knownStreamers),
+                                 repeat(streamerAliases),
+                                 repeat(getConfig('internal.chatParseMode')))
+        for file, (groups, newCacheEntries, cacheHits, cacheMisses) in zip(chatFiles, allGroups):
+            matcher.addCacheEntries(newCacheEntries, isNew=True)
+            matcher.cacheHits += cacheHits
+            matcher.cacheMisses += cacheMisses
+            file.parsedChat = ParsedChat(file, groups=groups)
+            scanned.dirtyVideoIds.add(file.videoId)
+    return len(chatFiles)
+
+
+def finishScan(newCompleteFiles: List['SourceFile']):
     #Can only parse chat files properly when all streamers have been scanned in
-    
     logger.info("Parsing new chat files")
-    parsedChatCount = 0
-    for file in newFilesByVideoId.values():
-        if file.tryParsingChatFile():
-            parsedChatCount += 1
+    parsedChatCount = parseChatFiles(newCompleteFiles)
+    cacheHits, cacheMisses, cacheEntries = getGroupMessageCacheStats()
     logger.info(f"Done parsing {parsedChatCount} new chat files")
-    
+    logger.detail(f"Group message cache: {cacheHits} hits, {cacheMisses} misses, {cacheEntries} entries")
+    if getConfig('internal.prewarmProbeCache') and len(newCompleteFiles) > 0:
+        # queued in the background, so new sessions are available without waiting on ffprobe
+        prewarmProbeCache(newCompleteFiles, wait=False)
+
     scanned.allStreamersWithVideos = list(scanned.allFilesByStreamer.keys())
     logger.info(f"Step 0: {scanned.allStreamersWithVideos}")
 
@@ -260,69 +344,186 @@ def scanFiles():
     #    scanned.allStreamerSessions[streamer].sort(key=lambda x:x.startTimestamp)
     logger.info(f"Step 1: {sum((len(x) for x in scanned.allStreamerSessions.values()))}")
 
+
+def scanFiles():
+    basepath = getConfig('main.basepath')
+    outputDirectory = getConfig('main.outputDirectory')
+    scannedExts = getScannedExts()
+    newCompleteFiles: List[SourceFile] = []
+    with os.scandir(basepath) as basepathEntries:
+        globalAllStreamers = [entry.name for entry in basepathEntries if
+                          (entry.name not in ("NA", outputDirectory) and 
+                           entry.is_dir())]
+    for streamer in sorted(globalAllStreamers):
+        streamerBasePath = os.path.join(basepath, streamer, 'S1')
+        # stat before listing, so anything added mid-scan changes the mtime and forces another pass
+        dirStat = os.stat(streamerBasePath)
+        journalKey = (dirStat.st_ino, dirStat.st_mtime_ns)
+        if scanned.scannedDirectoryJournal.get(streamerBasePath) == journalKey:
+            logger.debug(f"Skipping unchanged streamer directory {streamerBasePath}")
+            continue
+        logger.info(f"Scanning streamer {streamer} ")
+        newStreamerFiles: Dict[str, SourceFile] = {}
+        with os.scandir(streamerBasePath) as streamerEntries:
+            entries = [entry for entry in streamerEntries if entry.name.endswith(scannedExts)]
+        for entry in entries:
+            scanSingleFile(streamer, entry.path, entry.stat().st_mtime, newStreamerFiles)
+        hasIncompleteFiles = addScannedFiles(streamer, newStreamerFiles, newCompleteFiles)
+        # Incomplete files are dropped until their other half shows up, so keep rescanning their directory
+        if hasIncompleteFiles:
+            scanned.scannedDirectoryJournal.pop(streamerBasePath, None)
+        else:
+            scanned.scannedDirectoryJournal[streamerBasePath] = journalKey
+    finishScan(newCompleteFiles)
+
+
+def scanPaths(paths: List[str]):
+    """Scans only the given file paths, e.g. from a DirectoryWatcher, instead of walking every streamer folder"""
+    basepath = getConfig('main.basepath')
+    scannedExts = getScannedExts()
+    pathsByStreamer: Dict[str, List[str]] = {}
+    for path in paths:
+        relpath = os.path.relpath(path, basepath)
+        parts = relpath.split(os.sep)
+        if len(parts) != 3 or parts[1] != 'S1' or not parts[2].endswith(scannedExts):
+            logger.debug(f"Ignoring path outside of streamer folders: {path}")
+            continue
+        pathsByStreamer.setdefault(parts[0], []).append(path)
+    newCompleteFiles: List[SourceFile] = []
+    for streamer in sorted(pathsByStreamer.keys()):
+        logger.info(f"Scanning {len(pathsByStreamer[streamer])} changed files for streamer {streamer}")
+        newStreamerFiles: Dict[str, SourceFile] = {}
+        for path in pathsByStreamer[streamer]:
+            try:
+                mtime = os.path.getmtime(path)
+            except FileNotFoundError:
+                # moved or deleted again before we got to it
+                continue
+            scanSingleFile(streamer, path, mtime, newStreamerFiles)
+        addScannedFiles(streamer, newStreamerFiles, newCompleteFiles)
+    finishScan(newCompleteFiles)
+
+def saveFileToCatalog(file: 'SourceFile'):
+    # chat groups are only rewritten if they were parsed (or loaded) in this run
+    chatGroups = None
+    if file._parsedChat is not None:
+        chatGroups = [(group['time'].isoformat(), group['group']) for group in file._parsedChat.groups]
+    FileCatalog.saveFile(file.videoId, file.streamer, file.videoFile, file.infoFile, file.chatFile,
+                         file.startTimestamp, file.endTimestamp, file.duration, file.downloadTime.timestamp(),
+                         file._infoJson, file.chapters, chatGroups)
+
+
 def saveFiledata(filepath: str):
-    logger.info("Starting pickle dump")
-    with open(filepath, 'wb') as file:
-        pickle.dump(scanned.allFilesByVideoId, file)
-        logger.info("Pickle dump successful")
+    FileCatalog.openCatalog(filepath)
+    with FileCatalog.catalogLock:
+        dirtyVideoIds = set(scanned.dirtyVideoIds)
+        scanned.dirtyVideoIds.difference_update(dirtyVideoIds)
+        logger.info(f"Saving {len(dirtyVideoIds)} changed files to catalog")
+        try:
+            for videoId in sorted(dirtyVideoIds):
+                if videoId in scanned.allFilesByVideoId.keys():
+                    saveFileToCatalog(scanned.allFilesByVideoId[videoId])
+            # same transaction as the file data, so the journal never claims a directory the catalog is missing
+            FileCatalog.saveDirectories(scanned.scannedDirectoryJournal)
+            newCacheEntries = takeNewGroupMessageCacheEntries()
+            if newCacheEntries is not None:
+                FileCatalog.saveGroupMessages(*newCacheEntries)
+            FileCatalog.commit()
+        except:
+            FileCatalog.rollback()
+            FileCatalog.loadDirectories()
+            scanned.dirtyVideoIds.update(dirtyVideoIds)
+            raise
+        logger.info("Catalog save successful")
 
 
-def loadFiledata(filepath: str):  # suppresses all errors
+def clearScannedData():
+    scanned.allFilesByVideoId = {}
+    scanned.allFilesByStreamer = {}  # string:[SourceFile]
+    scanned.allStreamersWithVideos = []
+    scanned.allStreamerSessions = {}
+    scanned.sessionIndex = SessionIndex()
+    clearRenderPlanCache()
+    scanned.allScannedFiles = set()
+    scanned.filesBySourceVideoPath = {}
+    scanned.pendingFilesByVideoId = {}
+    scanned.dirtyVideoIds = set()
+    scanned.latestDownloadTime = None
+    scanned.scannedDirectoryJournal = {}
+
+
+def addLoadedFiles(filesByVideoId: Dict[str, 'SourceFile']):
+    scanned.allFilesByVideoId = filesByVideoId
+    for file in scanned.allFilesByVideoId.values():
+        scanned.filesBySourceVideoPath[file.videoFile] = file
+        if scanned.latestDownloadTime is None or file.downloadTime > scanned.latestDownloadTime:
+            scanned.latestDownloadTime = file.downloadTime
+    for file in sorted(scanned.allFilesByVideoId.values(), key=lambda x: x.startTimestamp):
+        if file.streamer not in scanned.allStreamersWithVideos:
+            scanned.allFilesByStreamer[file.streamer] = []
+            scanned.allStreamersWithVideos.append(file.streamer)
+        scanSessionsFromFile(file)
+        scanned.allFilesByStreamer[file.streamer].append(file)
+        scanned.allScannedFiles.add(file.videoFile)
+        scanned.allScannedFiles.add(file.infoFile)
+        if file.chatFile is not None:
+            scanned.allScannedFiles.add(file.chatFile)
+
+
+def migrateLegacyFiledata(legacyFilepath: str):
     try:
-        with open(filepath, 'rb') as file:
-            logger.info("Starting pickle load...")
-            pickleData = pickle.load(file)
-            scanned.allFilesByVideoId = pickleData
-            scanned.allFilesByStreamer = {}  # string:[SourceFile]
-            scanned.allStreamersWithVideos = []
-            scanned.allStreamerSessions = {}
-            scanned.allScannedFiles = set()
-            scanned.filesBySourceVideoPath = {}
-            for file in scanned.allFilesByVideoId.values():
-                scanned.filesBySourceVideoPath[file.videoFile] = file
-            for file in sorted(scanned.allFilesByVideoId.values(), key=lambda x: x.startTimestamp):
-                if file.streamer not in scanned.allStreamersWithVideos:
-                    scanned.allFilesByStreamer[file.streamer] = []
-                    scanned.allStreamersWithVideos.append(file.streamer)
-                scanSessionsFromFile(file)
-                scanned.allFilesByStreamer[file.streamer].append(file)
-                scanned.allScannedFiles.add(file.videoFile)
-                scanned.allScannedFiles.add(file.infoFile)
-                if file.chatFile is not None:
-                    scanned.allScannedFiles.add(file.chatFile)
-            logger.info("Pickle load successful")
+        with open(legacyFilepath, 'rb') as file:
+            logger.info(f"Migrating legacy data file {legacyFilepath} into the file catalog...")
+            legacyFiles = pickle.load(file)
     except FileNotFoundError:
-        logger.warning("Pickle load failed due to missing file, this is not an issue for the first run or if the file has been deleted")
+        logger.warning("File catalog is empty, this is not an issue for the first run or if the catalog has been deleted")
+        return
+    addLoadedFiles(legacyFiles)
+    scanned.dirtyVideoIds.update(legacyFiles.keys())
+    saveFiledata(FileCatalog.catalogFilepath)
+    logger.info(f"Migrated {len(legacyFiles)} files, {legacyFilepath} is no longer used and can be deleted")
+
+
+def loadFiledata(filepath: str):  # suppresses all errors
+    clearScannedData()
+    try:
+        FileCatalog.openCatalog(filepath)
+        if FileCatalog.getFileCount() == 0:
+            migrateLegacyFiledata(getConfig('main.dataFilepath'))
+            return
+        logger.info("Starting catalog load...")
+        chaptersByVideoId = FileCatalog.loadAllChapters()
+        loadedFiles = {}
+        for row in FileCatalog.loadFileRows():
+            loadedFiles[row['videoId']] = SourceFile.fromCatalogRow(row, chaptersByVideoId.get(row['videoId'], []))
+        addLoadedFiles(loadedFiles)
+        scanned.scannedDirectoryJournal = FileCatalog.loadDirectories()
+        logger.info(f"Catalog load successful, loaded {len(loadedFiles)} files")
     except Exception as ex:
-        logger.error("Pickle load failed! Exception:")
+        logger.error("Catalog load failed! Exception:")
         logger.error(ex)
+        clearScannedData()
 
 
 def initialize():
-    dataFilepath = getConfig('main.dataFilepath')
+    catalogFilepath = getConfig('main.catalogFilepath')
     if len(scanned.allFilesByVideoId) == 0:
-        loadFiledata(dataFilepath)
-    oldCount = len(scanned.allFilesByVideoId)
+        loadFiledata(catalogFilepath)
     scanFiles()
-    if len(scanned.allFilesByVideoId) != oldCount:
-        saveFiledata(dataFilepath)
+    saveFiledata(catalogFilepath)
 
 
 def reinitialize():
-    dataFilepath = getConfig('main.dataFilepath')
+    catalogFilepath = getConfig('main.catalogFilepath')
     scanned.allFilesByVideoId = {}
-    loadFiledata(dataFilepath)
+    loadFiledata(catalogFilepath)
     initialize()
 
 
 def reloadAndSave():
-    dataFilepath = getConfig('main.dataFilepath')
-    scanned.allFilesByVideoId = {}
-    scanned.allFilesByStreamer = {}  # string:[SourceFile]
-    scanned.allStreamersWithVideos = []
-    scanned.allStreamerSessions = {}
-    scanned.allScannedFiles = set()
-    scanned.filesBySourceVideoPath = {}
+    catalogFilepath = getConfig('main.catalogFilepath')
+    FileCatalog.openCatalog(catalogFilepath)
+    FileCatalog.clearCatalog()
+    clearScannedData()
     scanFiles()
-    saveFiledata(dataFilepath)
-
+    saveFiledata(catalogFilepath)
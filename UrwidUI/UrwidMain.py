@@ -8,6 +8,7 @@ COPY_FILES = getConfig('main.copyFiles')
 ENABLE_URWID = getConfig('internal.ENABLE_URWID')
 
 from RenderWorker import endRendersAndExit, renderThread, renderThreadStarted, startRenderThread
+from RenderTelemetry import formatRenderProgress
 if COPY_FILES:
     from CopyWorker import copyThread
 
@@ -73,7 +74,7 @@ def urwidUiMain():
         ).keys() else exit_program),
         InfoChoice('Start render thread', renderThreadChoice,
                 RenderThreadStatusString()),
-        # InfoChoice('Print active jobs', activeJobsChoice, ),
+        InfoChoice('Render progress', HorizontalBoxes.closeTopBox, formatRenderProgress),
         # InfoChoice('Print queued jobs'),
         # InfoChoice('Print completed jobs'),
         # InfoChoice('Print errored jobs'),
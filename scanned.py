@@ -1,4 +1,7 @@
-from typing import Dict, List, Set, TYPE_CHECKING
+from datetime import datetime
+from typing import Dict, List, Set, Tuple, TYPE_CHECKING
+
+from SessionIndex import SessionIndex
 
 if TYPE_CHECKING:
     from SourceFile import SourceFile
@@ -11,5 +14,14 @@ allFilesByVideoId: Dict[str, 'SourceFile'] = {}  # string:SourceFile
 allFilesByStreamer: Dict[str, 'SourceFile'] = {}  # string:[SourceFile]
 allStreamersWithVideos: List[str] = []
 allStreamerSessions: Dict[str, List['Session']] = {}
+# the same sessions, indexed for time range queries
+sessionIndex: SessionIndex = SessionIndex()
 allScannedFiles: Set[str] = set()
-filesBySourceVideoPath: Dict[str, 'SourceFile'] = {}
\ No newline at end of file
+filesBySourceVideoPath: Dict[str, 'SourceFile'] = {}
+# streamer S1 folder path -> (inode, mtime_ns) as of its last complete scan
+scannedDirectoryJournal: Dict[str, Tuple[int, int]] = {}
+# files missing their video or info file, kept between scans until the other half shows up
+pendingFilesByVideoId: Dict[str, 'SourceFile'] = {}
+latestDownloadTime: datetime | None = None
+# video ids whose catalog rows are out of date
+dirtyVideoIds: Set[str] = set()
@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fuzzysearch import find_near_matches
+
+import scanned
+from MTRConfig import getConfig
+from ParsedChat import PlayerMatcher, iterateCandidateComments
+from SourceFile import initialize
+
+MAX_MESSAGES = 5000
+
+initialize()
+
+# The matching loop as it was before PlayerMatcher, for comparison
+def parsePlayersNaive(message, knownStreamers, streamerAliases):
+    players = []
+    messageLowercase = message.lower()
+    for streamer in knownStreamers:
+        fuzzymatches = find_near_matches(
+            streamer.lower(), messageLowercase, max_l_dist=len(streamer)//5)
+        if len(fuzzymatches) > 0:
+            players.append(streamer)
+        elif streamer in streamerAliases.keys():
+            for alias in streamerAliases[streamer]:
+                fuzzymatches = find_near_matches(
+                    alias.lower(), messageLowercase, max_l_dist=len(alias)//5)
+                if len(fuzzymatches) > 0:
+                    players.append(streamer)
+                    break
+    return players
+
+# PlayerMatcher returns players in sorted order, give the naive version the same order to compare against
+knownStreamers = sorted(scanned.allFilesByStreamer.keys())
+streamerAliases = getConfig('streamerAliases')
+
+# Collect real Nightbot !who replies
+messages = []
+for streamer in getConfig('main.streamersParseChatList'):
+    for file in scanned.allFilesByStreamer.get(streamer, []):
+        if file.chatFile is None:
+            continue
+        for comment in iterateCandidateComments(file.chatFile):
+            commenter = comment['commenter']
+            if commenter is not None and commenter['displayName'] == 'Nightbot':
+                messages.append(" ".join((frag['text'] for frag in comment['message']['fragments'])))
+        if len(messages) >= MAX_MESSAGES:
+            break
+messages = messages[:MAX_MESSAGES]
+print(f"Benchmarking {len(messages)} Nightbot messages against {len(knownStreamers)} streamers")
+
+startTime = time.perf_counter()
+naiveResults = [parsePlayersNaive(message, knownStreamers, streamerAliases) for message in messages]
+naiveTime = time.perf_counter() - startTime
+print(f"Naive: {naiveTime:.3f}s")
+
+startTime = time.perf_counter()
+matcher = PlayerMatcher(knownStreamers, streamerAliases)
+buildTime = time.perf_counter() - startTime
+matcherResults = [matcher.findPlayers(message) for message in messages]
+matcherTime = time.perf_counter() - startTime
+print(f"PlayerMatcher: {matcherTime:.3f}s (of which {buildTime:.4f}s building)")
+
+mismatches = [(message, naive, matched) for message, naive, matched in zip(messages, naiveResults, matcherResults) if naive != matched]
+for mismatch in mismatches[:10]:
+    print("Mismatch:", mismatch)
+assert len(mismatches) == 0, f"{len(mismatches)} messages matched differently"
+print(f"Results identical, speedup {naiveTime / max(matcherTime, 1e-9):.1f}x")
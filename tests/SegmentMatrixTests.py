@@ -0,0 +1,89 @@
+import os
+import random
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from ParsedChat import ParsedChat
+from SegmentMatrix import buildSegmentMatrices, buildSegmentMatricesLegacy
+from Session import Session
+
+# Differential test: the vectorized segment matrix has to match the original per-segment loop exactly
+TRIALS = 300
+GAMES = ('Just Chatting', 'Minecraft', 'Lethal Company')
+random.seed(12345)
+
+
+class FakeFile:
+    def __init__(self, streamer, startTimestamp, endTimestamp):
+        self.streamer = streamer
+        self.startTimestamp = startTimestamp
+        self.endTimestamp = endTimestamp
+        self.parsedChat = None
+
+    def __repr__(self):
+        return f"FakeFile({self.streamer}, {self.startTimestamp}, {self.endTimestamp})"
+
+
+def randomTimestamp(dayStart):
+    timestamp = dayStart + random.randint(0, 24*60) * 60
+    return timestamp + random.choice((0, 0, 0.5))  # chapter offsets are often fractional
+
+
+def makeSessions(streamer, streamers, dayStart):
+    sessions = []
+    fileStart = randomTimestamp(dayStart)
+    for _ in range(random.randint(1, 2)):
+        fileEnd = fileStart + random.randint(10, 8*60) * 60
+        file = FakeFile(streamer, fileStart, fileEnd)
+        if random.random() < 0.5:
+            groups = []
+            for _ in range(random.randint(0, 6)):
+                groupTime = datetime.fromtimestamp(random.uniform(fileStart - 3600, fileEnd), timezone.utc)
+                groups.append({'time': groupTime, 'group': random.sample(streamers, random.randint(0, len(streamers)))})
+            groups.sort(key=lambda x: x['time'])
+            file.parsedChat = ParsedChat(file, groups=groups)
+        chapterStart = fileStart
+        while chapterStart < fileEnd:
+            chapterEnd = min(fileEnd, chapterStart + random.randint(5, 4*60) * 60)
+            sessions.append(Session(file, random.choice(GAMES), chapterStart, chapterEnd))
+            chapterStart = chapterEnd
+        fileStart = fileEnd + random.randint(1, 120) * 60
+    return sessions
+
+
+def matricesEqual(expected, actual):
+    if len(expected) != len(actual):
+        return False
+    for expectedRow, actualRow in zip(expected, actual):
+        for expectedItem, actualItem in zip(expectedRow, actualRow):
+            if isinstance(expectedItem, list) and isinstance(actualItem, list):
+                if [id(x) for x in expectedItem] != [id(x) for x in actualItem]:
+                    return False
+            elif expectedItem is not actualItem:
+                return False
+    return True
+
+
+dayStart = datetime(2024, 3, 1, tzinfo=timezone.utc).timestamp()
+for trial in range(TRIALS):
+    streamers = [f"streamer{i}" for i in range(random.randint(2, 16))]
+    sessionsByStreamer = {streamer: makeSessions(streamer, streamers, dayStart) for streamer in streamers}
+    mainSessions = sessionsByStreamer[streamers[0]]
+    timestamps = set()
+    for sessions in sessionsByStreamer.values():
+        for session in sessions:
+            timestamps.add(session.startTimestamp)
+            timestamps.add(session.endTimestamp)
+    for _ in range(random.randint(0, 10)):
+        timestamps.add(randomTimestamp(dayStart))
+    mainStart = mainSessions[0].startTimestamp
+    mainEnd = mainSessions[-1].endTimestamp
+    uniqueTimestampsSorted = sorted((x for x in timestamps if mainStart <= x <= mainEnd))
+    for useChat in (True, False):
+        expected = buildSegmentMatricesLegacy(uniqueTimestampsSorted, streamers, sessionsByStreamer, mainSessions, useChat)
+        actual = buildSegmentMatrices(uniqueTimestampsSorted, streamers, sessionsByStreamer, mainSessions, useChat)
+        assert matricesEqual(expected[0], actual[0]), f"File matrix mismatch in trial {trial}, {useChat=}"
+        assert matricesEqual(expected[1], actual[1]), f"Session matrix mismatch in trial {trial}, {useChat=}"
+print(f"{TRIALS} trials identical")
@@ -148,7 +148,7 @@ pprint([targetGroups[i] for i in range(len(targetGroups)) if i == 0 or set(targe
 #print(uniqueFiles, end='\n\n')
 
 
-saveFiledata(getConfig('main.dataFilepath'))
+saveFiledata(getConfig('main.catalogFilepath'))
 
 
 # %%